@@ -1,11 +1,64 @@
 # agents/ai_base.py
 
 from abc import ABC, abstractmethod
+import json
+import time
+import asyncio
+import hashlib
 import logging
-from openai import OpenAI, APIError  # Более конкретный импорт ошибки
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Union
+from openai import OpenAI, AsyncOpenAI, APIError  # Более конкретный импорт ошибки
+from openai import APIConnectionError, APIStatusError
+
+from services.cache import shared_get
+from services.rate_limiter import ModelRateLimiter
+from services.resilience import DeadlineExceeded, LatencyTracker, RetryPolicy, remaining
+from services.tokens import TokenCounter, record_tokens
+from services.metrics import LLM_REQUEST_DURATION, LLM_REQUESTS, LLM_TOKENS
+from services.tracing import REQUEST_ID_HEADER, current_request_id, span
 
 logger = logging.getLogger(__name__)
 
+# Промпт: строка (одно сообщение пользователя) или готовый список сообщений чата
+Prompt = Union[str, List[Dict[str, str]]]
+
+
+def to_messages(prompt: Prompt) -> List[Dict[str, str]]:
+    """Приводит промпт к списку сообщений чата."""
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    return list(prompt)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Ошибки, после которых имеет смысл повторить запрос: сеть, таймаут, 408/409/429 и 5xx."""
+    if isinstance(error, DeadlineExceeded):
+        # Начиная с Python 3.11 это подкласс asyncio.TimeoutError, но повторять его бессмысленно
+        return False
+    if isinstance(error, (APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Задержка из заголовка Retry-After ответа об ошибке (в секундах), если он есть."""
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _usage_value(usage, *path: str) -> int:
+    """Достает счетчик токенов из usage ответа API (0, если поля нет)."""
+    value = usage
+    for name in path:
+        value = getattr(value, name, None)
+    return value if isinstance(value, int) else 0
+
 class LLMClient(ABC):
     """
     Абстрактный базовый класс для клиентов, взаимодействующих с API языковых моделей.
@@ -68,4 +121,496 @@ class LLMGenerator(LLMClient):
             raise RuntimeError(f"OpenAI API error: {e}")
         except Exception as e:
             logger.error(f"Неожиданная ошибка при работе с LLM: {e}")
-            raise RuntimeError(f"Unexpected error in LLM generation: {e}")
\ No newline at end of file
+            raise RuntimeError(f"Unexpected error in LLM generation: {e}")
+
+
+class AsyncLLMClient(ABC):
+    """
+    Абстрактный базовый класс для асинхронных клиентов языковых моделей.
+
+    В отличие от LLMClient, метод generate является корутиной, поэтому вызов
+    модели не блокирует цикл событий и один воркер может одновременно
+    обслуживать множество запросов.
+    """
+
+    @abstractmethod
+    async def generate(self, prompt: Prompt, use_cache: bool = True, **kwargs) -> str:
+        """
+        Асинхронно генерирует ответ от LLM на основе предоставленного промпта.
+
+        :param prompt: Строка запроса для модели или список сообщений чата.
+        :param use_cache: Разрешить ответ из кеша (учитывается кеширующими клиентами).
+        :param kwargs: Дополнительные параметры для запроса (model, temperature и т.д.).
+        :return: Ответ модели в виде строки.
+        """
+        pass
+
+    async def __call__(self, prompt: Prompt, **kwargs) -> str:
+        """
+        Позволяет использовать объект класса как асинхронную функцию.
+
+        :param prompt: Строка запроса для модели или список сообщений чата.
+        :param kwargs: Дополнительные параметры для клиента AI.
+        :return: Ответ модели в виде строки.
+        """
+        return await self.generate(prompt, **kwargs)
+
+    async def stream(self, prompt: Prompt, **kwargs) -> AsyncIterator[str]:
+        """
+        Генерирует ответ по частям по мере получения токенов от модели.
+
+        Реализация по умолчанию отдает ответ generate() одним фрагментом;
+        клиенты с поддержкой потоковой передачи переопределяют метод.
+
+        :param prompt: Строка запроса для модели или список сообщений чата.
+        :param kwargs: Дополнительные параметры для запроса.
+        :return: Асинхронный итератор фрагментов ответа.
+        """
+        yield await self.generate(prompt, **kwargs)
+
+    async def generate_many(self,
+                            prompts: Sequence[Prompt],
+                            max_concurrency: int = 8,
+                            return_exceptions: bool = False,
+                            **kwargs) -> List[Union[str, BaseException]]:
+        """
+        Выполняет несколько запросов к модели параллельно.
+
+        Одновременно выполняется не более max_concurrency запросов; лимиты
+        провайдера (RPM/TPM) соблюдает сам клиент в generate(). Результаты
+        возвращаются в порядке промптов.
+
+        :param prompts: Промпты (строки или списки сообщений).
+        :param max_concurrency: Максимальное число одновременных запросов.
+        :param return_exceptions: Возвращать исключения на месте результатов;
+                                  иначе первая ошибка отменяет остальные запросы.
+        :param kwargs: Параметры запроса, общие для всех промптов (model, temperature и т.д.).
+        :return: Список ответов в порядке промптов.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def generate_one(prompt: Prompt) -> str:
+            async with semaphore:
+                return await self.generate(prompt, **kwargs)
+
+        tasks = [asyncio.ensure_future(generate_one(prompt)) for prompt in prompts]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def usage_metrics(self) -> dict:
+        """Возвращает накопленный учет токенов по ответам API (если клиент его ведет)."""
+        return {}
+
+    async def aclose(self):
+        """Освобождает ресурсы клиента. По умолчанию ничего не делает."""
+        pass
+
+
+class AsyncLLMGenerator(AsyncLLMClient):
+    """
+    Асинхронная реализация клиента для работы с OpenAI-совместимым API.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 base_url: str = "https://api.vsegpt.ru:7090/v1",
+                 stream_usage: bool = False,
+                 rate_limiter: Optional[ModelRateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 call_timeout: Optional[float] = None,
+                 hedge_quantile: float = 0.0,
+                 latency_tracker: Optional[LatencyTracker] = None):
+        """
+        Инициализирует клиент.
+
+        :param api_key: API ключ для доступа к сервису.
+        :param base_url: Базовый URL API.
+        :param stream_usage: Запрашивать usage в потоковом режиме (stream_options.include_usage);
+                             включайте, только если провайдер поддерживает этот параметр.
+        :param rate_limiter: Лимиты провайдера по моделям (None — без ограничений).
+        :param retry_policy: Повторы при временных ошибках (по умолчанию 2 повтора, как в SDK).
+        :param call_timeout: Таймаут одной попытки в секундах (None — только дедлайн запроса).
+        :param hedge_quantile: Квантиль длительности, после которого отправляется дублирующий
+                               запрос (например, 0.95; 0 — без дублирования).
+        :param latency_tracker: Окно длительностей вызовов для оценки квантиля.
+        """
+        # Повторы выполняет клиент с учетом дедлайна запроса, а не SDK
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.stream_usage = stream_usage
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.call_timeout = call_timeout
+        self.hedge_quantile = hedge_quantile
+        self.latency = latency_tracker or LatencyTracker()
+        self._counters: Dict[str, TokenCounter] = {}
+        self.usage_stats = {"calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0}
+        self.resilience_stats = {"retries": 0, "timeouts": 0, "hedged": 0, "hedge_wins": 0}
+
+    def _record_usage(self, usage, model: Optional[str]):
+        """
+        Учитывает токены ответа API: входные из кеша провайдера, остальные входные и выходные.
+
+        Счетчики копятся в usage_stats и в учете токенов текущего запроса
+        (AgentMemory.token_usage) под ключами provider_*.
+        """
+        if usage is None:
+            return
+        prompt_tokens = _usage_value(usage, "prompt_tokens")
+        cached_tokens = _usage_value(usage, "prompt_tokens_details", "cached_tokens")
+        completion_tokens = _usage_value(usage, "completion_tokens")
+
+        self.usage_stats["calls"] += 1
+        self.usage_stats["prompt_tokens"] += prompt_tokens
+        self.usage_stats["cached_prompt_tokens"] += cached_tokens
+        self.usage_stats["completion_tokens"] += completion_tokens
+        record_tokens("provider_prompt", prompt_tokens)
+        record_tokens("provider_cached_prompt", cached_tokens)
+        record_tokens("provider_completion", completion_tokens)
+        LLM_TOKENS.inc(prompt_tokens - cached_tokens, model=model or "", kind="prompt")
+        LLM_TOKENS.inc(cached_tokens, model=model or "", kind="cached_prompt")
+        LLM_TOKENS.inc(completion_tokens, model=model or "", kind="completion")
+        logger.debug(f"LLM {model}: входных токенов {prompt_tokens} (из кеша {cached_tokens}, "
+                     f"без кеша {prompt_tokens - cached_tokens}), выходных {completion_tokens}")
+
+    async def _throttle(self, prompt: Prompt, kwargs: dict):
+        """Дожидается, пока запрос уложится в RPM/TPM-лимиты модели."""
+        if self.rate_limiter is None:
+            return
+        model = kwargs.get("model", "")
+        counter = self._counters.get(model)
+        if counter is None:
+            counter = self._counters[model] = TokenCounter(model)
+        # Провайдеры резервируют под запрос промпт и max_tokens ответа
+        tokens = counter.count(prompt) + (kwargs.get("max_tokens") or 0)
+        await self.rate_limiter.acquire(model, tokens)
+
+    def _attempt_timeout(self) -> Optional[float]:
+        """Таймаут очередной попытки: call_timeout, ограниченный оставшимся временем запроса."""
+        left = remaining()
+        if left is None:
+            return self.call_timeout
+        if left <= 0:
+            raise DeadlineExceeded("Истек бюджет времени запроса к LLM")
+        return min(self.call_timeout, left) if self.call_timeout else left
+
+    async def _with_retries(self, make_call, before_attempt=None):
+        """
+        Выполняет вызов с таймаутом попытки и повторами временных ошибок.
+
+        Задержка между попытками растет экспоненциально; повтор не выполняется,
+        если после задержки не останется времени до дедлайна.
+
+        :param make_call: Функция без аргументов, возвращающая корутину вызова API.
+        :param before_attempt: Функция без аргументов, возвращающая корутину, которая
+                               ожидается перед каждой попыткой (например, _throttle:
+                               повтор после 429 тоже расходует лимиты провайдера).
+        :raises DeadlineExceeded: Если дедлайн истек до или во время вызова.
+        """
+        attempt = 0
+        while True:
+            if before_attempt is not None:
+                await before_attempt()
+            timeout = self._attempt_timeout()
+            # Таймаут попытки задан дедлайном запроса или этапа, а не call_timeout
+            capped = timeout is not None and (not self.call_timeout or timeout < self.call_timeout)
+            try:
+                return await asyncio.wait_for(make_call(), timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                error = e
+            if isinstance(error, asyncio.TimeoutError):
+                self.resilience_stats["timeouts"] += 1
+                # После wait_for по дедлайну remaining() может остаться чуть больше нуля
+                left = remaining()
+                if capped or (left is not None and left <= 0):
+                    raise DeadlineExceeded("Истек бюджет времени запроса к LLM") from error
+            if attempt >= self.retry_policy.max_retries:
+                raise error
+            delay = self.retry_policy.delay(attempt, _retry_after(error))
+            left = remaining()
+            if left is not None and delay >= left:
+                raise error
+            attempt += 1
+            self.resilience_stats["retries"] += 1
+            logger.warning(f"Временная ошибка LLM ({error!r}), повтор {attempt} через {delay:.2f} с")
+            await asyncio.sleep(delay)
+
+    async def _create(self, messages: List[Dict[str, str]], kwargs: dict):
+        """Один вызов API с замером длительности."""
+        request_id = current_request_id()
+        if request_id:
+            kwargs = {**kwargs, "extra_headers": {**kwargs.get("extra_headers", {}), REQUEST_ID_HEADER: request_id}}
+        started_at = time.monotonic()
+        with span("llm.create", model=kwargs.get("model", "")):
+            response = await self.client.chat.completions.create(messages=messages, **kwargs)
+        elapsed = time.monotonic() - started_at
+        self.latency.observe(kwargs.get("model", ""), elapsed)
+        LLM_REQUEST_DURATION.observe(elapsed, model=kwargs.get("model", ""))
+        return response
+
+    async def _hedged_create(self, messages: List[Dict[str, str]], kwargs: dict):
+        """
+        Вызов API с дублированием: если ответ не пришел за квантиль hedge_quantile
+        длительности модели, отправляется второй такой же запрос, и используется
+        первый успешный ответ. Незавершенный запрос отменяется.
+        """
+        delay = self.latency.quantile(kwargs.get("model", ""), self.hedge_quantile) if self.hedge_quantile else None
+        if delay is None:
+            return await self._create(messages, kwargs)
+
+        tasks = [asyncio.ensure_future(self._create(messages, kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.resilience_stats["hedged"] += 1
+                tasks.append(asyncio.ensure_future(self._create(messages, kwargs)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.resilience_stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Дожидаемся отмены проигравших запросов, чтобы их ошибки не остались неполученными
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def usage_metrics(self) -> dict:
+        """Возвращает накопленный учет токенов и долю входных токенов из кеша провайдера."""
+        prompt_tokens = self.usage_stats["prompt_tokens"]
+        metrics = {
+            **self.usage_stats,
+            "uncached_prompt_tokens": prompt_tokens - self.usage_stats["cached_prompt_tokens"],
+            "cached_prompt_ratio": self.usage_stats["cached_prompt_tokens"] / prompt_tokens if prompt_tokens else 0.0,
+        }
+        if self.rate_limiter is not None:
+            metrics["rate_limiter"] = self.rate_limiter.metrics()
+        metrics["resilience"] = dict(self.resilience_stats)
+        return metrics
+
+    async def generate(self, prompt: Prompt, use_cache: bool = True, **kwargs) -> str:
+        """
+        Асинхронно отправляет запрос к API и возвращает сгенерированный текст.
+
+        :param prompt: Строка запроса для модели или список сообщений чата.
+        :param use_cache: Не используется: клиент не кеширует ответы.
+        :param kwargs: Дополнительные параметры для запроса (model, temperature, max_tokens и т.д.).
+        :return: Ответ модели в виде строки.
+        :raises RuntimeError: В случае ошибки API (после исчерпания повторов).
+        :raises DeadlineExceeded: Если истек бюджет времени запроса.
+        """
+        messages = to_messages(prompt)
+        try:
+            response = await self._with_retries(
+                lambda: self._hedged_create(messages, kwargs), lambda: self._throttle(messages, kwargs)
+            )
+            self._record_usage(getattr(response, "usage", None), kwargs.get("model"))
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="ok")
+            return response.choices[0].message.content
+        except DeadlineExceeded:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="deadline")
+            logger.error(f"Истек бюджет времени запроса к LLM {kwargs.get('model')}")
+            raise
+        except asyncio.TimeoutError as e:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="error")
+            logger.error(f"Таймаут запроса к LLM: {e!r}")
+            raise RuntimeError(f"OpenAI API timeout: {e!r}")
+        except APIError as e:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="error")
+            logger.error(f"Ошибка API при обращении к LLM: {e}")
+            raise RuntimeError(f"OpenAI API error: {e}")
+        except Exception as e:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="error")
+            logger.error(f"Неожиданная ошибка при работе с LLM: {e}")
+            raise RuntimeError(f"Unexpected error in LLM generation: {e}")
+
+    async def stream(self, prompt: Prompt, use_cache: bool = True, **kwargs) -> AsyncIterator[str]:
+        """
+        Запрашивает потоковую генерацию и отдает текст по мере поступления токенов.
+
+        :param prompt: Строка запроса для модели или список сообщений чата.
+        :param use_cache: Не используется: клиент не кеширует ответы.
+        :param kwargs: Дополнительные параметры для запроса (model, temperature, max_tokens и т.д.).
+        :return: Асинхронный итератор фрагментов ответа.
+        :raises RuntimeError: В случае ошибки API.
+        """
+        messages = to_messages(prompt)
+        if self.stream_usage:
+            # usage приходит последним фрагментом с пустым списком choices
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        try:
+            # Повторы и дедлайн относятся к открытию потока; начатый поток не повторяется
+            response = await self._with_retries(lambda: self.client.chat.completions.create(
+                messages=messages,
+                stream=True,
+                **kwargs
+            ), lambda: self._throttle(messages, kwargs))
+            async for chunk in response:
+                if self.stream_usage and getattr(chunk, "usage", None) is not None:
+                    self._record_usage(chunk.usage, kwargs.get("model"))
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="ok")
+        except DeadlineExceeded:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="deadline")
+            logger.error(f"Истек бюджет времени потокового запроса к LLM {kwargs.get('model')}")
+            raise
+        except asyncio.TimeoutError as e:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="error")
+            logger.error(f"Таймаут потокового запроса к LLM: {e!r}")
+            raise RuntimeError(f"OpenAI API timeout: {e!r}")
+        except APIError as e:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="error")
+            logger.error(f"Ошибка API при потоковом обращении к LLM: {e}")
+            raise RuntimeError(f"OpenAI API error: {e}")
+        except Exception as e:
+            LLM_REQUESTS.inc(model=kwargs.get("model", ""), outcome="error")
+            logger.error(f"Неожиданная ошибка при потоковой генерации LLM: {e}")
+            raise RuntimeError(f"Unexpected error in LLM streaming: {e}")
+
+    async def aclose(self):
+        """Закрывает пул HTTP-соединений клиента."""
+        await self.client.close()
+
+
+class MemoizedLLMClient(AsyncLLMClient):
+    """
+    Кеширующая обертка над асинхронным LLM-клиентом.
+
+    Ключ кеша — хеш от (model, prompt, temperature, max_tokens). Первый уровень —
+    ограниченный in-memory LRU, второй (опционально) — дисковый или общий кеш,
+    который переживает перезапуск воркера и разделяется воркерами (SQLite, Redis).
+    Сбой второго уровня не прерывает запрос. Кеширование отключается для отдельного вызова
+    параметром use_cache=False (например, для генерации запросов с temperature=1.0).
+    """
+
+    def __init__(self, client: AsyncLLMClient, memory_cache, disk_cache=None):
+        """
+        :param client: Оборачиваемый клиент.
+        :param memory_cache: In-memory кеш (services.cache.TTLCache).
+        :param disk_cache: Второй уровень (services.cache.SQLiteCache, RedisCache) или None.
+        """
+        self.client = client
+        self.memory_cache = memory_cache
+        self.disk_cache = disk_cache
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+
+    async def _disk_get(self, key: str) -> Optional[str]:
+        if self.disk_cache is None:
+            return None
+        try:
+            return await shared_get(self.disk_cache, key)
+        except Exception as e:
+            logger.warning(f"Второй уровень кеша LLM недоступен: {e!r}")
+            return None
+
+    async def _disk_set(self, key: str, response: str):
+        if self.disk_cache is None:
+            return
+        try:
+            await asyncio.to_thread(self.disk_cache.set, key, response)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить ответ во второй уровень кеша LLM: {e}")
+
+    @staticmethod
+    def make_key(prompt: Prompt, **kwargs) -> str:
+        """
+        Строит ключ кеша по промпту и всем параметрам запроса.
+
+        Ответ зависит не только от model, temperature и max_tokens, но и от stop,
+        response_format, seed и т.д., поэтому в ключ входят все kwargs, кроме use_cache.
+        """
+        payload = {name: value for name, value in kwargs.items() if name != "use_cache"}
+        payload["prompt"] = prompt
+        return hashlib.sha256(
+            json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    async def generate(self, prompt: Prompt, use_cache: bool = True, **kwargs) -> str:
+        """
+        Возвращает ответ из кеша или обращается к оборачиваемому клиенту.
+
+        :param prompt: Строка запроса для модели или список сообщений чата.
+        :param use_cache: False — всегда обращаться к модели и не сохранять ответ.
+        :param kwargs: Параметры запроса (model, temperature, max_tokens и т.д.).
+        :return: Ответ модели в виде строки.
+        """
+        if not use_cache:
+            self.stats["bypassed"] += 1
+            return await self.client.generate(prompt, use_cache=False, **kwargs)
+
+        key = self.make_key(prompt, **kwargs)
+        cached = self.memory_cache.get(key)
+        if cached is not None:
+            self.stats["memory_hits"] += 1
+            return cached
+
+        cached = await self._disk_get(key)
+        if cached is not None:
+            self.stats["disk_hits"] += 1
+            self.memory_cache.set(key, cached)
+            return cached
+
+        self.stats["misses"] += 1
+        response = await self.client.generate(prompt, **kwargs)
+        if response is not None:
+            self.memory_cache.set(key, response)
+            await self._disk_set(key, response)
+        return response
+
+    async def stream(self, prompt: Prompt, use_cache: bool = True, **kwargs) -> AsyncIterator[str]:
+        """
+        Потоковая генерация с кешированием: закешированный ответ отдается
+        одним фрагментом, новый сохраняется после полного получения.
+        """
+        if not use_cache:
+            self.stats["bypassed"] += 1
+            async for chunk in self.client.stream(prompt, use_cache=False, **kwargs):
+                yield chunk
+            return
+
+        key = self.make_key(prompt, **kwargs)
+        cached = self.memory_cache.get(key)
+        if cached is None:
+            cached = await self._disk_get(key)
+            if cached is not None:
+                self.stats["disk_hits"] += 1
+                self.memory_cache.set(key, cached)
+        else:
+            self.stats["memory_hits"] += 1
+        if cached is not None:
+            yield cached
+            return
+
+        self.stats["misses"] += 1
+        chunks = []
+        async for chunk in self.client.stream(prompt, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        response = "".join(chunks)
+        self.memory_cache.set(key, response)
+        await self._disk_set(key, response)
+
+    def metrics(self) -> dict:
+        """Возвращает счетчики попаданий по уровням кеша."""
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return {**self.stats, "hit_ratio": hits / total if total else 0.0}
+
+    def usage_metrics(self) -> dict:
+        return self.client.usage_metrics()
+
+    async def aclose(self):
+        await self.client.aclose()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
@@ -0,0 +1,352 @@
+# agents/answer_cache.py
+
+import re
+import asyncio
+import math
+import zlib
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from core.data_types import PromtsChain, Parameters, AgentMemory
+from services.cache import TTLCache, SharedCache, cache_key, shared_get
+from utils.utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+SparseVector = Dict[int, float]
+
+
+def ngram_embedding(text: str, ngram_range: Tuple[int, int] = (3, 5), n_features: int = 2 ** 20) -> SparseVector:
+    """
+    Локальный эмбеддинг запроса: нормированный вектор хешированных символьных n-грамм.
+
+    :param text: Текст запроса.
+    :param ngram_range: Минимальная и максимальная длина n-граммы.
+    :param n_features: Размер пространства признаков.
+    :return: Разреженный вектор единичной длины.
+    """
+    text = f" {normalize_query(text)} "
+    vector: SparseVector = {}
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        for i in range(len(text) - n + 1):
+            index = zlib.crc32(text[i:i + n].encode("utf-8")) % n_features
+            vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {index: value / norm for index, value in vector.items()}
+
+
+def cosine_similarity(a: SparseVector, b: SparseVector) -> float:
+    """Косинусная близость двух нормированных разреженных векторов."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+def prompts_version(prompts: PromtsChain) -> str:
+    """Короткий хеш содержимого промптов: смена промптов инвалидирует кеш."""
+    return hashlib.sha1(prompts.model_dump_json().encode("utf-8")).hexdigest()[:12]
+
+
+def models_signature(parameters: Parameters) -> str:
+    """Набор моделей, участвующих в генерации ответа."""
+    return "|".join([
+        parameters.ai_model_queries_generate,
+        parameters.ai_model_analisys_note,
+        parameters.ai_model_voting,
+        parameters.ai_model_answer_generator,
+    ])
+
+
+class AnswerCache:
+    """
+    Кеш готовых ответов SearchAgent.
+
+    Точный уровень: ключ (нормализованный запрос, alias, версия промптов, набор моделей),
+    TTL и LRU-вытеснение. Семантический уровень (опционально): ответ переиспользуется,
+    если эмбеддинг нового запроса достаточно близок к эмбеддингу закешированного
+    в той же области (alias, версия промптов, набор моделей). Векторы хранятся
+    по областям, поиск просматривает только свою; в aget он выполняется в
+    отдельном потоке, чтобы не занимать цикл событий.
+
+    Общий уровень (опционально) — кеш, разделяемый процессами-воркерами
+    (см. services.cache.build_shared_cache): точные попадания одного воркера
+    доступны остальным через aget/aset. Семантический уровень остается локальным.
+    """
+
+    def __init__(self,
+                 prompts_version: str,
+                 models_signature: str,
+                 max_size: int = 1024,
+                 ttl: Optional[float] = 3600.0,
+                 semantic: bool = False,
+                 similarity_threshold: float = 0.92,
+                 embedder: Callable[[str], SparseVector] = ngram_embedding,
+                 clock: Callable[[], float] = time.monotonic,
+                 shared: Optional[SharedCache] = None):
+        """
+        :param prompts_version: Версия промптов (см. prompts_version()).
+        :param models_signature: Набор моделей (см. models_signature()).
+        :param max_size: Максимальное число закешированных ответов.
+        :param ttl: Время жизни ответа в секундах.
+        :param semantic: Включить семантический уровень.
+        :param similarity_threshold: Минимальная косинусная близость для семантического попадания.
+        :param embedder: Функция получения эмбеддинга запроса.
+        :param clock: Источник времени (подменяется в тестах).
+        :param shared: Общий уровень кеша (None — только память процесса).
+        """
+        self.prompts_version = prompts_version
+        self.models_signature = models_signature
+        self.exact = TTLCache(max_size=max_size, ttl=ttl, clock=clock)
+        self.semantic = semantic
+        self.similarity_threshold = similarity_threshold
+        self.embedder = embedder
+        self._clock = clock
+        self._ttl = ttl
+        self._max_size = max_size
+        # Ключ точного уровня -> область (порядок — LRU для вытеснения)
+        self._vectors: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # Область -> {ключ -> (эмбеддинг, время истечения)}: поиск просматривает только свою область
+        self._buckets: Dict[tuple, Dict[tuple, Tuple[SparseVector, Optional[float]]]] = {}
+        # Защищает _vectors, _buckets и stats
+        self._lock = threading.Lock()
+        self.shared = shared
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0}
+
+    @classmethod
+    def from_parameters(cls, prompts: PromtsChain, parameters: Parameters,
+                        shared: Optional[SharedCache] = None) -> "AnswerCache":
+        """Создает кеш по настройкам приложения."""
+        return cls(
+            prompts_version=prompts_version(prompts),
+            models_signature=models_signature(parameters),
+            max_size=parameters.answer_cache_size,
+            ttl=parameters.answer_cache_ttl,
+            semantic=parameters.answer_cache_semantic,
+            similarity_threshold=parameters.answer_cache_similarity,
+            shared=shared,
+        )
+
+    def _scope(self, alias: str) -> tuple:
+        return (alias, self.prompts_version, self.models_signature)
+
+    def make_key(self, query: str, alias: str) -> tuple:
+        """
+        Строит ключ точного уровня.
+
+        :param query: Запрос пользователя.
+        :param alias: Идентификатор источника.
+        :return: Кортеж-ключ.
+        """
+        normalized = re.sub(r"[\s?!.,;:]+$", "", normalize_query(query))
+        return (normalized,) + self._scope(alias)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, query: str, alias: str) -> Optional[str]:
+        """
+        Ищет ответ сначала по точному ключу, затем (если включено) семантически.
+
+        :return: Закешированный ответ или None.
+        """
+        key = self.make_key(query, alias)
+        answer = self.exact.get(key)
+        if answer is not None:
+            self._count("exact_hits")
+            if self.semantic:
+                self._touch(key)
+            return answer
+
+        if self.semantic:
+            answer = self._semantic_lookup(query, self._scope(alias))
+            if answer is not None:
+                self._count("semantic_hits")
+                return answer
+
+        self._count("misses")
+        return None
+
+    def _semantic_lookup(self, query: str, scope: tuple) -> Optional[str]:
+        """Находит ближайший закешированный запрос в той же области."""
+        vector = self.embedder(query)
+        now = self._clock()
+        best_key, best_score = None, self.similarity_threshold
+        with self._lock:
+            bucket = self._buckets.get(scope, {})
+            for key, (key_vector, expires_at) in list(bucket.items()):
+                if expires_at is not None and expires_at <= now:
+                    self._forget(key)
+                    continue
+                score = cosine_similarity(vector, key_vector)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is not None:
+                self._vectors.move_to_end(best_key)
+        if best_key is None:
+            return None
+        logger.info(f"Семантическое попадание в кеш ответов (близость {best_score:.3f})")
+        return self.exact.get(best_key)
+
+    def _touch(self, key: tuple):
+        """Отмечает ключ как недавно использованный, чтобы он вытеснялся последним."""
+        with self._lock:
+            if key in self._vectors:
+                self._vectors.move_to_end(key)
+
+    def _forget(self, key: tuple):
+        # Вызывается под self._lock
+        scope = self._vectors.pop(key)
+        bucket = self._buckets[scope]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[scope]
+
+    def set(self, query: str, alias: str, answer: str):
+        """Сохраняет ответ на запрос."""
+        key = self.make_key(query, alias)
+        self.exact.set(key, answer)
+        self._count("stores")
+        if self.semantic:
+            scope = self._scope(alias)
+            vector = self.embedder(query)
+            expires_at = self._clock() + self._ttl if self._ttl is not None else None
+            with self._lock:
+                if key in self._vectors:
+                    self._forget(key)
+                self._vectors[key] = scope
+                self._buckets.setdefault(scope, {})[key] = (vector, expires_at)
+                while len(self._vectors) > self._max_size:
+                    self._forget(next(iter(self._vectors)))
+
+    async def aget(self, query: str, alias: str) -> Optional[str]:
+        """
+        Как get(), но семантический поиск выполняется вне цикла событий,
+        а при промахе в памяти процесса запрос идет на общий уровень.
+
+        :return: Закешированный ответ или None.
+        """
+        key = self.make_key(query, alias)
+        answer = self.exact.get(key)
+        if answer is not None:
+            self._count("exact_hits")
+            return answer
+
+        if self.semantic:
+            answer = await asyncio.to_thread(self._semantic_lookup, query, self._scope(alias))
+            if answer is not None:
+                self._count("semantic_hits")
+                return answer
+
+        if self.shared is not None:
+            try:
+                answer = await shared_get(self.shared, cache_key(*key))
+            except Exception as e:
+                logger.warning(f"Общий кеш ответов недоступен: {e!r}")
+                answer = None
+            if answer is not None:
+                self._count("shared_hits")
+                self.exact.set(key, answer)
+                return answer
+
+        self._count("misses")
+        return None
+
+    async def aset(self, query: str, alias: str, answer: str):
+        """Сохраняет ответ в памяти процесса и на общем уровне."""
+        self.set(query, alias, answer)
+        if self.shared is None:
+            return
+        try:
+            await asyncio.to_thread(self.shared.set, cache_key(*self.make_key(query, alias)), answer)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить ответ в общий кеш: {e}")
+
+    def close(self):
+        """Закрывает общий уровень."""
+        if self.shared is not None:
+            self.shared.close()
+
+    def metrics(self) -> Dict[str, float]:
+        """Возвращает счетчики попаданий и промахов."""
+        with self._lock:
+            stats = dict(self.stats)
+        hits = stats["exact_hits"] + stats["semantic_hits"] + stats["shared_hits"]
+        total = hits + stats["misses"]
+        return {
+            **stats,
+            "size": len(self.exact),
+            "evictions": self.exact.stats["evictions"],
+            "hit_ratio": hits / total if total else 0.0,
+        }
+
+
+class CachedSearchAgent:
+    """
+    Слой кеширования вокруг SearchAgent.
+
+    Повторяет интерфейс агента (вызов, action_pipeline, retrieve, answer),
+    поэтому подставляется в BotDependencies без изменений конвейера.
+    Ответ «НЕТ ОТВЕТА» не кешируется: он может быть следствием временной
+    недоступности поиска.
+    """
+
+    def __init__(self, agent, cache: AnswerCache):
+        """
+        :param agent: Экземпляр SearchAgent.
+        :param cache: Кеш ответов.
+        """
+        self.agent = agent
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # Остальные атрибуты (parameters, retriever и т.д.) берутся у агента
+        return getattr(self.agent, name)
+
+    async def _store(self, query: str, alias: str, answer: str, fail_answer: str):
+        if answer and answer != fail_answer:
+            await self.cache.aset(query, alias, answer)
+
+    async def action_pipeline(self, query: str, alias: str = "bss.vip") -> str:
+        cached = await self.cache.aget(query, alias)
+        if cached is not None:
+            return cached
+        answer = await self.agent.action_pipeline(query, alias)
+        await self._store(query, alias, answer, self.agent.memory.fail_answer)
+        return answer
+
+    async def __call__(self, query: str, alias: str = "bss.vip") -> str:
+        return await self.action_pipeline(query, alias)
+
+    async def retrieve(self, query: str, alias: str = "bss.vip") -> AgentMemory:
+        """
+        При попадании в кеш поиск не выполняется: возвращается память
+        с уже заполненным ответом, который answer() отдаст без вызова LLM.
+        """
+        cached = await self.cache.aget(query, alias)
+        if cached is not None:
+            memory = self.agent._new_memory(query, alias)
+            memory.answer = cached
+            return memory
+        return await self.agent.retrieve(query, alias)
+
+    async def answer(self, memory: AgentMemory) -> str:
+        if memory.answer:
+            return memory.answer
+        answer = await self.agent.answer(memory)
+        await self._store(memory.query, memory.alias, answer, memory.fail_answer)
+        return answer
+
+    async def stream_answer(self, memory: AgentMemory) -> AsyncIterator[str]:
+        if memory.answer:
+            yield memory.answer
+            return
+        chunks = []
+        async for chunk in self.agent.stream_answer(memory):
+            chunks.append(chunk)
+            yield chunk
+        await self._store(memory.query, memory.alias, "".join(chunks), memory.fail_answer)
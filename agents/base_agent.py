@@ -2,7 +2,7 @@
 
 from abc import ABC, abstractmethod
 from core.data_types import PromtsChain, Parameters, AgentMemory
-from agents.ai_base import LLMGenerator
+from agents.ai_base import AsyncLLMClient
 
 class BaseAgent(ABC):
     """
@@ -16,7 +16,7 @@ class BaseAgent(ABC):
                  prompts: PromtsChain, 
                  parameters: Parameters, 
                  memory: AgentMemory, 
-                 ai_client: LLMGenerator):
+                 ai_client: AsyncLLMClient):
         """
         Инициализатор базового агента.
 
@@ -0,0 +1,136 @@
+# agents/candidates.py
+
+import heapq
+import hashlib
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from core.data_types import Candidate
+from utils.utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+FUSION_METHODS = ("max", "rrf")
+
+CandidateLike = Union[Candidate, Dict[str, Any]]
+
+
+def candidate_key(candidate: Candidate) -> tuple:
+    """Ключ документа: (mod_id, doc_id), а при их отсутствии — ссылка или заголовок."""
+    if candidate.mod_id or candidate.doc_id:
+        return (candidate.mod_id, candidate.doc_id)
+    return ("", candidate.link or candidate.title)
+
+
+def fragment_key(text: str) -> bytes:
+    """Короткий хеш нормализованного текста фрагмента."""
+    return hashlib.blake2b(normalize_query(text).encode("utf-8"), digest_size=8).digest()
+
+
+def _query_fragment_scores(results: Sequence[CandidateLike], fusion: str, rrf_k: int) -> Dict[tuple, Tuple[str, float]]:
+    """
+    Оценки фрагментов в выдаче одного запроса.
+
+    Для "max" — исходная оценка сервиса поиска, для "rrf" — 1 / (rrf_k + ранг),
+    где ранг считается по всем фрагментам выдачи. Повторы внутри выдачи
+    схлопываются по лучшей оценке.
+
+    :return: (ключ документа, хеш фрагмента) -> (текст, оценка).
+    """
+    fragments = []
+    for item in results:
+        candidate = Candidate.coerce(item)
+        doc_key = candidate_key(candidate)
+        for text, score in candidate.best_fragments_scores:
+            fragments.append((doc_key, text, float(score)))
+
+    if fusion == "rrf":
+        fragments.sort(key=lambda x: x[2], reverse=True)
+        fragments = [(doc_key, text, 1.0 / (rrf_k + rank)) for rank, (doc_key, text, _) in enumerate(fragments, 1)]
+
+    scores: Dict[tuple, Tuple[str, float]] = {}
+    for doc_key, text, score in fragments:
+        key = (doc_key, fragment_key(text))
+        if key not in scores or score > scores[key][1]:
+            scores[key] = (text, score)
+    return scores
+
+
+def merge_candidates(result_lists: Iterable[Sequence[CandidateLike]],
+                     fusion: str = "max",
+                     rrf_k: int = 60) -> List[CandidateLike]:
+    """
+    Объединяет выдачи нескольких поисковых запросов.
+
+    Документы схлопываются по (mod_id, doc_id), фрагменты документа — по хешу
+    текста. Оценки одного фрагмента из разных выдач объединяются:
+    "max" — максимум исходных оценок, "rrf" — сумма 1 / (rrf_k + ранг)
+    (reciprocal rank fusion: фрагмент, найденный несколькими запросами, поднимается выше).
+
+    :param result_lists: Выдачи запросов (списки Candidate или ranking_dict).
+    :param fusion: Способ объединения оценок: "max" или "rrf".
+    :param rrf_k: Сглаживающая константа RRF.
+    :return: Список уникальных документов в порядке первого появления
+             (в том же формате, что и входные кандидаты).
+    :raises ValueError: Если указан неизвестный способ объединения.
+    """
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"Неизвестный способ объединения оценок: {fusion}")
+
+    documents: Dict[tuple, CandidateLike] = {}
+    fragments: Dict[tuple, Dict[bytes, Tuple[str, float]]] = {}
+    total = 0
+    for results in result_lists:
+        for item in results:
+            candidate = Candidate.coerce(item)
+            total += 1
+            doc_key = candidate_key(candidate)
+            if doc_key not in documents:
+                # Документ остается в исходном формате: копия ranking_dict или Candidate
+                documents[doc_key] = dict(item) if isinstance(item, dict) else Candidate(
+                    candidate.mod_id, candidate.doc_id, candidate.title, candidate.link
+                )
+                fragments[doc_key] = {}
+
+        for (doc_key, frag_key), (text, score) in _query_fragment_scores(results, fusion, rrf_k).items():
+            doc_fragments = fragments[doc_key]
+            if frag_key not in doc_fragments:
+                doc_fragments[frag_key] = (text, score)
+                continue
+            # Текст фрагмента остается из первой выдачи, объединяется только оценка
+            known_text, known_score = doc_fragments[frag_key]
+            fused = known_score + score if fusion == "rrf" else max(known_score, score)
+            doc_fragments[frag_key] = (known_text, fused)
+
+    for doc_key, document in documents.items():
+        if isinstance(document, dict):
+            document["best_fragments_scores"] = [list(f) for f in fragments[doc_key].values()]
+        else:
+            document.best_fragments_scores = list(fragments[doc_key].values())
+
+    logger.debug(f"Объединение выдач: {total} кандидатов -> {len(documents)} уникальных документов")
+    return list(documents.values())
+
+
+def top_fragments(candidates: Iterable[CandidateLike], k: Optional[int] = None) -> List[Tuple[Candidate, str, float]]:
+    """
+    Выбирает k фрагментов с наибольшей оценкой без полной сортировки.
+
+    Одинаковые по тексту фрагменты (в том числе из разных документов)
+    учитываются один раз — с лучшей оценкой. При равных оценках порядок
+    совпадает с порядком появления, как у sorted(..., reverse=True).
+
+    :param candidates: Кандидаты (Candidate или ranking_dict).
+    :param k: Число фрагментов (None — все фрагменты).
+    :return: Список (кандидат, текст фрагмента, оценка) по убыванию оценки.
+    """
+    best: Dict[bytes, Tuple[Candidate, str, float]] = {}
+    for item in candidates:
+        candidate = Candidate.coerce(item)
+        for text, score in candidate.best_fragments_scores:
+            key = fragment_key(text)
+            if key not in best or score > best[key][2]:
+                best[key] = (candidate, text, score)
+    if k is None:
+        return sorted(best.values(), key=lambda x: x[2], reverse=True)
+    return heapq.nlargest(k, best.values(), key=lambda x: x[2])
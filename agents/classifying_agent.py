@@ -3,7 +3,20 @@
 import os
 import sys
 import re
+import asyncio
+import logging
+from typing import Optional
 from agents.base_agent import BaseAgent
+from agents.ai_base import AsyncLLMClient
+from agents.pre_classifier import BasePreClassifier
+from core.data_types import PromtsChain, Parameters, AgentMemory
+from services.resilience import StageDeadlineExceeded, stage_deadline
+from services.metrics import timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Тип запроса, если классификатор не уложился в долю бюджета времени (бухгалтерский вопрос)
+FALLBACK_QUERY_TYPE = "3"
 
 # Добавление корневой директории проекта в sys.path для корректного импорта
 # Эта практика полезна для запуска скрипта напрямую, но в проде лучше использовать
@@ -20,40 +33,65 @@ class ClassifierAgent(BaseAgent):
     Использует LLM для определения категории запроса (например, приветствие, 
     бухгалтерский вопрос, благодарность и т.д.), что позволяет системе
     выбрать правильный конвейер для обработки.
+
+    Если задан локальный предклассификатор, очевидные запросы (приветствия,
+    благодарности, явные бухгалтерские вопросы) классифицируются без LLM.
     """
+    def __init__(self,
+                 prompts: PromtsChain,
+                 parameters: Parameters,
+                 memory: AgentMemory,
+                 ai_client: AsyncLLMClient,
+                 pre_classifier: Optional[BasePreClassifier] = None):
+        super().__init__(prompts, parameters, memory, ai_client)
+        self.pre_classifier = pre_classifier
     
-    def action_pipeline(self, query: str) -> str:
+    @timed_stage("classifier")
+    async def action_pipeline(self, query: str) -> str:
         """
         Выполняет классификацию запроса.
 
         :param query: Входящий текст от пользователя.
-        :return: Строка с результатом классификации от LLM.
+        :return: Строка с результатом классификации (номер типа от
+                 предклассификатора или ответ LLM).
         """
+        if self.pre_classifier is not None:
+            result = self.pre_classifier.classify(query)
+            if result is not None:
+                logger.info(f"Запрос классифицирован локально ({result.source}): тип {result.label}")
+                return str(result.label)
+
         # Форматируем промпт, подставляя в него запрос пользователя
         prompt = self.prompts.classication.format(query)
         
         # Вызываем LLM с параметрами, специфичными для задачи классификации
-        return self.ai_client(
-            prompt, 
-            model=self.parameters.ai_model_classifier, 
-            temperature=0.5, 
-            max_tokens=1000
-        )
+        try:
+            with stage_deadline("classifier"):
+                return await self.ai_client(
+                    prompt, 
+                    model=self.parameters.ai_model_classifier, 
+                    temperature=0.5, 
+                    max_tokens=1000
+                )
+        except StageDeadlineExceeded as e:
+            # Почти весь трафик — бухгалтерские вопросы: без вердикта запрос идет в поиск
+            logger.warning(f"{e}: запрос считается бухгалтерским вопросом (тип {FALLBACK_QUERY_TYPE})")
+            return FALLBACK_QUERY_TYPE
 
 # Этот блок кода выполняется только при прямом запуске файла.
 # Он полезен для быстрой проверки и демонстрации работы агента.
 if __name__ == "__main__":
     # Импорты для демонстрационного запуска
-    from piplines.dependencies import parameters, class_memory, ai_client, prompts
+    from piplines.dependencies import AppContainer
 
     # Создание экземпляра агента
-    agent = ClassifierAgent(prompts, parameters, class_memory, ai_client)
+    agent = AppContainer.build().classifier_agent
     
     # Пример запроса
     query = """Добрый день! У работницы предприятия двое детей возраста до 18 лет. Подскажите пожалуйста с 2025года на второго ребенка предоставляется заявление на вычеты по НДФЛ? Спасибо!"""
     
     # Вызов агента
-    answer = agent(query)
+    answer = asyncio.run(agent(query))
 
     print(f"Ответ классификатора: {answer}")
 
@@ -0,0 +1,145 @@
+# agents/context_packer.py
+
+import re
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from core.data_types import Candidate, Parameters
+from services.tokens import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+FRAGMENT_TEMPLATE = "Заголовок текста: {title} ссылка на текст: {link} Фрагмент: {text}"
+FRAGMENT_SEPARATOR = "\n\n"
+TRUNCATION_MARK = "…"
+
+# Граница предложения: знак конца предложения и пробел после него
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+")
+
+
+@dataclass
+class PackedContext:
+    """Результат упаковки фрагментов в промпт."""
+    text: str
+    tokens: int
+    fragments: int
+    truncated: int
+    skipped: int
+
+
+class ContextPacker:
+    """
+    Упаковывает фрагменты в контекст промпта с учетом бюджета токенов.
+
+    Фрагменты берутся жадно по убыванию оценки, пока не исчерпан бюджет
+    или не набрано max_fragments. Длинные фрагменты обрезаются по границе
+    предложения до max_fragment_tokens; фрагмент, который не помещается
+    даже после обрезки, пропускается, и упаковка продолжается со следующего.
+    """
+
+    def __init__(self,
+                 counter: TokenCounter,
+                 budget_tokens: int = 0,
+                 max_fragment_tokens: int = 0,
+                 max_fragments: Optional[int] = None,
+                 min_fragment_tokens: int = 32):
+        """
+        :param counter: Счетчик токенов.
+        :param budget_tokens: Бюджет токенов на весь контекст (0 — без ограничения).
+        :param max_fragment_tokens: Максимальная длина одного фрагмента (0 — без ограничения).
+        :param max_fragments: Максимальное число фрагментов (None — без ограничения).
+        :param min_fragment_tokens: Если фрагмент пришлось бы обрезать короче этого, он пропускается.
+        """
+        self.counter = counter
+        self.budget_tokens = budget_tokens
+        self.max_fragment_tokens = max_fragment_tokens
+        self.max_fragments = max_fragments
+        self.min_fragment_tokens = min_fragment_tokens
+
+    @classmethod
+    def from_parameters(cls, parameters: Parameters) -> "ContextPacker":
+        """
+        Создает упаковщик по настройкам приложения.
+
+        Строка фрагментов подставляется в промпты анализа, голосования и ответа,
+        поэтому берется наименьший из бюджетов этих моделей.
+        """
+        models = [
+            parameters.ai_model_analisys_note,
+            parameters.ai_model_voting,
+            parameters.ai_model_answer_generator,
+        ]
+        budgets = [parameters.context_token_budgets.get(model, parameters.context_token_budget) for model in models]
+        budgets = [budget for budget in budgets if budget > 0]
+        return cls(
+            TokenCounter(parameters.ai_model_analisys_note),
+            budget_tokens=min(budgets) if budgets else 0,
+            max_fragment_tokens=parameters.context_max_fragment_tokens,
+            max_fragments=parameters.max_texts,
+        )
+
+    def truncate_sentences(self, text: str, max_tokens: int) -> str:
+        """
+        Обрезает текст до max_tokens токенов по границе предложения.
+
+        Если не помещается даже первое предложение, оно обрезается по токенам.
+
+        :param text: Текст фрагмента.
+        :param max_tokens: Максимальное число токенов (включая знак обрезки).
+        :return: Исходный или обрезанный текст.
+        """
+        if self.counter.count(text) <= max_tokens:
+            return text
+        limit = max_tokens - self.counter.count(TRUNCATION_MARK)
+        kept: List[str] = []
+        used = 0
+        for sentence in _SENTENCE_BOUNDARY.split(text):
+            tokens = self.counter.count(sentence) + (1 if kept else 0)
+            if used + tokens > limit:
+                break
+            kept.append(sentence)
+            used += tokens
+        if kept:
+            return " ".join(kept) + TRUNCATION_MARK
+        return self.counter.truncate(text, limit).rstrip() + TRUNCATION_MARK
+
+    def pack(self, fragments: Sequence[Tuple[Candidate, str, float]]) -> PackedContext:
+        """
+        Собирает строку контекста из фрагментов.
+
+        :param fragments: Кортежи (кандидат, текст, оценка) по убыванию оценки (см. top_fragments).
+        :return: Упакованный контекст и статистика.
+        """
+        lines: List[str] = []
+        used = truncated = skipped = 0
+        # Считается здесь, а не в __init__: кодировка токенизатора не загружается при сборке приложения
+        separator_tokens = self.counter.count(FRAGMENT_SEPARATOR)
+        for candidate, text, _ in fragments:
+            if self.max_fragments is not None and len(lines) >= self.max_fragments:
+                break
+            header = FRAGMENT_TEMPLATE.format(title=candidate.title, link=candidate.link, text="")
+            overhead = self.counter.count(header) + (separator_tokens if lines else 0)
+
+            limit = None
+            if self.max_fragment_tokens:
+                limit = self.max_fragment_tokens
+            if self.budget_tokens:
+                remaining = self.budget_tokens - used - overhead
+                limit = remaining if limit is None else min(limit, remaining)
+
+            packed_text = text
+            if limit is not None and self.counter.count(text) > limit:
+                # Обрезанный слишком коротко фрагмент бесполезен: пробуем следующий
+                if limit < self.min_fragment_tokens:
+                    skipped += 1
+                    continue
+                packed_text = self.truncate_sentences(text, limit)
+                truncated += 1
+
+            lines.append(header + packed_text)
+            used += overhead + self.counter.count(packed_text)
+
+        if skipped:
+            logger.debug(f"Упаковка контекста: пропущено {skipped} фрагментов, бюджет {self.budget_tokens} токенов")
+        return PackedContext(FRAGMENT_SEPARATOR.join(lines), used, len(lines), truncated, skipped)
@@ -0,0 +1,305 @@
+# agents/pre_classifier.py
+
+"""
+Локальная предварительная классификация запросов.
+
+Позволяет определить тип запроса (приветствие, благодарность, бухгалтерский
+вопрос) без обращения к LLM. Если локальная классификация не уверена,
+возвращается None и решение принимает ClassifierAgent через LLM.
+"""
+import os
+import re
+import json
+import math
+import zlib
+import glob
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.utils import normalize_query
+from services.memory_writer import SEGMENT_PREFIX, iter_segment
+
+logger = logging.getLogger(__name__)
+
+# Номера типов совпадают с промптом классификатора
+GREETING, THANKS, QUESTION = 1, 2, 3
+
+DEFAULT_RULES: Dict[int, List[str]] = {
+    # Сообщение целиком состоит из приветствия
+    GREETING: [
+        r"^(привет(ствую)?|здравствуй(те)?|добр(ый|ого) (день|дня|вечер|вечера)|доброе утро|доброго времени суток|hello|hi)"
+        r"(\s+(коллеги|всем|уважаемые))?[\s!.,)]*$",
+    ],
+    # Сообщение целиком состоит из благодарности
+    THANKS: [
+        r"^((большое |огромное )?спасибо( (большое|огромное|вам|за (ответ|помощь|консультацию)))*|благодарю( вас)?( за (ответ|помощь))?"
+        r"|thanks?( you)?)[\s!.,)]*$",
+    ],
+    # Вопрос с явной бухгалтерской или налоговой лексикой: аббревиатуры — целыми словами,
+    # основы — с начала слова (иначе "енс" находится в "пенсия", "ип" — в "тип")
+    QUESTION: [
+        r"(\b(ндфл|ндс|усн|енвд|осно|псн|енс|кбк|кпп|рсв|сзв|ефс|ип)\b|\b(упрощенк|налог|вычет|декларац|"
+        r"бухгалтер|бухучет|отчетност|взнос|счет-фактур|амортизац|проводк|больничн|отпускн|зарплат|"
+        r"трудов(ой|ого) договор|увольнен|командировк|аванс)).*(\?|подскажите|как |нужно ли|можно ли|обязан)",
+        r"(\?|подскажите|как |нужно ли|можно ли|обязан).*(\b(ндфл|ндс|усн)\b|\b(налог|вычет|декларац|бухгалтер|"
+        r"отчетност|взнос))",
+    ],
+}
+
+# Исходные примеры для классов, которых нет в сохраненной памяти агента
+SEED_SAMPLES: List[Tuple[str, int]] = [
+    ("Привет", GREETING), ("Здравствуйте", GREETING), ("Добрый день!", GREETING),
+    ("Доброе утро", GREETING), ("Добрый вечер", GREETING), ("Приветствую, коллеги", GREETING),
+    ("Спасибо", THANKS), ("Большое спасибо!", THANKS), ("Спасибо за ответ", THANKS),
+    ("Благодарю", THANKS), ("Спасибо, очень помогли", THANKS), ("Благодарю за помощь", THANKS),
+]
+
+
+@dataclass
+class PreClassification:
+    """Результат локальной классификации."""
+    label: int
+    confidence: float
+    source: str
+
+
+class BasePreClassifier(ABC):
+    """Абстрактный локальный классификатор запросов."""
+
+    @abstractmethod
+    def classify(self, query: str) -> Optional[PreClassification]:
+        """
+        Классифицирует запрос локально.
+
+        :param query: Текст запроса пользователя.
+        :return: Результат классификации или None, если классификатор не уверен.
+        """
+        pass
+
+
+class RulePreClassifier(BasePreClassifier):
+    """
+    Классификатор на основе таблиц регулярных выражений.
+    Правила проверяются в порядке номеров типов, первое совпадение побеждает.
+    """
+
+    def __init__(self, rules: Optional[Dict[int, List[str]]] = None, confidence: float = 1.0):
+        """
+        :param rules: Словарь {номер типа: список регулярных выражений}.
+        :param confidence: Уверенность, присваиваемая совпадению правила.
+        """
+        rules = rules if rules is not None else DEFAULT_RULES
+        self.rules = [
+            (label, [re.compile(pattern) for pattern in patterns])
+            for label, patterns in sorted(rules.items())
+        ]
+        self.confidence = confidence
+
+    def classify(self, query: str) -> Optional[PreClassification]:
+        text = normalize_query(query)
+        for label, patterns in self.rules:
+            if any(pattern.search(text) for pattern in patterns):
+                return PreClassification(label, self.confidence, "rules")
+        return None
+
+
+class NgramPreClassifier(BasePreClassifier):
+    """
+    Легковесный линейный классификатор (мультиномиальный наивный Байес)
+    на хешированных символьных n-граммах.
+
+    Не требует внешних библиотек; модель сохраняется в JSON.
+    """
+
+    def __init__(self,
+                 ngram_range: Tuple[int, int] = (2, 4),
+                 n_features: int = 2 ** 18,
+                 alpha: float = 0.1,
+                 threshold: float = 0.95):
+        """
+        :param ngram_range: Минимальная и максимальная длина символьной n-граммы.
+        :param n_features: Размер пространства хешированных признаков.
+        :param alpha: Параметр сглаживания Лапласа.
+        :param threshold: Минимальная вероятность класса для уверенного ответа.
+        """
+        self.ngram_range = tuple(ngram_range)
+        self.n_features = n_features
+        self.alpha = alpha
+        self.threshold = threshold
+        self.class_counts: Dict[int, int] = {}
+        self.feature_counts: Dict[int, Dict[int, int]] = {}
+        self.feature_totals: Dict[int, int] = {}
+
+    def _features(self, text: str) -> Dict[int, int]:
+        """Возвращает счетчики хешированных n-грамм текста."""
+        text = f" {normalize_query(text)} "
+        features: Dict[int, int] = {}
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                index = zlib.crc32(text[i:i + n].encode("utf-8")) % self.n_features
+                features[index] = features.get(index, 0) + 1
+        return features
+
+    def fit(self, samples: Iterable[Tuple[str, int]]) -> "NgramPreClassifier":
+        """
+        Обучает модель на размеченных примерах.
+
+        :param samples: Пары (текст запроса, номер типа).
+        :return: Обученная модель.
+        """
+        for text, label in samples:
+            self.class_counts[label] = self.class_counts.get(label, 0) + 1
+            counts = self.feature_counts.setdefault(label, {})
+            for index, count in self._features(text).items():
+                counts[index] = counts.get(index, 0) + count
+                self.feature_totals[label] = self.feature_totals.get(label, 0) + count
+        return self
+
+    def predict_proba(self, query: str) -> Dict[int, float]:
+        """
+        Вычисляет вероятности классов для запроса.
+
+        :param query: Текст запроса.
+        :return: Словарь {номер типа: вероятность}.
+        """
+        if not self.class_counts:
+            return {}
+        features = self._features(query)
+        total_docs = sum(self.class_counts.values())
+        log_scores = {}
+        for label, docs in self.class_counts.items():
+            counts = self.feature_counts[label]
+            denominator = math.log(self.feature_totals.get(label, 0) + self.alpha * self.n_features)
+            score = math.log(docs / total_docs)
+            for index, count in features.items():
+                score += count * (math.log(counts.get(index, 0) + self.alpha) - denominator)
+            log_scores[label] = score
+        max_score = max(log_scores.values())
+        exp_scores = {label: math.exp(score - max_score) for label, score in log_scores.items()}
+        norm = sum(exp_scores.values())
+        return {label: value / norm for label, value in exp_scores.items()}
+
+    def classify(self, query: str) -> Optional[PreClassification]:
+        probabilities = self.predict_proba(query)
+        if not probabilities:
+            return None
+        label, confidence = max(probabilities.items(), key=lambda item: item[1])
+        if confidence < self.threshold:
+            return None
+        return PreClassification(label, confidence, "ngram")
+
+    def save(self, path: str | Path):
+        """Сохраняет модель в JSON-файл."""
+        data = {
+            "ngram_range": list(self.ngram_range),
+            "n_features": self.n_features,
+            "alpha": self.alpha,
+            "threshold": self.threshold,
+            "class_counts": self.class_counts,
+            "feature_counts": self.feature_counts,
+            "feature_totals": self.feature_totals,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path: str | Path, threshold: Optional[float] = None) -> "NgramPreClassifier":
+        """
+        Загружает модель из JSON-файла.
+
+        :param path: Путь к файлу модели.
+        :param threshold: Переопределение порога уверенности.
+        :return: Экземпляр NgramPreClassifier.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        model = cls(
+            ngram_range=tuple(data["ngram_range"]),
+            n_features=data["n_features"],
+            alpha=data["alpha"],
+            threshold=threshold if threshold is not None else data["threshold"],
+        )
+        # Ключи JSON всегда строки, восстанавливаем числовые
+        model.class_counts = {int(k): v for k, v in data["class_counts"].items()}
+        model.feature_counts = {
+            int(label): {int(k): v for k, v in counts.items()}
+            for label, counts in data["feature_counts"].items()
+        }
+        model.feature_totals = {int(k): v for k, v in data["feature_totals"].items()}
+        return model
+
+
+class PreClassifier(BasePreClassifier):
+    """
+    Композиция локальных классификаторов: сначала правила, затем модель.
+    Возвращает первый уверенный результат.
+    """
+
+    def __init__(self, classifiers: List[BasePreClassifier]):
+        """
+        :param classifiers: Классификаторы в порядке приоритета.
+        """
+        self.classifiers = classifiers
+
+    def classify(self, query: str) -> Optional[PreClassification]:
+        for classifier in self.classifiers:
+            result = classifier.classify(query)
+            if result is not None:
+                return result
+        return None
+
+
+def load_memory_samples(memory_path: str | Path) -> List[Tuple[str, int]]:
+    """
+    Собирает обучающие примеры из сохраненной памяти SearchAgent.
+
+    В память попадают только запросы, дошедшие до поиска, поэтому
+    все они размечаются как бухгалтерский вопрос (тип 3).
+
+    :param memory_path: Директория памяти: JSON-файлы и JSONL-сегменты (в т.ч. сжатые).
+    :return: Список пар (запрос, номер типа).
+    """
+    queries = []
+    for file_path in sorted(glob.glob(os.path.join(memory_path, "*.json"))):
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                queries.append(json.load(f).get("query", ""))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать файл памяти {file_path}: {e}")
+    for file_path in sorted(glob.glob(os.path.join(memory_path, f"{SEGMENT_PREFIX}*.jsonl*"))):
+        try:
+            queries.extend(record.get("query", "") for record in iter_segment(file_path))
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать сегмент памяти {file_path}: {e}")
+    return [(query, QUESTION) for query in queries if query]
+
+
+def build_pre_classifier(model_path: Optional[str] = None, threshold: float = 0.95) -> PreClassifier:
+    """
+    Собирает стандартный предклассификатор: правила и (если есть файл) n-граммная модель.
+
+    :param model_path: Путь к сохраненной NgramPreClassifier.
+    :param threshold: Порог уверенности модели.
+    :return: Экземпляр PreClassifier.
+    """
+    classifiers: List[BasePreClassifier] = [RulePreClassifier()]
+    if model_path and os.path.exists(model_path):
+        classifiers.append(NgramPreClassifier.load(model_path, threshold=threshold))
+    elif model_path:
+        logger.warning(f"Модель предклассификатора не найдена: {model_path}")
+    return PreClassifier(classifiers)
+
+
+# Обучение модели по сохраненной памяти:
+#   python -m agents.pre_classifier data/memory data/pre_classifier.json
+if __name__ == "__main__":
+    import sys
+
+    memory_dir, output_path = sys.argv[1], sys.argv[2]
+    training_samples = load_memory_samples(memory_dir) + SEED_SAMPLES
+    NgramPreClassifier().fit(training_samples).save(output_path)
+    print(f"Модель обучена на {len(training_samples)} примерах и сохранена в {output_path}")
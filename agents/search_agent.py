@@ -1,15 +1,31 @@
 # agents/search_agent.py
 
 import asyncio
+import contextlib
+import datetime
+import logging
 import re
-from typing import List
+from typing import AsyncIterator, Awaitable, List
 
 from agents.base_agent import BaseAgent
-from agents.ai_base import LLMGenerator
+from agents.ai_base import AsyncLLMClient
+from agents.candidates import merge_candidates
 from services.retriever import AsyncPostRequest
-from core.data_types import PromtsChain, Parameters, AgentMemory
+from services.tokens import TokenCounter, record_tokens, track_token_usage
+from services.resilience import StageDeadlineExceeded, cap_timeout, stage_deadline
+from services.metrics import timed_stage, track_stage_timings
+from services.tracing import current_request_id
+from core.data_types import PromtsChain, Parameters, AgentMemory, Candidate
 from agents.search_agent_units import AnalysisUnit, VotingUnit, AnswerGenerator, MemoryManager
 
+logger = logging.getLogger(__name__)
+
+
+async def _in_stage(stage: str, awaitable: Awaitable):
+    """Выполняет шаг в рамках дедлайна этапа (для шагов, запускаемых отдельной задачей)."""
+    with stage_deadline(stage):
+        return await awaitable
+
 
 class SearchAgent(BaseAgent):
     """
@@ -20,7 +36,7 @@ class SearchAgent(BaseAgent):
                  prompts: PromtsChain,
                  parameters: Parameters,
                  memory: AgentMemory,
-                 ai_client: LLMGenerator,
+                 ai_client: AsyncLLMClient,
                  retriever: AsyncPostRequest,
                  analysis_unit: AnalysisUnit,
                  voting_unit: VotingUnit,
@@ -36,87 +52,320 @@ class SearchAgent(BaseAgent):
         self.memory_manager = memory_manager
         self.voting_unit_is = voting_unit_is
         self.queries_generate = queries_generate
+        self.token_counter = TokenCounter(parameters.ai_model_queries_generate)
 
-    def _clear_memory(self):
-        """Очищает память агента для нового цикла обработки."""
-        self.memory = AgentMemory() # Создаем новый чистый экземпляр
-
-    async def _generate_and_search_queries(self, initial_query: str) -> List[dict]:
+    def _new_memory(self, query: str, alias: str) -> AgentMemory:
         """
-        Генерирует дополнительные поисковые запросы (если включено) и выполняет поиск.
+        Создает чистую память для одного запроса.
+
+        Агент живет все время работы приложения и обслуживает запросы
+        конкурентно, поэтому состояние запроса хранится не в self.memory,
+        а в отдельном экземпляре. Память из конструктора служит шаблоном.
         """
-        search_tasks = []
-        if self.queries_generate:
-            prompt_query = self.prompts.query_generation.format(initial_query)
-            generated_queries_text = self.ai_client(
-                prompt_query,
-                model=self.parameters.ai_model_queries_generate,
-                temperature=1.0,
-                max_tokens=3000
-            )
-            queries = [initial_query] + generated_queries_text.split("\n")
-        else:
-            queries = [initial_query]
+        return self.memory.model_copy(
+            update={
+                "query": query,
+                "alias": alias,
+                "request_id": current_request_id(),
+                "created_at": datetime.datetime.now().isoformat(),
+            },
+            deep=True,
+        )
 
-        # Запускаем поиск для каждого запроса асинхронно
+    async def _generate_queries(self, initial_query: str) -> List[str]:
+        """Генерирует дополнительные поисковые запросы с помощью LLM."""
+        prompt_query = self.prompts.query_generation.format(initial_query)
+        record_tokens("queries_prompt", self.token_counter.count(prompt_query))
+        generated_queries_text = await self.ai_client(
+            prompt_query,
+            model=self.parameters.ai_model_queries_generate,
+            temperature=1.0,
+            max_tokens=3000,
+            # Генерация с высокой температурой: разнообразие важнее повторяемости
+            use_cache=False
+        )
+        record_tokens("queries_completion", self.token_counter.count(generated_queries_text))
+        return generated_queries_text.split("\n")
+
+    def _search(self, queries: List[str], memory: AgentMemory) -> List[asyncio.Task]:
+        """Запускает поиск для каждого непустого запроса и возвращает задачи."""
+        search_tasks = []
+        # Просим сервис поиска вернуть только нужные поля, если он это поддерживает
+        additional_data = None
+        if self.parameters.retrieval_fields:
+            additional_data = {"fields": list(self.parameters.retrieval_fields)}
         for q in queries:
             clean_query = re.sub(r"Вопрос\d+:", "", q).strip()
             if clean_query:
-                self.memory.temp_queries.append(clean_query)
-                task = self.retriever(
+                memory.temp_queries.append(clean_query)
+                task = asyncio.ensure_future(self.retriever(
                     query=clean_query,
-                    alias=self.memory.alias,
+                    alias=memory.alias,
                     endpoint=self.parameters.retrieval_endpoint,
+                    additional_data=additional_data,
                     headers={"Authorization": "Bearer token123"},
-                    timeout=15
-                )
+                    timeout=cap_timeout(15)
+                ))
                 search_tasks.append(task)
+        return search_tasks
+
+    @timed_stage("retrieval")
+    async def _generate_and_search_queries(self, initial_query: str, memory: AgentMemory) -> List[dict]:
+        """
+        Генерирует дополнительные поисковые запросы (если включено) и выполняет поиск.
+
+        Если включен parameters.overlap_query_generation, поиск по исходному запросу
+        стартует одновременно с генерацией дополнительных запросов, а не после нее.
+        """
+        search_tasks = []
+        if self.queries_generate:
+            if self.parameters.overlap_query_generation:
+                search_tasks.extend(self._search([initial_query], memory))
+            try:
+                generated_queries = await self._generate_queries(initial_query)
+            except BaseException:
+                for task in search_tasks:
+                    task.cancel()
+                raise
+            if search_tasks:
+                queries = generated_queries
+            else:
+                queries = [initial_query] + generated_queries
+        else:
+            queries = [initial_query]
+
+        # Запускаем поиск для каждого запроса асинхронно
+        search_tasks.extend(self._search(queries, memory))
         
         results = await asyncio.gather(*search_tasks, return_exceptions=True)
         
-        # Собираем всех кандидатов
+        # Собираем всех кандидатов; в компактном режиме сразу отбрасываем
+        # текст документа и служебные поля, которые конвейеру не нужны
+        result_lists = []
         for res in results:
             if isinstance(res, dict) and "ranking_dicts" in res:
-                self.memory.searching_candidates.extend(res["ranking_dicts"])
+                if self.parameters.slim_candidates:
+                    result_lists.append([
+                        Candidate.from_ranking_dict(d, memory.alias, self.parameters.alias_to_site)
+                        for d in res["ranking_dicts"]
+                    ])
+                else:
+                    result_lists.append(res["ranking_dicts"])
+
+        if self.parameters.candidate_dedup:
+            # Выдачи запросов сильно пересекаются: один документ — один кандидат
+            memory.searching_candidates.extend(merge_candidates(
+                result_lists, self.parameters.candidate_fusion, self.parameters.candidate_rrf_k
+            ))
+        else:
+            for candidates in result_lists:
+                memory.searching_candidates.extend(candidates)
+
+    async def _vote_and_answer(self, query: str, memory: AgentMemory) -> str:
+        """
+        Спекулятивно выполняет голосование и генерацию ответа параллельно.
+
+        Оба шага зависят только от аналитической записки, поэтому ответ
+        начинает генерироваться, не дожидаясь вердикта. Если голосование
+        отрицательное, генерация ответа отменяется.
+        """
+        # Дедлайн этапа ответа задается внутри задачи, чтобы его истечение
+        # стало StageDeadlineExceeded, а не ошибкой всего запроса
+        answer_task = asyncio.ensure_future(_in_stage("answer", self.answer_generator.generate(
+            query, memory.analysis_note, memory.best_fragments, self.voting_unit_is
+        )))
+        try:
+            answer_is_relevant = await self._vote(query, memory)
+        except BaseException:
+            answer_task.cancel()
+            # Забираем результат отмененной задачи, иначе asyncio сообщит о неполученном исключении
+            with contextlib.suppress(Exception, asyncio.CancelledError):
+                await answer_task
+            raise
+
+        if answer_is_relevant:
+            return await answer_task
+
+        # Вердикт «нет ответа» не зависит от того, успела ли генерация завершиться ошибкой
+        answer_task.cancel()
+        with contextlib.suppress(Exception, asyncio.CancelledError):
+            await answer_task
+        return memory.fail_answer
+
+    async def retrieve(self, query: str, alias: str = "bss.vip") -> AgentMemory:
+        """
+        Первая часть конвейера: создает память запроса и ищет кандидатов.
+
+        Вынесена отдельно, чтобы поиск можно было запустить заранее,
+        например параллельно с классификацией запроса.
+
+        :return: Память запроса с заполненным списком кандидатов.
+        """
+        memory = self._new_memory(query, alias)
+        with track_token_usage(memory.token_usage), track_stage_timings(memory.stage_timings):
+            try:
+                with stage_deadline("retrieval"):
+                    await self._generate_and_search_queries(query, memory)
+            except StageDeadlineExceeded as e:
+                # Дальше идут найденные к этому моменту кандидаты (без них — ответ по умолчанию)
+                logger.warning(f"{e}: кандидатов найдено {len(memory.searching_candidates)}")
+        return memory
+
+    async def _analyze(self, memory: AgentMemory):
+        """Шаг 1: создает аналитическую записку и сохраняет ее в память запроса."""
+        with stage_deadline("analysis"):
+            analysis_note, best_fragments = await self.analysis_unit.generate(memory.query, memory.searching_candidates)
+        memory.analysis_note = analysis_note
+        memory.best_fragments = best_fragments
+
+    async def _vote(self, query: str, memory: AgentMemory) -> bool:
+        """
+        Шаг 2: голосование о релевантности записки.
+
+        Если голосование не уложилось в долю бюджета своего этапа, ответ
+        считается релевантным, как при выключенном голосовании.
+        """
+        try:
+            with stage_deadline("voting"):
+                return await self.voting_unit.vote(query, memory.analysis_note, memory.best_fragments)
+        except StageDeadlineExceeded as e:
+            logger.warning(f"{e}: голосование пропущено")
+            return True
+
+    def _save(self, memory: AgentMemory):
+        """Сохраняет память запроса."""
+        self.memory_manager.save(
+            memory.model_dump(),
+            model_answer_generator=self.parameters.ai_model_answer_generator,
+            models={
+                "queries_generate": self.parameters.ai_model_queries_generate,
+                "analysis_note": self.parameters.ai_model_analisys_note,
+                "voting": self.parameters.ai_model_voting,
+                "answer_generator": self.parameters.ai_model_answer_generator,
+            },
+        )
+
+    async def answer(self, memory: AgentMemory) -> str:
+        """
+        Вторая часть конвейера: анализ, голосование, ответ и сохранение.
+
+        :param memory: Память запроса, полученная из retrieve().
+        :return: Ответ пользователю.
+        """
+        # Токены этапов учитываются в памяти запроса и сохраняются вместе с ней
+        with track_token_usage(memory.token_usage), track_stage_timings(memory.stage_timings):
+            return await self._answer(memory)
+
+    async def _answer(self, memory: AgentMemory) -> str:
+        query = memory.query
+
+        if not memory.searching_candidates:
+            return memory.fail_answer
+
+        try:
+            answer = await self._analyze_and_answer(query, memory)
+        except StageDeadlineExceeded as e:
+            # Без записки или ответа продолжать нечего; бюджет запроса при этом не истек
+            logger.warning(f"{e}: возвращается ответ по умолчанию")
+            answer = memory.fail_answer
+
+        memory.answer = answer
+        
+        # Шаг 4: Сохранение
+        self._save(memory)
+        
+        return answer
+
+    async def _analyze_and_answer(self, query: str, memory: AgentMemory) -> str:
+        # Шаг 1: Анализ
+        await self._analyze(memory)
+
+        if self.voting_unit_is and self.parameters.speculative_answer:
+            # Шаги 2 и 3 параллельно: ответ отменяется при отрицательном голосовании
+            return await self._vote_and_answer(query, memory)
+
+        # Шаг 2: Голосование
+        answer_is_relevant = True
+        if self.voting_unit_is:
+            answer_is_relevant = await self._vote(query, memory)
+
+        # Шаг 3: Генерация ответа
+        if not answer_is_relevant:
+            return memory.fail_answer
+        with stage_deadline("answer"):
+            return await self.answer_generator.generate(
+                query, memory.analysis_note, memory.best_fragments, self.voting_unit_is
+            )
+
+    async def stream_answer(self, memory: AgentMemory) -> AsyncIterator[str]:
+        """
+        Потоковый вариант answer(): анализ и голосование выполняются как обычно,
+        а итоговый ответ отдается фрагментами по мере генерации.
+
+        :param memory: Память запроса, полученная из retrieve().
+        :return: Асинхронный итератор фрагментов ответа.
+        """
+        with track_token_usage(memory.token_usage), track_stage_timings(memory.stage_timings):
+            query = memory.query
+
+            if not memory.searching_candidates:
+                yield memory.fail_answer
+                return
+
+            try:
+                await self._analyze(memory)
+            except StageDeadlineExceeded as e:
+                logger.warning(f"{e}: возвращается ответ по умолчанию")
+                answer_is_relevant = False
+            else:
+                answer_is_relevant = True
+                if self.voting_unit_is:
+                    answer_is_relevant = await self._vote(query, memory)
+
+            if not answer_is_relevant:
+                memory.answer = memory.fail_answer
+                self._save(memory)
+                yield memory.fail_answer
+                return
+
+            chunks = []
+            try:
+                with stage_deadline("answer"):
+                    async for chunk in self.answer_generator.stream(
+                        query, memory.analysis_note, memory.best_fragments, self.voting_unit_is
+                    ):
+                        chunks.append(chunk)
+                        yield chunk
+            except StageDeadlineExceeded as e:
+                # Отправленные фрагменты не отзываются; если их нет — ответ по умолчанию
+                logger.warning(f"{e}: отправлено фрагментов ответа {len(chunks)}")
+                if not chunks:
+                    chunks.append(memory.fail_answer)
+                    yield memory.fail_answer
+
+            memory.answer = "".join(chunks)
+            self._save(memory)
 
     async def action_pipeline(self, query: str, alias: str = "bss.vip") -> str:
         """
         Основной конвейер, координирующий работу агента.
-        1. Очищает память.
+        1. Создает память запроса.
         2. Ищет кандидатов.
         3. Создает аналитическую записку.
         4. Проводит голосование (если включено).
         5. Генерирует ответ.
         6. Сохраняет результаты.
         """
-        self._clear_memory()
-        self.memory.query = query
-        self.memory.alias = alias
-        
-        await self._generate_and_search_queries(query)
+        memory = await self.retrieve(query, alias)
+        return await self.answer(memory)
 
-        if not self.memory.searching_candidates:
-            return self.memory.fail_answer
-
-        # Шаг 1: Анализ
-        analysis_note, best_fragments = self.analysis_unit.generate(query, self.memory.searching_candidates)
-        self.memory.analysis_note = analysis_note
-        self.memory.best_fragments = best_fragments
 
-        # Шаг 2: Голосование
-        answer_is_relevant = True
-        if self.voting_unit_is:
-            answer_is_relevant = self.voting_unit.vote(query, analysis_note, best_fragments)
+    async def stream_pipeline(self, query: str, alias: str = "bss.vip") -> AsyncIterator[str]:
+        """
+        Потоковый вариант action_pipeline.
 
-        # Шаг 3: Генерация ответа
-        if answer_is_relevant:
-            answer = self.answer_generator.generate(query, analysis_note, best_fragments, self.voting_unit_is)
-        else:
-            answer = self.memory.fail_answer
-            
-        self.memory.answer = answer
-        
-        # Шаг 4: Сохранение
-        self.memory_manager.save(self.memory.model_dump(), model_answer_generator=self.parameters.ai_model_answer_generator)
-        
-        return answer
\ No newline at end of file
+        :return: Асинхронный итератор фрагментов ответа.
+        """
+        memory = await self.retrieve(query, alias)
+        async for chunk in self.stream_answer(memory):
+            yield chunk
@@ -6,45 +6,43 @@ import uuid
 import json
 import logging
 import datetime
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Optional, Union
 
-from agents.ai_base import LLMGenerator
-from core.data_types import PromtsChain, AgentMemory, Parameters
+from agents.ai_base import AsyncLLMClient, Prompt
+from agents.candidates import top_fragments
+from agents.context_packer import ContextPacker
+from core.data_types import PromtsChain, AgentMemory, Parameters, Candidate
+from services.memory_writer import MemoryWriter
+from services.memory_index import MemoryIndex, default_index_path
+from services.tokens import TokenCounter, record_tokens
+from services.metrics import observe_stage, timed_stage
 
 # ... (Классы AnalysisUnit, VotingUnit, AnswerGenerator остаются без изменений) ...
 class AnalysisUnit:
     """
     Отвечает за создание аналитической записки на основе найденных фрагментов.
     """
-    def __init__(self, ai_client: LLMGenerator, prompts: PromtsChain, parameters: Parameters):
+    def __init__(self, ai_client: AsyncLLMClient, prompts: PromtsChain, parameters: Parameters):
         self.ai_client = ai_client
         self.prompts = prompts
         self.parameters = parameters
+        self.packer = ContextPacker.from_parameters(parameters)
+        self.token_counter = self.packer.counter
 
-    def _prepare_fragments_string(self, searching_candidates: List[Dict[str, Any]]) -> str:
+    def _prepare_fragments_string(self, searching_candidates: List[Union[Candidate, Dict[str, Any]]]) -> str:
         """
         Преобразует список кандидатов в строку для промпта.
-        Сортирует фрагменты по релевантности и обрезает до максимального количества.
-        """
-        text_candidates = []
-        fragments_tuples = []
-         
-        for d in searching_candidates:
-            fragments_tuples.extend([
-                (f"Заголовок текста: {d.get('title', '')} ссылка на текст: {d.get('link', '')} Фрагмент: {tpl[0]}", tpl[1]) 
-                for tpl in d.get("best_fragments_scores", [])
-            ])
-        
-        # Сортировка всех фрагментов из всех документов по их оценке
-        sorted_fragments = sorted(fragments_tuples, key=lambda x: x[1], reverse=True)
-        
-        # Выбор лучших фрагментов до заданного лимита
-        for tpl in sorted_fragments[:self.parameters.max_texts]:
-            text_candidates.append(tpl[0])
-
-        return "\n\n".join(text_candidates)
+        Фрагменты берутся по убыванию оценки (повторяющиеся — один раз), пока
+        не набрано max_texts или не исчерпан бюджет токенов (см. ContextPacker).
+        Кандидаты могут быть как Candidate, так и исходными ranking_dict.
+        """
+        packed = self.packer.pack(top_fragments(searching_candidates))
+        record_tokens("context", packed.tokens)
+        return packed.text
 
-    def generate(self, query: str, searching_candidates: List[Dict[str, Any]]) -> (str, str):
+    @timed_stage("analysis")
+    async def generate(self, query: str, searching_candidates: List[Union[Candidate, Dict[str, Any]]]) -> (str, str):
         """
         Генерирует аналитическую записку.
 
@@ -54,14 +52,18 @@ class AnalysisUnit:
         """
         best_fragments_str = self._prepare_fragments_string(searching_candidates)
         
-        prompt_plan = self.prompts.validation_plan.format(query, best_fragments_str)
+        prompt_plan = self.prompts.render(
+            "validation_plan", query, best_fragments_str, context=1, layout=self.parameters.prompt_layout
+        )
+        record_tokens("analysis_prompt", self.token_counter.count(prompt_plan))
         
-        analysis_note = self.ai_client(
+        analysis_note = await self.ai_client(
             prompt_plan,
             model=self.parameters.ai_model_analisys_note, 
             temperature=0.1, 
             max_tokens=5000
         )
+        record_tokens("analysis_completion", self.token_counter.count(analysis_note))
         return analysis_note, best_fragments_str
 
 
@@ -69,81 +71,201 @@ class VotingUnit:
     """
     Отвечает за проведение "голосования" для оценки релевантности ответа.
     """
-    def __init__(self, ai_client: LLMGenerator, prompts: PromtsChain, parameters: Parameters):
+    def __init__(self, ai_client: AsyncLLMClient, prompts: PromtsChain, parameters: Parameters):
         self.ai_client = ai_client
         self.prompts = prompts
         self.parameters = parameters
+        self.token_counter = TokenCounter(parameters.ai_model_voting)
 
-    def vote(self, query: str, analysis_note: str, best_fragments: str) -> bool:
+    @timed_stage("voting")
+    async def vote(self, query: str, analysis_note: str, best_fragments: str) -> bool:
         """
         Проводит голосование экспертов.
 
+        При parameters.voting_experts > 1 промпт голосования отправляется
+        несколько раз параллельно (generate_many), и итог определяется
+        большинством вердиктов. Неудачные вызовы не учитываются.
+
         :return: True, если ответ релевантен, иначе False.
+        :raises RuntimeError: Если ни один вызов голосования не удался.
         """
-        prompt_voting = self.prompts.validation_voting.format(query, analysis_note, best_fragments)
-        voting_result_text = self.ai_client(
-            prompt_voting,
-            model=self.parameters.ai_model_voting,
-            temperature=0.2, 
-            max_tokens=1000
+        prompt_voting = self.prompts.render(
+            "validation_voting", query, analysis_note, best_fragments, layout=self.parameters.prompt_layout
         )
-        
-        # Простая логика извлечения результата из текста
-        # REGEX ищет фразу "общее мнение: есть ответ" без учета регистра
-        voting = re.search(r"общее\s+мнение:\s+есть\s+ответ", voting_result_text, re.IGNORECASE)
-        
-        return bool(voting)
+        experts = max(1, self.parameters.voting_experts)
+        record_tokens("voting_prompt", self.token_counter.count(prompt_voting) * experts)
+
+        if experts == 1:
+            voting_results = [await self.ai_client(
+                prompt_voting,
+                model=self.parameters.ai_model_voting,
+                temperature=0.2, 
+                max_tokens=1000
+            )]
+        else:
+            responses = await self.ai_client.generate_many(
+                [prompt_voting] * experts,
+                max_concurrency=self.parameters.llm_max_concurrency,
+                return_exceptions=True,
+                model=self.parameters.ai_model_voting,
+                temperature=self.parameters.voting_expert_temperature,
+                max_tokens=1000,
+                # Вызовы должны быть независимыми: одинаковый промпт не берется из кеша
+                use_cache=False
+            )
+            voting_results = [r for r in responses if isinstance(r, str)]
+            if not voting_results:
+                raise RuntimeError(f"Все вызовы голосования завершились ошибкой: {responses[0]}")
+
+        verdicts = []
+        for voting_result_text in voting_results:
+            record_tokens("voting_completion", self.token_counter.count(voting_result_text))
+            # Простая логика извлечения результата из текста
+            # REGEX ищет фразу "общее мнение: есть ответ" без учета регистра
+            voting = re.search(r"общее\s+мнение:\s+есть\s+ответ", voting_result_text, re.IGNORECASE)
+            verdicts.append(bool(voting))
+
+        return sum(verdicts) * 2 > len(verdicts)
 
 
 class AnswerGenerator:
     """
     Отвечает за генерацию итогового ответа пользователю.
     """
-    def __init__(self, ai_client: LLMGenerator, prompts: PromtsChain, parameters: Parameters):
+    def __init__(self, ai_client: AsyncLLMClient, prompts: PromtsChain, parameters: Parameters):
         self.ai_client = ai_client
         self.prompts = prompts
         self.parameters = parameters
+        self.token_counter = TokenCounter(parameters.ai_model_answer_generator)
 
-    def generate(self, query: str, analysis_note: str, best_fragments: str, voting_enabled: bool) -> str:
-        """
-        Генерирует финальный ответ.
-
-        :param voting_enabled: Флаг, указывающий, используется ли отдельный узел голосования.
-        """
+    def _build_prompt(self, query: str, analysis_note: str, best_fragments: str, voting_enabled: bool) -> Prompt:
+        """Выбирает шаблон в зависимости от наличия голосования и подставляет данные."""
         if voting_enabled:
             # Если голосование было, используем промпт, который сразу генерирует ответ
-            prompt_template = self.prompts.answer_generation
+            template_name = "answer_generation"
         else:
             # Если голосования не было, промпт сам должен проверить наличие ответа
-            prompt_template = self.prompts.answer_generation_with_votin
+            template_name = "answer_generation_with_votin"
+
+        return self.prompts.render(
+            template_name, query, analysis_note, best_fragments, context=2, layout=self.parameters.prompt_layout
+        )
+
+    @timed_stage("answer")
+    async def generate(self, query: str, analysis_note: str, best_fragments: str, voting_enabled: bool) -> str:
+        """
+        Генерирует финальный ответ.
 
-        prompt_answer = prompt_template.format(query, analysis_note, best_fragments)
+        :param voting_enabled: Флаг, указывающий, используется ли отдельный узел голосования.
+        """
+        prompt_answer = self._build_prompt(query, analysis_note, best_fragments, voting_enabled)
+        record_tokens("answer_prompt", self.token_counter.count(prompt_answer))
         
-        answer = self.ai_client(
+        answer = await self.ai_client(
             prompt_answer,
             model=self.parameters.ai_model_answer_generator,
             temperature=0.1,
             max_tokens=5000
         )
+        record_tokens("answer_completion", self.token_counter.count(answer))
         return answer
 
+    @timed_stage("answer")
+    async def stream(self, query: str, analysis_note: str, best_fragments: str, voting_enabled: bool) -> AsyncIterator[str]:
+        """
+        Генерирует финальный ответ по частям по мере получения токенов от модели.
+
+        :param voting_enabled: Флаг, указывающий, используется ли отдельный узел голосования.
+        :return: Асинхронный итератор фрагментов ответа.
+        """
+        prompt_answer = self._build_prompt(query, analysis_note, best_fragments, voting_enabled)
+        record_tokens("answer_prompt", self.token_counter.count(prompt_answer))
+
+        chunks = []
+        try:
+            async for chunk in self.ai_client.stream(
+                prompt_answer,
+                model=self.parameters.ai_model_answer_generator,
+                temperature=0.1,
+                max_tokens=5000
+            ):
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            # Токены ответа считаются один раз по собранному тексту (в том числе при обрыве потока)
+            record_tokens("answer_completion", self.token_counter.count("".join(chunks)))
+
 
 class MemoryManager:
     """
-    Управляет сохранением памяти агента в файл.
-    Для каждого вызова метода save() генерируется уникальное имя файла.
+    Управляет сохранением памяти агента.
+
+    Если задан фоновый MemoryWriter, save() только ставит запись в его очередь,
+    и запись на диск не входит во время обработки запроса. Иначе для каждого
+    вызова save() синхронно создается отдельный JSON-файл с уникальным именем.
+    Если задан MemoryIndex, каждая записанная запись добавляется в индекс:
+    из потока MemoryWriter или, для JSON-файлов, из отдельного фонового потока,
+    чтобы вставка в SQLite не выполнялась в цикле событий.
     """
-    def __init__(self, parameters: Parameters):
+    def __init__(self, parameters: Parameters, writer: Optional[MemoryWriter] = None,
+                 index: Optional[MemoryIndex] = None):
         """
         Инициализирует менеджер памяти.
 
         :param parameters: Параметры приложения, содержащие путь для сохранения.
+        :param writer: Фоновый писатель JSONL-сегментов (None — по файлу на запрос).
+        :param index: Индекс сохраненной памяти (None — без индекса).
         """
         self.memory_path = parameters.memory_path
+        self.writer = writer
+        self.index = index
+        # Поток индексации JSON-файлов; создается при первой записи
+        self._index_executor: Optional[ThreadPoolExecutor] = None
+        if writer is not None and index is not None:
+            writer.on_written = index.add
         # Убеждаемся, что директория для сохранения существует
         if not os.path.exists(self.memory_path):
             os.makedirs(self.memory_path)
 
+    @classmethod
+    def from_parameters(cls, parameters: Parameters) -> "MemoryManager":
+        """
+        Создает менеджер памяти в формате, заданном parameters.memory_format:
+        "jsonl" — фоновая запись сегментов, "json" — файл на каждый запрос.
+        При parameters.memory_index_enabled записи добавляются в индекс SQLite.
+        """
+        index = None
+        if parameters.memory_index_enabled:
+            os.makedirs(parameters.memory_path, exist_ok=True)
+            index = MemoryIndex(parameters.memory_index_path or default_index_path(parameters.memory_path))
+        writer = None
+        if parameters.memory_format == "jsonl":
+            writer = MemoryWriter(
+                parameters.memory_path,
+                segment_max_bytes=parameters.memory_segment_max_bytes,
+                compression=parameters.memory_compression,
+                queue_size=parameters.memory_queue_size,
+                batch_size=parameters.memory_batch_size,
+                flush_interval=parameters.memory_flush_interval,
+                drop_policy=parameters.memory_drop_policy,
+            )
+        return cls(parameters, writer, index)
+
+    def start(self):
+        """Запускает фоновую запись (если используется)."""
+        if self.writer is not None:
+            self.writer.start()
+
+    def close(self):
+        """Дописывает очередь фоновой записи, останавливает ее и закрывает индекс."""
+        if self.writer is not None:
+            self.writer.close()
+        if self._index_executor is not None:
+            self._index_executor.shutdown(wait=True)
+            self._index_executor = None
+        if self.index is not None:
+            self.index.close()
+
     def _sanitize_filename(self, text: str, max_length: int = 50) -> str:
         """
         Очищает текст, чтобы его можно было безопасно использовать в имени файла.
@@ -161,7 +283,8 @@ class MemoryManager:
 
     def save(self, memory_data: Dict[str, Any], **kwargs):
         """
-        Сохраняет содержимое памяти в уникальный JSON-файл.
+        Сохраняет содержимое памяти: в очередь фоновой записи
+        или в уникальный JSON-файл.
 
         Имя файла генерируется на основе временной метки,
         запроса пользователя и уникального идентификатора (UUID)
@@ -172,6 +295,15 @@ class MemoryManager:
         """
         # Объединяем основные данные с дополнительными
         memory_data.update(kwargs)
+
+        with observe_stage("memory_save"):
+            self._save(memory_data)
+
+    def _save(self, memory_data: Dict[str, Any]):
+        memory_data.setdefault("saved_at", datetime.datetime.now().isoformat())
+        if self.writer is not None:
+            self.writer.submit(memory_data)
+            return
         
         # --- Генерация уникального имени файла ---
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -186,4 +318,15 @@ class MemoryManager:
             with open(json_path, 'w', encoding='utf-8') as f:
                 json.dump(memory_data, f, ensure_ascii=False, indent=4, default=str)
         except Exception as e:
-            logging.error(f"Не удалось сохранить файл памяти {json_path}: {e}")
\ No newline at end of file
+            logging.error(f"Не удалось сохранить файл памяти {json_path}: {e}")
+            return
+        if self.index is not None:
+            if self._index_executor is None:
+                self._index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-index")
+            self._index_executor.submit(self._index_file, json_path, memory_data)
+
+    def _index_file(self, json_path: str, memory_data: Dict[str, Any]):
+        try:
+            self.index.add_file(json_path, memory_data)
+        except Exception as e:
+            logging.error(f"Не удалось добавить {json_path} в индекс памяти: {e}")
\ No newline at end of file
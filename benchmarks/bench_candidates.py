@@ -0,0 +1,81 @@
+# benchmarks/bench_candidates.py
+
+"""
+Бенчмарк компактного представления кандидатов (Candidate) против полных ranking_dict.
+
+Берет кандидатов из сохраненной памяти агента (data/memory: *.json и JSONL-сегменты) и сравнивает:
+объем памяти процесса, размер сериализованной записи и время json.dumps/json.loads
+для памяти запроса в полном и компактном виде.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_candidates --memory-path data/memory --repeat 200
+"""
+import os
+import glob
+import json
+import time
+import argparse
+import tracemalloc
+
+from core.data_types import AgentMemory, Candidate, Parameters
+from services.memory_writer import SEGMENT_PREFIX, iter_segment
+
+
+def load_ranking_dicts(memory_path: str) -> list:
+    """Собирает ranking_dict из всех сохраненных записей памяти."""
+    records = []
+    for path in sorted(glob.glob(os.path.join(memory_path, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                records.append(json.load(f))
+            except json.JSONDecodeError:
+                continue
+    for path in sorted(glob.glob(os.path.join(memory_path, f"{SEGMENT_PREFIX}*.jsonl*"))):
+        records.extend(iter_segment(path))
+    return [d for record in records for d in record.get("searching_candidates", []) if isinstance(d, dict)]
+
+
+def measure(name: str, build, repeat: int):
+    """Печатает объем памяти, размер JSON и время сериализации."""
+    tracemalloc.start()
+    memory = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        payload = json.dumps(memory.model_dump(), ensure_ascii=False, default=str)
+    dump_ms = (time.perf_counter() - start) * 1000 / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        json.loads(payload)
+    load_ms = (time.perf_counter() - start) * 1000 / repeat
+
+    print(f"{name:>9}: память {allocated / 1024:8.1f} КБ, JSON {len(payload.encode('utf-8')) / 1024:8.1f} КБ, "
+          f"dump {dump_ms:6.2f} мс, load {load_ms:6.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк компактных кандидатов")
+    parser.add_argument("--memory-path", default=Parameters().memory_path)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    ranking_dicts = load_ranking_dicts(args.memory_path)
+    if not ranking_dicts:
+        print(f"Нет кандидатов в {args.memory_path}")
+        return
+    # Ответ сервиса поиска в исходном виде, как после response.json()
+    raw = json.dumps(ranking_dicts, ensure_ascii=False)
+    alias_to_site = Parameters().alias_to_site
+    print(f"Кандидатов: {len(ranking_dicts)}")
+
+    measure("полные", lambda: AgentMemory(searching_candidates=json.loads(raw)), args.repeat)
+    measure("Candidate", lambda: AgentMemory(searching_candidates=[
+        Candidate.from_ranking_dict(d, "bss.vip", alias_to_site) for d in json.loads(raw)
+    ]), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
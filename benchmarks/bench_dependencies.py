@@ -0,0 +1,86 @@
+# benchmarks/bench_dependencies.py
+
+"""
+Бенчмарк накладных расходов на создание зависимостей для одного запроса.
+
+Сравнивает прежнюю схему (Settings, промпты, LLM-клиент, ретривер, юниты
+и MemoryManager создаются заново на каждый вызов /expert_bot/) со схемой
+AppContainer, где на запрос создается только AgentMemory.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_dependencies --iterations 500
+"""
+import os
+import argparse
+import asyncio
+import tempfile
+import time
+
+from core.data_types import Settings, Parameters, PromtsChain, AgentMemory
+from agents.ai_base import AsyncLLMGenerator
+from services.retriever import AsyncPostRequest
+from agents.search_agent import SearchAgent
+from agents.classifying_agent import ClassifierAgent
+from agents.search_agent_units import AnalysisUnit, VotingUnit, AnswerGenerator, MemoryManager
+from piplines.dependencies import AppContainer, PROMPTS_FILE_PATH
+
+
+def build_per_request(parameters_kwargs: dict):
+    """Повторяет прежнюю цепочку Depends из main.py для одного запроса."""
+    settings = Settings()
+    parameters = Parameters(**parameters_kwargs)
+    prompts = PromtsChain.from_file(PROMPTS_FILE_PATH)
+    ai_client = AsyncLLMGenerator(api_key=settings.openai_api_key)
+    retriever = AsyncPostRequest(base_url=parameters.retrieval_base_url)
+    classifier = ClassifierAgent(prompts, parameters, AgentMemory(), ai_client)
+    searcher = SearchAgent(
+        prompts=prompts,
+        parameters=parameters,
+        memory=AgentMemory(),
+        ai_client=ai_client,
+        retriever=retriever,
+        analysis_unit=AnalysisUnit(ai_client, prompts, parameters),
+        voting_unit=VotingUnit(ai_client, prompts, parameters),
+        answer_generator=AnswerGenerator(ai_client, prompts, parameters),
+        memory_manager=MemoryManager(parameters),
+        voting_unit_is=True
+    )
+    return classifier, searcher
+
+
+def build_from_container(container: AppContainer):
+    """Схема с контейнером: агенты общие, на запрос создается только память."""
+    memory = container.search_agent._new_memory("вопрос", "bss.vip")
+    return container.classifier_agent, container.search_agent, memory
+
+
+def measure(func, iterations: int) -> float:
+    """Возвращает среднее время одного вызова в микросекундах."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main(iterations: int):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark_key")
+    with tempfile.TemporaryDirectory() as memory_path:
+        parameters_kwargs = {"memory_path": memory_path}
+        container = AppContainer.build(parameters=Parameters(**parameters_kwargs))
+
+        before = measure(lambda: build_per_request(parameters_kwargs), iterations)
+        after = measure(lambda: build_from_container(container), iterations)
+
+        await container.aclose()
+
+    print(f"Итераций: {iterations}")
+    print(f"Создание зависимостей на каждый запрос: {before:10.1f} мкс/запрос")
+    print(f"Контейнер приложения (только AgentMemory): {after:10.1f} мкс/запрос")
+    print(f"Ускорение: x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations))
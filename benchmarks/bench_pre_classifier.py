@@ -0,0 +1,85 @@
+# benchmarks/bench_pre_classifier.py
+
+"""
+Бенчмарк локального предклассификатора против меток LLM-классификатора.
+
+Размеченный набор задается JSONL-файлом со строками {"query": ..., "label": N},
+где label — тип, который вернул LLM-классификатор. Без файла используется
+набор из data/memory (тип 3) и встроенные примеры приветствий/благодарностей.
+
+Отчет: покрытие (доля запросов, классифицированных локально), точность
+на покрытой части, задержка локальной классификации и сэкономленное время LLM.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_pre_classifier --labels labels.jsonl --llm-latency-ms 900
+"""
+import json
+import random
+import argparse
+import statistics
+import time
+
+from agents.pre_classifier import (
+    RulePreClassifier, NgramPreClassifier, PreClassifier, load_memory_samples, SEED_SAMPLES
+)
+
+
+def load_labels(path: str) -> list:
+    """Загружает пары (запрос, метка LLM) из JSONL-файла."""
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                samples.append((record["query"], int(record["label"])))
+    return samples
+
+
+def evaluate(name: str, classifier, samples: list, llm_latency_ms: float):
+    """Печатает покрытие, точность и задержку классификатора."""
+    covered = correct = 0
+    latencies = []
+    for query, label in samples:
+        start = time.perf_counter()
+        result = classifier.classify(query)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        if result is not None:
+            covered += 1
+            # Типы 3 и 4 обрабатываются конвейером одинаково
+            correct += result.label == label or {result.label, label} <= {3, 4}
+
+    coverage = covered / len(samples) if samples else 0.0
+    accuracy = correct / covered if covered else 0.0
+    saved_ms = covered * llm_latency_ms
+    print(f"{name:>16}: покрытие {coverage:6.1%}, точность {accuracy:6.1%}, "
+          f"задержка p50 {statistics.median(latencies):7.1f} мкс, "
+          f"сэкономлено LLM {saved_ms / 1000:.1f} с на {len(samples)} запросах")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк предклассификатора")
+    parser.add_argument("--labels", help="JSONL с метками LLM-классификатора")
+    parser.add_argument("--memory-path", default="data/memory")
+    parser.add_argument("--threshold", type=float, default=0.95)
+    parser.add_argument("--llm-latency-ms", type=float, default=1000.0,
+                        help="Средняя задержка LLM-классификатора для оценки экономии")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_labels(args.labels) if args.labels else load_memory_samples(args.memory_path) + SEED_SAMPLES
+    random.Random(args.seed).shuffle(samples)
+
+    # Модель обучается на половине выборки и проверяется на второй половине
+    split = len(samples) // 2
+    train, test = samples[:split], samples[split:]
+    model = NgramPreClassifier(threshold=args.threshold).fit(train)
+    rules = RulePreClassifier()
+
+    print(f"Обучение: {len(train)}, проверка: {len(test)}")
+    evaluate("правила", rules, test, args.llm_latency_ms)
+    evaluate("n-граммы", model, test, args.llm_latency_ms)
+    evaluate("правила+n-граммы", PreClassifier([rules, model]), test, args.llm_latency_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# benchmarks/bench_replay.py
+
+"""
+Воспроизведение сохраненных запросов (data/memory) через конвейер без сети.
+
+Записи памяти агента подаются в bot_pipeline (или только в SearchAgent) с
+заданной конкурентностью. LLM и ретривер заменены локальными заглушками
+(benchmarks/stubs.py) с записанными ответами и настраиваемой задержкой;
+все остальное — настоящий AppContainer: кеши, лимиты, повторы, запись памяти.
+
+Отчет: пропускная способность, p50/p95/p99 длительности запроса, задержка
+цикла событий и память процесса в пересчете на запрос.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_replay --memory-path data/memory --requests 200 --concurrency 16 \\
+        --llm-latency lognormal:0.8:0.4 --retriever-latency lognormal:0.15:0.3
+"""
+import gc
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from core.data_types import Settings, Parameters, PromtsChain
+from piplines.dependencies import AppContainer, PROMPTS_FILE_PATH
+from piplines.expert_bot import bot_pipeline, BotDependencies
+from services.tracing import request_context
+from benchmarks.stubs import (
+    STATS, LatencyModel, ReplayData, StubServer, build_llm_app, build_retriever_app, load_records, replay_request_id,
+)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Квантиль q (0..1) по методу ближайшего ранга; 0 для пустого списка."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+class LoopLagMonitor:
+    """Замеряет, насколько позже запланированного просыпается задача в цикле событий."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def replay(records: List[Dict[str, Any]],
+                 container: AppContainer,
+                 requests: int,
+                 concurrency: int,
+                 mode: str = "pipeline",
+                 trace_memory: bool = False) -> Dict[str, Any]:
+    """
+    Воспроизводит записи через конвейер и собирает статистику.
+
+    :param records: Записи памяти агента.
+    :param container: Контейнер приложения, настроенный на заглушки.
+    :param requests: Число запросов (записи повторяются по кругу).
+    :param concurrency: Число одновременно выполняемых запросов.
+    :param mode: "pipeline" — bot_pipeline целиком, "search" — только SearchAgent.
+    :param trace_memory: Замерять выделения памяти через tracemalloc (замедляет выполнение).
+    :return: Отчет.
+    """
+    deps = BotDependencies(
+        classifier_agent=container.classifier_agent,
+        search_agent=container.search_agent,
+        optimistic_retrieval=container.parameters.optimistic_retrieval,
+        request_timeout=container.parameters.request_timeout,
+        stage_budget_shares=container.parameters.stage_budget_shares,
+        single_flight=container.pipeline_single_flight,
+    )
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i % len(records))
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    not_found = 0
+
+    async def worker():
+        nonlocal not_found
+        while True:
+            try:
+                index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            record = records[index]
+            started = time.perf_counter()
+            try:
+                with request_context(replay_request_id(index)):
+                    if mode == "search":
+                        answer = await container.search_agent(record["query"], record.get("alias", "bss.vip"))
+                    else:
+                        answer = await bot_pipeline(record["query"], record.get("alias", "bss.vip"), deps)
+                latencies.append(time.perf_counter() - started)
+                if not answer or answer == "НЕТ ОТВЕТА":
+                    not_found += 1
+            except Exception as e:
+                name = type(e).__name__
+                errors[name] = errors.get(name, 0) + 1
+
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "mode": mode,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_s": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=0.0),
+        },
+        "loop_lag_ms": {
+            "p50": percentile(monitor.lags, 0.50) * 1e3,
+            "p99": percentile(monitor.lags, 0.99) * 1e3,
+            "max": max(monitor.lags, default=0.0) * 1e3,
+        },
+        "errors": errors,
+        "not_found": not_found,
+    }
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report["memory_kb"] = {
+            "retained_per_request": current / 1024 / max(1, requests),
+            "peak_per_concurrent_request": peak / 1024 / max(1, concurrency),
+        }
+    return report
+
+
+async def main(args):
+    # Ретривер и SDK логируют каждый запрос на уровне INFO
+    logging.getLogger().setLevel(args.log_level)
+    records = load_records(args.memory_path, limit=args.limit)
+    prompts = PromtsChain.from_file(PROMPTS_FILE_PATH)
+    data = ReplayData(records, prompts)
+    llm = StubServer(build_llm_app(data, LatencyModel.parse(args.llm_latency), args.tokens_per_second, args.seed))
+    retriever = StubServer(build_retriever_app(data, LatencyModel.parse(args.retriever_latency), args.seed))
+
+    with llm, retriever, tempfile.TemporaryDirectory() as memory_path:
+        overrides = json.loads(args.parameters) if args.parameters else {}
+        parameters = Parameters(**{
+            "memory_path": memory_path,
+            "retrieval_base_url": retriever.url,
+            "llm_base_url": f"{llm.url}/v1",
+            **overrides,
+        })
+        container = AppContainer.build(settings=Settings(openai_api_key="replay"), parameters=parameters)
+        await container.start()
+        try:
+            report = await replay(records, container, args.requests or len(records), args.concurrency,
+                                  mode=args.mode, trace_memory=args.trace_memory)
+        finally:
+            await container.aclose()
+        report["stub_requests"] = {"llm": llm.app[STATS]["requests"], "retriever": retriever.app[STATS]["requests"]}
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"Записей: {len(records)}, запросов: {report['requests']}, конкурентность: {report['concurrency']}, "
+          f"режим: {report['mode']}")
+    print(f"Пропускная способность: {report['throughput_rps']:8.2f} запросов/с за {report['elapsed_s']:.2f} с")
+    latency = report["latency_s"]
+    print(f"Длительность запроса, с:  p50 {latency['p50']:.3f}  p95 {latency['p95']:.3f}  "
+          f"p99 {latency['p99']:.3f}  max {latency['max']:.3f}")
+    lag = report["loop_lag_ms"]
+    print(f"Задержка цикла событий, мс: p50 {lag['p50']:.2f}  p99 {lag['p99']:.2f}  max {lag['max']:.2f}")
+    if "memory_kb" in report:
+        memory = report["memory_kb"]
+        print(f"Память, КБ: удержано на запрос {memory['retained_per_request']:.1f}, "
+              f"пик на одновременный запрос {memory['peak_per_concurrent_request']:.1f}")
+    print(f"Ошибки: {report['errors'] or 'нет'}, без ответа: {report['not_found']}, "
+          f"вызовов заглушек: {report['stub_requests']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--memory-path", default="data/memory")
+    parser.add_argument("--limit", type=int, default=None, help="Максимальное число записей")
+    parser.add_argument("--requests", type=int, default=0, help="Число запросов (0 — по одному на запись)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=("pipeline", "search"), default="pipeline")
+    parser.add_argument("--llm-latency", default="lognormal:0.5:0.3", help="вид:медиана[:разброс], секунды")
+    parser.add_argument("--retriever-latency", default="lognormal:0.1:0.3")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Скорость генерации заглушки LLM")
+    parser.add_argument("--parameters", default="", help="JSON с переопределениями Parameters")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="Замерять память через tracemalloc")
+    parser.add_argument("--json", action="store_true", help="Вывести отчет в JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    asyncio.run(main(parser.parse_args()))
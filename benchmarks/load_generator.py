@@ -0,0 +1,235 @@
+# benchmarks/load_generator.py
+
+"""
+Генератор нагрузки на работающий сервис (POST /expert_bot/) с заданной интенсивностью.
+
+Нагрузка открытая: запросы отправляются по расписанию (равномерно или
+пуассоновским потоком) независимо от того, ответил ли сервис на предыдущие,
+поэтому рост очереди виден как рост задержки, а не как падение интенсивности.
+Интенсивность повышается ступенями (--rps 2,4,8,16); для каждой ступени
+выводятся достигнутая интенсивность, p50/p95/p99, доля ошибок и максимум
+одновременных запросов. Ступень считается насыщенной, если сервис не держит
+интенсивность, нарушает SLO по p95 или доля ошибок превышает порог.
+
+Вопросы берутся из записей памяти агента (data/memory). Для прогона без
+внешних сервисов запустите заглушки и сервис, направленный на них:
+    python -m benchmarks.stubs --memory-path data/memory --llm-port 8001 --retriever-port 8000
+    EXPERT_BOT_PARAMETERS=stubs.json uvicorn main:app --port 8080   # см. benchmarks/stubs.py
+    python -m benchmarks.load_generator --url http://127.0.0.1:8080 --rps 2,4,8,16 --duration 30
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from benchmarks.bench_replay import percentile
+from benchmarks.stubs import load_records
+
+
+class StepResult:
+    """Итоги одной ступени нагрузки."""
+
+    def __init__(self, target_rps: float):
+        self.target_rps = target_rps
+        self.latencies: List[float] = []
+        # Моменты успешных ответов (сек. от начала ступени)
+        self.completions: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.sent = 0
+        self.dropped = 0
+        self.not_found = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.duration = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return (sum(self.errors.values()) + self.dropped) / max(1, self.sent + self.dropped)
+
+    @property
+    def offered_rps(self) -> float:
+        """Фактическая интенсивность отправки (для пуассоновского потока отличается от целевой)."""
+        return (self.sent + self.dropped) / self.duration if self.duration else 0.0
+
+    @property
+    def achieved_rps(self) -> float:
+        """Темп успешных ответов между первым и последним из них."""
+        if len(self.completions) < 2:
+            return 0.0
+        span = max(self.completions) - min(self.completions)
+        return (len(self.completions) - 1) / span if span else 0.0
+
+    def report(self, slo_p95: float, max_error_rate: float) -> Dict[str, Any]:
+        achieved = self.achieved_rps
+        p95 = percentile(self.latencies, 0.95)
+        reasons = []
+        if achieved < 0.95 * self.offered_rps:
+            reasons.append("throughput")
+        if p95 > slo_p95:
+            reasons.append("p95")
+        if self.error_rate > max_error_rate:
+            reasons.append("errors")
+        return {
+            "target_rps": self.target_rps,
+            "offered_rps": self.offered_rps,
+            "achieved_rps": achieved,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "not_found": self.not_found,
+            "latency_s": {
+                "p50": percentile(self.latencies, 0.50),
+                "p95": p95,
+                "p99": percentile(self.latencies, 0.99),
+                "max": max(self.latencies, default=0.0),
+            },
+            "error_rate": self.error_rate,
+            "errors": self.errors,
+            "max_in_flight": self.max_in_flight,
+            "saturated": reasons,
+        }
+
+
+def arrival_times(rps: float, duration: float, arrival: str, rng: random.Random) -> List[float]:
+    """
+    Моменты отправки запросов (сек. от начала ступени).
+
+    :param rps: Целевая интенсивность.
+    :param duration: Длительность ступени.
+    :param arrival: "constant" — равные интервалы, "poisson" — экспоненциальные.
+    :param rng: Генератор случайных чисел.
+    """
+    if rps <= 0:
+        return []
+    if arrival == "constant":
+        return [i / rps for i in range(int(rps * duration))]
+    times, moment = [], rng.expovariate(rps)
+    while moment < duration:
+        times.append(moment)
+        moment += rng.expovariate(rps)
+    return times
+
+
+async def run_step(session: aiohttp.ClientSession,
+                   url: str,
+                   queries: List[Tuple[str, str]],
+                   rps: float,
+                   duration: float,
+                   arrival: str,
+                   max_in_flight: int,
+                   timeout: float,
+                   rng: random.Random) -> StepResult:
+    """
+    Выполняет одну ступень нагрузки.
+
+    :param session: HTTP-сессия.
+    :param url: Адрес конечной точки /expert_bot/.
+    :param queries: Пары (вопрос, alias).
+    :param rps: Целевая интенсивность.
+    :param duration: Длительность ступени (сек.).
+    :param arrival: Распределение интервалов ("constant" или "poisson").
+    :param max_in_flight: Предел одновременных запросов; сверх него запросы не отправляются и считаются отброшенными.
+    :param timeout: Таймаут одного запроса (сек.).
+    :param rng: Генератор случайных чисел.
+    :return: Итоги ступени.
+    """
+    result = StepResult(rps)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def send(query: str, alias: str):
+        result.in_flight += 1
+        result.max_in_flight = max(result.max_in_flight, result.in_flight)
+        started = time.perf_counter()
+        try:
+            async with session.post(url, json={"query": query, "alias": alias}, timeout=client_timeout) as response:
+                await response.read()
+                # 404 — штатный ответ «нет ответа», а не отказ сервиса
+                if response.status in (200, 404):
+                    result.latencies.append(time.perf_counter() - started)
+                    result.completions.append(loop.time() - step_started)
+                    result.not_found += response.status == 404
+                else:
+                    result.errors[f"HTTP {response.status}"] = result.errors.get(f"HTTP {response.status}", 0) + 1
+        except Exception as e:
+            name = "timeout" if isinstance(e, asyncio.TimeoutError) else type(e).__name__
+            result.errors[name] = result.errors.get(name, 0) + 1
+        finally:
+            result.in_flight -= 1
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    step_started = loop.time()
+    for moment in arrival_times(rps, duration, arrival, rng):
+        delay = step_started + moment - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if result.in_flight >= max_in_flight:
+            result.dropped += 1
+            continue
+        query, alias = rng.choice(queries)
+        result.sent += 1
+        tasks.append(asyncio.ensure_future(send(query, alias)))
+    await asyncio.gather(*tasks)
+    result.duration = duration
+    return result
+
+
+async def main(args):
+    records = load_records(args.memory_path, limit=args.limit)
+    queries = [(r["query"], args.alias or r.get("alias", "bss.vip")) for r in records if r.get("query")]
+    if not queries:
+        raise RuntimeError(f"В {args.memory_path} нет записей с вопросами")
+    rng = random.Random(args.seed)
+    url = args.url.rstrip("/") + "/expert_bot/"
+    steps = [float(value) for value in args.rps.split(",") if value.strip()]
+
+    reports = []
+    connector = aiohttp.TCPConnector(limit=args.max_in_flight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for rps in steps:
+            result = await run_step(session, url, queries, rps, args.duration, args.arrival,
+                                    args.max_in_flight, args.timeout, rng)
+            report = result.report(args.slo_p95, args.max_error_rate)
+            reports.append(report)
+            if not args.json:
+                latency = report["latency_s"]
+                print(f"{rps:7.1f} rps (отправлено {report['offered_rps']:6.2f}) -> {report['achieved_rps']:7.2f} rps  "
+                      f"p50 {latency['p50']:.3f}  p95 {latency['p95']:.3f}  p99 {latency['p99']:.3f} с  "
+                      f"ошибки {report['error_rate']:.1%}  в работе до {report['max_in_flight']}"
+                      + (f"  НАСЫЩЕНИЕ ({', '.join(report['saturated'])})" if report["saturated"] else ""))
+            if report["saturated"] and args.stop_on_saturation:
+                break
+            if args.pause:
+                await asyncio.sleep(args.pause)
+
+    saturation: Optional[float] = next((r["target_rps"] for r in reports if r["saturated"]), None)
+    sustained = max((r["target_rps"] for r in reports if not r["saturated"]), default=0.0)
+    if args.json:
+        print(json.dumps({"steps": reports, "saturation_rps": saturation, "max_sustained_rps": sustained},
+                         ensure_ascii=False, indent=2))
+        return
+    print(f"Максимальная устойчивая интенсивность: {sustained:.1f} rps; "
+          + (f"насыщение с {saturation:.1f} rps" if saturation is not None else "насыщение не достигнуто"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="Адрес сервиса")
+    parser.add_argument("--memory-path", default="data/memory", help="Источник вопросов")
+    parser.add_argument("--limit", type=int, default=None, help="Максимальное число записей")
+    parser.add_argument("--alias", default="", help="Alias для всех запросов (по умолчанию — из записи)")
+    parser.add_argument("--rps", default="1,2,4,8", help="Ступени интенсивности через запятую")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность ступени, с")
+    parser.add_argument("--pause", type=float, default=0.0, help="Пауза между ступенями, с")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Таймаут запроса, с")
+    parser.add_argument("--slo-p95", type=float, default=30.0, help="SLO по p95, с")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--stop-on-saturation", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Вывести отчет в JSON")
+    asyncio.run(main(parser.parse_args()))
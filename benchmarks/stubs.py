@@ -0,0 +1,453 @@
+# benchmarks/stubs.py
+
+"""
+Локальные заглушки внешних сервисов для бенчмарков и нагрузочных тестов.
+
+- OpenAI-совместимый эндпоинт /v1/chat/completions, который отвечает
+  записанными ответами из памяти агента (data/memory): классификация,
+  дополнительные запросы, аналитическая записка, голосование, ответ;
+- эндпоинт ретривера /query/, который отдает записанных кандидатов.
+
+Запись для ответа выбирается по заголовку X-Request-ID вида
+"replay-<номер записи>-..." (его проставляет конвейер, см. services/tracing.py),
+иначе — по вхождению вопроса записи в промпт или в запрос поиска.
+Задержка ответа задается моделью LatencyModel, доля ошибок — error_rate.
+
+Запуск заглушек отдельным процессом (для нагрузочного теста main.py):
+    python -m benchmarks.stubs --memory-path data/memory --llm-port 8001 --retriever-port 8000 \\
+        --llm-latency lognormal:0.8:0.4 --retriever-latency lognormal:0.15:0.3 --llm-error-rate 0.01
+
+Сервис при этом запускается с переопределенными адресами:
+    echo '{"llm_base_url": "http://127.0.0.1:8001/v1", "retrieval_base_url": "http://127.0.0.1:8000"}' > stubs.json
+    EXPERT_BOT_PARAMETERS=stubs.json uvicorn main:app --port 8080
+"""
+import os
+import re
+import glob
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from core.data_types import PromtsChain
+from services.memory_writer import SEGMENT_PREFIX, iter_segment
+from services.tracing import REQUEST_ID_HEADER
+from utils.utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+REPLAY_ID_PREFIX = "replay-"
+_REPLAY_ID = re.compile(rf"^{REPLAY_ID_PREFIX}(\d+)-")
+
+# Ответы голосования, если в записи его нет: вердикт восстанавливается по записанному ответу
+VOTING_POSITIVE = "Общее мнение: есть ответ"
+VOTING_NEGATIVE = "Общее мнение: нет ответа"
+
+# Счетчики запросов заглушки в состоянии приложения aiohttp
+STATS = web.AppKey("stats", dict)
+
+
+@dataclass
+class LatencyModel:
+    """
+    Распределение задержки ответа заглушки.
+
+    kind: "fixed" — всегда median; "uniform" — median ± jitter;
+    "lognormal" — median * exp(N(0, jitter)); "exponential" — среднее median.
+    """
+    kind: str = "fixed"
+    median: float = 0.0
+    jitter: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """
+        Разбирает строку вида "lognormal:0.8:0.5" (вид:медиана[:разброс], секунды).
+
+        :raises ValueError: Для неизвестного вида распределения.
+        """
+        kind, *values = spec.split(":")
+        if kind not in ("fixed", "uniform", "lognormal", "exponential"):
+            raise ValueError(f"Неизвестное распределение задержки: {kind}")
+        numbers = [float(v) for v in values] + [0.0, 0.0]
+        return cls(kind, numbers[0], numbers[1])
+
+    def sample(self, rng: random.Random) -> float:
+        """Возвращает задержку в секундах (не меньше 0)."""
+        if self.kind == "uniform":
+            value = rng.uniform(self.median - self.jitter, self.median + self.jitter)
+        elif self.kind == "lognormal":
+            value = self.median * math.exp(rng.gauss(0.0, self.jitter))
+        elif self.kind == "exponential":
+            value = rng.expovariate(1.0 / self.median) if self.median > 0 else 0.0
+        else:
+            value = self.median
+        return max(0.0, value)
+
+
+def load_records(memory_path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Загружает записи памяти агента: файлы *.json и JSONL-сегменты (в т.ч. сжатые).
+
+    Записи без вопроса или без кандидатов пропускаются.
+
+    :param memory_path: Каталог памяти (Parameters.memory_path).
+    :param limit: Максимальное число записей.
+    :return: Список записей.
+    """
+    paths = sorted(glob.glob(os.path.join(memory_path, "*.json")))
+    segments = sorted(glob.glob(os.path.join(memory_path, f"{SEGMENT_PREFIX}*.jsonl*")))
+    records = []
+
+    def accept(record) -> bool:
+        if isinstance(record, dict) and record.get("query") and record.get("searching_candidates"):
+            records.append(record)
+        return limit is not None and len(records) >= limit
+
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                if accept(json.load(f)):
+                    return records
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Пропущен файл памяти {path}: {e}")
+    for path in segments:
+        try:
+            for record in iter_segment(path):
+                if accept(record):
+                    return records
+        except (OSError, RuntimeError, json.JSONDecodeError) as e:
+            logger.warning(f"Пропущен сегмент памяти {path}: {e}")
+    return records
+
+
+def replay_request_id(index: int) -> str:
+    """Идентификатор запроса, по которому заглушки находят запись с номером index."""
+    return f"{REPLAY_ID_PREFIX}{index}-{uuid.uuid4().hex[:8]}"
+
+
+class ReplayData:
+    """Записанные ответы: выбор записи для запроса и ответа LLM для этапа."""
+
+    def __init__(self, records: List[Dict[str, Any]], prompts: PromtsChain):
+        """
+        :param records: Записи памяти агента (см. load_records).
+        :param prompts: Промпты конвейера: по началу шаблона определяется этап.
+        """
+        if not records:
+            raise ValueError("Нет записей для воспроизведения")
+        self.records = records
+        self._by_query = {normalize_query(r["query"]): i for i, r in enumerate(records)}
+        # Постоянная часть шаблона до первой подстановки
+        self._stage_prefixes = sorted(
+            ((name, str(template).split("{")[0].strip()) for name, template in prompts.model_dump().items()
+             if isinstance(template, str) and "{" in template),
+            key=lambda item: -len(item[1]),
+        )
+
+    def record_for(self, request_id: str, text: str = "", rng: Optional[random.Random] = None) -> Dict[str, Any]:
+        """
+        Находит запись по X-Request-ID, затем по вопросу в тексте.
+
+        Если запись не найдена, возвращается случайная (при заданном rng) или первая.
+        """
+        match = _REPLAY_ID.match(request_id or "")
+        if match and int(match.group(1)) < len(self.records):
+            return self.records[int(match.group(1))]
+        normalized = normalize_query(text)
+        index = self._by_query.get(normalized)
+        if index is None:
+            index = next((i for query, i in self._by_query.items() if query in normalized), None)
+        if index is None:
+            index = rng.randrange(len(self.records)) if rng is not None else 0
+        return self.records[index]
+
+    def stage(self, prompt_text: str) -> str:
+        """Имя шаблона промпта, с которого начинается текст (пустая строка, если не найден)."""
+        text = prompt_text.lstrip()
+        for name, prefix in self._stage_prefixes:
+            if prefix and text.startswith(prefix):
+                return name
+        return ""
+
+    def llm_response(self, record: Dict[str, Any], prompt_text: str) -> str:
+        """Записанный ответ модели на промпт этапа."""
+        stage = self.stage(prompt_text)
+        if stage == "classication":
+            return "3"
+        if stage == "query_generation":
+            return "\n".join(record.get("temp_queries", [])[1:]) or record["query"]
+        if stage == "validation_plan":
+            return record.get("analysis_note", "")
+        if stage == "validation_voting":
+            voting = record.get("voting", "")
+            if "мнение" in voting.lower():
+                return voting
+            answered = record.get("answer") not in ("", record.get("fail_answer", "НЕТ ОТВЕТА"))
+            return VOTING_POSITIVE if answered else VOTING_NEGATIVE
+        if stage.startswith("answer_generation"):
+            return record.get("answer", "")
+        return ""
+
+    @staticmethod
+    def ranking_dicts(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Записанные кандидаты (в полном или компактном виде)."""
+        return record.get("searching_candidates", [])
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    """Текст этапа: последнее сообщение (в раскладке "messages" контекст идет отдельным сообщением)."""
+    for message in reversed(messages):
+        if isinstance(message.get("content"), str):
+            return message["content"]
+    return ""
+
+
+def _error_response(rng: random.Random, error_rate: float, error_status: int) -> Optional[web.Response]:
+    """Ответ с ошибкой с вероятностью error_rate (формат ошибок OpenAI), иначе None."""
+    if error_rate <= 0 or rng.random() >= error_rate:
+        return None
+    return web.json_response(
+        {"error": {"message": "Stub failure", "type": "server_error", "code": error_status}},
+        status=error_status,
+        headers={"Retry-After": "0"} if error_status == 429 else None,
+    )
+
+
+def build_llm_app(data: ReplayData,
+                  latency: LatencyModel,
+                  tokens_per_second: float = 0.0,
+                  seed: int = 0,
+                  error_rate: float = 0.0,
+                  error_status: int = 503,
+                  stream_chunk_chars: int = 12) -> web.Application:
+    """
+    Заглушка OpenAI-совместимого API (POST /v1/chat/completions), в т.ч. потокового (stream=true, SSE).
+
+    :param data: Записанные ответы.
+    :param latency: Задержка до ответа (время до первого токена).
+    :param tokens_per_second: Скорость «генерации» (0 — ответ целиком после latency).
+    :param seed: Зерно генератора случайных задержек и ошибок.
+    :param error_rate: Доля запросов, на которые возвращается ошибка.
+    :param error_status: HTTP-статус ошибки (например, 429 или 503).
+    :param stream_chunk_chars: Размер фрагмента текста в потоковом ответе (символов).
+    """
+    rng = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        stats["requests"] += 1
+        error = _error_response(rng, error_rate, error_status)
+        if error is not None:
+            stats["errors"] += 1
+            return error
+
+        messages = body.get("messages", [])
+        prompt_text = _prompt_text(messages)
+        record = data.record_for(request.headers.get(REQUEST_ID_HEADER, ""), prompt_text, rng)
+        content = data.llm_response(record, prompt_text)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 3
+        completion_tokens = len(content) // 3
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        generation_time = completion_tokens / tokens_per_second if tokens_per_second > 0 else 0.0
+        await asyncio.sleep(latency.sample(rng))
+
+        if not body.get("stream"):
+            await asyncio.sleep(generation_time)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", ""),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        stats["streams"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(delta: dict, finish_reason: Optional[str] = None, **extra):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", ""),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                **extra,
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        pieces = [content[i:i + stream_chunk_chars] for i in range(0, len(content), stream_chunk_chars)]
+        await send({"role": "assistant", "content": ""})
+        for piece in pieces:
+            await asyncio.sleep(generation_time / len(pieces))
+            await send({"content": piece})
+        await send({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send(None, usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application(client_max_size=64 * 1024 ** 2)
+    app[STATS] = stats
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+def build_retriever_app(data: ReplayData,
+                        latency: LatencyModel,
+                        seed: int = 0,
+                        error_rate: float = 0.0,
+                        error_status: int = 503) -> web.Application:
+    """
+    Заглушка сервиса поиска (POST /query/): отдает записанных кандидатов.
+
+    Для запросов, которые не удалось сопоставить с записью, кандидаты
+    берутся из случайной записи.
+
+    :param data: Записанные ответы.
+    :param latency: Задержка ответа.
+    :param seed: Зерно генератора случайных задержек и ошибок.
+    :param error_rate: Доля запросов, на которые возвращается ошибка.
+    :param error_status: HTTP-статус ошибки.
+    """
+    rng = random.Random(seed + 1)
+    stats = {"requests": 0, "errors": 0}
+
+    async def query(request: web.Request) -> web.Response:
+        body = await request.json()
+        stats["requests"] += 1
+        await asyncio.sleep(latency.sample(rng))
+        error = _error_response(rng, error_rate, error_status)
+        if error is not None:
+            stats["errors"] += 1
+            return error
+        record = data.record_for(request.headers.get(REQUEST_ID_HEADER, ""), body.get("query", ""), rng)
+        return web.json_response({"ranking_dicts": data.ranking_dicts(record)})
+
+    app = web.Application(client_max_size=64 * 1024 ** 2)
+    app[STATS] = stats
+    app.router.add_post("/query/", query)
+    return app
+
+
+class StubServer:
+    """
+    Запускает приложение aiohttp в отдельном потоке со своим циклом событий,
+    чтобы работа заглушки не искажала задержки цикла событий измеряемого кода.
+    """
+
+    def __init__(self, app: web.Application, host: str = "127.0.0.1", port: int = 0):
+        """
+        :param app: Приложение aiohttp.
+        :param host: Адрес.
+        :param port: Порт (0 — выбрать свободный).
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "StubServer":
+        """Запускает сервер и дожидается готовности."""
+        self._thread = threading.Thread(target=self._run, name="stub-server", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError("Заглушка не запустилась")
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def stop(self):
+        """Останавливает сервер."""
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def wait_for_interrupt():
+    """Блокирует поток до Ctrl+C (подменяется в тестах)."""
+    threading.Event().wait()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Заглушки LLM и ретривера с записанными ответами")
+    parser.add_argument("--memory-path", default="data/memory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=8001)
+    parser.add_argument("--retriever-port", type=int, default=8000)
+    parser.add_argument("--llm-latency", default="lognormal:0.8:0.4", help="вид:медиана[:разброс], секунды")
+    parser.add_argument("--retriever-latency", default="lognormal:0.15:0.3")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--stream-chunk-chars", type=int, default=12)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-status", type=int, default=503)
+    parser.add_argument("--retriever-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from piplines.dependencies import PROMPTS_FILE_PATH
+    data = ReplayData(load_records(args.memory_path), PromtsChain.from_file(PROMPTS_FILE_PATH))
+    llm = StubServer(build_llm_app(
+        data, LatencyModel.parse(args.llm_latency), args.tokens_per_second, args.seed,
+        error_rate=args.llm_error_rate, error_status=args.llm_error_status,
+        stream_chunk_chars=args.stream_chunk_chars,
+    ), args.host, args.llm_port)
+    retriever = StubServer(build_retriever_app(
+        data, LatencyModel.parse(args.retriever_latency), args.seed, error_rate=args.retriever_error_rate,
+    ), args.host, args.retriever_port)
+
+    with llm, retriever:
+        print(f"Записей: {len(data.records)}")
+        print(f"LLM: {llm.url}/v1   ретривер: {retriever.url}/query/   (Ctrl+C — остановка)")
+        try:
+            wait_for_interrupt()
+        except KeyboardInterrupt:
+            pass
+        print(f"Запросов: LLM {llm.app[STATS]}, ретривер {retriever.app[STATS]}")
+
+
+if __name__ == "__main__":
+    main()
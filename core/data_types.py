@@ -3,11 +3,15 @@
 """Модуль для определения типов данных, используемых в приложении."""
 import os
 import json
-from typing import List
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Tuple, Union
 from pathlib import Path
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 
+from utils.utils import build_document_link
+from services.resilience import DEFAULT_STAGE_SHARES
+
 # ... (классы Settings, Parameters, AgentMemory остаются без изменений) ...
 
 class Settings(BaseSettings):
@@ -19,7 +23,24 @@ class Settings(BaseSettings):
 class Parameters(BaseModel):
     retrieval_base_url: str = "http://0.0.0.0:8000"
     retrieval_endpoint: str = "/query/"
+    retrieval_connection_limit: int = 100
+    retrieval_limit_per_host: int = 32
+    retrieval_keepalive_timeout: float = 30.0
+    retrieval_dns_cache_ttl: int = 300
+    # Предохранитель ретривера: размыкается при доле ошибок не ниже retrieval_breaker_failure_rate
+    # среди последних retrieval_breaker_window запросов (0 — предохранитель выключен)
+    retrieval_breaker_window: int = 20
+    retrieval_breaker_min_calls: int = 5
+    retrieval_breaker_failure_rate: float = 0.5
+    retrieval_breaker_reset_timeout: float = 30.0
+    # Кеш последних успешных ответов ретривера на случай его недоступности (0 — выключен)
+    retrieval_stale_cache_size: int = 512
+    retrieval_stale_cache_ttl: float = 6 * 3600.0
+    # Одинаковые одновременные запросы к ретриверу выполняются один раз
+    retrieval_coalescing: bool = True
     llm_candidates_quantity: int = 15
+    # Базовый URL OpenAI-совместимого API (для нагрузочных тестов — адрес заглушки)
+    llm_base_url: str = "https://api.vsegpt.ru:7090/v1"
     ai_model_classifier: str = "openai/gpt-4o-mini"
     ai_model_queries_generate: str = "openai/gpt-4o-mini"
     ai_model_analisys_note: str = "openai/gpt-4o-mini"
@@ -28,27 +49,196 @@ class Parameters(BaseModel):
     ai_temperature: float = 0.0
     ai_max_tokens: int = 3000
     max_texts: int = 30
+    # Бюджет токенов на фрагменты в промптах анализа, голосования и ответа
+    # (0 — ограничение только по max_texts)
+    context_token_budget: int = 6000
+    # Бюджеты для отдельных моделей, например {"openai/gpt-4o-mini": 12000}
+    context_token_budgets: dict = {}
+    # Максимальная длина одного фрагмента; длинные обрезаются по границе предложения
+    context_max_fragment_tokens: int = 512
+    # Раскладка промптов: "flat" — одна строка, "messages" — общий контекст (подборка
+    # фрагментов) отдельным первым сообщением, чтобы промпты анализа и ответа имели
+    # общий префикс и попадали в кеш промптов провайдера
+    prompt_layout: str = "flat"
+    # Запрашивать usage в потоковом режиме (stream_options.include_usage)
+    llm_stream_usage: bool = False
+    # Параллельные запросы к LLM (generate_many) и лимиты провайдера по моделям:
+    # {"openai/gpt-4o-mini": {"rpm": 500, "tpm": 200000}, "*": {...}}
+    llm_max_concurrency: int = 8
+    llm_rate_limits: dict = {}
+    # Число независимых вызовов голосования; итог — большинство (1 — один вызов, как раньше)
+    voting_experts: int = 1
+    voting_expert_temperature: float = 0.7
+    # Бюджет времени на весь запрос в секундах (0 — без ограничения); делится между
+    # этапами по долям stage_budget_shares (неизрасходованное время переходит дальше)
+    request_timeout: float = 0.0
+    stage_budget_shares: dict = dict(DEFAULT_STAGE_SHARES)
+    # Таймаут одной попытки вызова LLM и повторы временных ошибок (429, 5xx, сеть)
+    llm_call_timeout: float = 120.0
+    llm_max_retries: int = 2
+    llm_retry_base_delay: float = 0.5
+    llm_retry_max_delay: float = 8.0
+    # Дублирующий запрос после квантиля длительности модели (например, 0.95; 0 — выключено)
+    llm_hedge_quantile: float = 0.0
+    llm_hedge_min_samples: int = 20
+    # Генерация ответа параллельно с голосованием (отменяется при отрицательном вердикте)
+    speculative_answer: bool = False
+    # Поиск по исходному запросу одновременно с генерацией дополнительных запросов
+    overlap_query_generation: bool = False
+    # Поиск параллельно с классификацией (отменяется для приветствий и благодарностей)
+    optimistic_retrieval: bool = False
+    # Одинаковые одновременные вопросы (по нормализованному тексту и alias) обрабатываются один раз
+    request_coalescing: bool = True
+    # Трассировка этапов: "none", "memory" (в памяти процесса) или "file" (JSONL в tracing_path)
+    tracing_exporter: str = "none"
+    tracing_path: str = ""
+    # Локальная предклассификация без LLM (правила и n-граммная модель)
+    pre_classifier_enabled: bool = False
+    pre_classifier_model_path: str = os.path.join("data", "pre_classifier.json")
+    pre_classifier_threshold: float = 0.95
+    # Кеш готовых ответов SearchAgent (точный и, опционально, семантический)
+    answer_cache_enabled: bool = False
+    answer_cache_size: int = 1024
+    answer_cache_ttl: float = 3600.0
+    answer_cache_semantic: bool = False
+    answer_cache_similarity: float = 0.92
+    # Мемоизация ответов LLM по хешу промпта и всех параметров запроса (model, temperature, stop и т.д.)
+    llm_cache_enabled: bool = False
+    llm_cache_size: int = 4096
+    llm_cache_ttl: float = 86400.0
+    # Путь к SQLite-файлу дискового уровня (пустая строка — только память)
+    llm_cache_path: str = ""
+    # Общий для процессов-воркеров уровень кешей ответов, LLM и ретривера:
+    # "memory" — только память процесса, "sqlite" — файлы в cache_path, "redis" — сервер cache_redis_url
+    cache_backend: str = "memory"
+    cache_path: str = os.path.join("data", "cache")
+    cache_redis_url: str = "redis://127.0.0.1:6379/0"
+    # Таймаут соединения и операций Redis, сек.: недоступный сервер не должен занимать потоки без ограничения
+    cache_redis_timeout: float = 1.0
     app_name: str = "expert_bot"
     project_host: str = "0.0.0.0"
     project_port: int = 8080
+    # Число процессов uvicorn при запуске python main.py (0 — по числу ядер)
+    workers: int = 1
     alias_to_site: dict = {
         "bss.vip": "https://vip.1gl.ru", 
         "bss": "https://1gl.ru",
         "uss": "https://1jur.ru"
     }
     memory_path: str = os.path.join("data", "memory")
+    # "jsonl" — фоновая пакетная запись сегментов, "json" — файл на каждый запрос
+    memory_format: str = "jsonl"
+    memory_compression: str = ""  # "" или "zstd" (нужен пакет zstandard)
+    memory_segment_max_bytes: int = 64 * 1024 * 1024
+    memory_queue_size: int = 1000
+    memory_batch_size: int = 50
+    memory_flush_interval: float = 1.0
+    memory_drop_policy: str = "drop_newest"  # или "drop_oldest"
+    # Индекс SQLite по сохраненной памяти (запрос, alias, время, исход, этапы, ссылка на запись)
+    memory_index_enabled: bool = False
+    memory_index_path: str = ""  # пустая строка — <memory_path>/index.sqlite
+    # Хранить в памяти запроса только нужные конвейеру поля кандидатов (см. Candidate)
+    slim_candidates: bool = True
+    # Подмножество полей, запрашиваемое у сервиса поиска (пустой список — все поля)
+    retrieval_fields: list[str] = []
+    # Объединение выдач нескольких запросов: дедупликация документов по (mod_id, doc_id)
+    # и фрагментов по тексту
+    candidate_dedup: bool = True
+    candidate_fusion: str = "max"  # "max" или "rrf" (reciprocal rank fusion)
+    candidate_rrf_k: int = 60
+
+    @classmethod
+    def from_env(cls, variable: str = "EXPERT_BOT_PARAMETERS") -> "Parameters":
+        """
+        Создает параметры с переопределениями из JSON-файла, путь к которому задан переменной окружения.
+
+        :param variable: Имя переменной окружения; если она не задана — значения по умолчанию.
+        :return: Экземпляр Parameters.
+        :raises FileNotFoundError: Если файл не найден.
+        """
+        file_path = os.environ.get(variable, "")
+        if not file_path:
+            return cls()
+        path = Path(file_path)
+        if not path.exists():
+            raise FileNotFoundError(f"Файл с параметрами не найден по пути: {path}")
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+# Поля документа, которые использует конвейер; остальное (text, text_lem, phrases...)
+# отбрасывается при получении ответа сервиса поиска
+CANDIDATE_FIELDS = ("mod_id", "doc_id", "title", "link", "best_fragments_scores")
+
+@dataclass(slots=True)
+class Candidate:
+    """
+    Компактное представление документа-кандидата из ответа сервиса поиска.
+
+    Хранит только поля, нужные для анализа и ссылок, вместо полного
+    ranking_dict с текстом документа, лемматизацией и служебными полями.
+    """
+    mod_id: str = ""
+    doc_id: str = ""
+    title: str = ""
+    link: str = ""
+    best_fragments_scores: List[Tuple[str, float]] = field(default_factory=list)
+
+    @classmethod
+    def from_ranking_dict(cls, data: Dict[str, Any], alias: Optional[str] = None,
+                          alias_to_site: Optional[dict] = None) -> "Candidate":
+        """
+        Проецирует ranking_dict сервиса поиска на нужные поля.
+
+        :param data: Документ из ответа сервиса поиска.
+        :param alias: Алиас сайта; нужен, чтобы собрать ссылку, если ее нет в ответе.
+        :param alias_to_site: Сопоставление алиаса с адресом сайта.
+        :return: Экземпляр Candidate.
+        """
+        mod_id = str(data.get("mod_id", ""))
+        doc_id = str(data.get("doc_id", ""))
+        link = data.get("link", "")
+        if not link and alias and alias_to_site and mod_id and doc_id:
+            link = build_document_link(alias, mod_id, doc_id, alias_to_site)
+        return cls(
+            mod_id=mod_id,
+            doc_id=doc_id,
+            title=data.get("title", ""),
+            link=link,
+            best_fragments_scores=[(tpl[0], tpl[1]) for tpl in data.get("best_fragments_scores", [])],
+        )
+
+    @classmethod
+    def coerce(cls, item: Union["Candidate", Dict[str, Any]]) -> "Candidate":
+        """Возвращает Candidate для кандидата в любом из форматов (ranking_dict или Candidate)."""
+        return item if isinstance(item, cls) else cls.from_ranking_dict(item)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+# Ответ агента, если ответ не найден
+FAIL_ANSWER = "НЕТ ОТВЕТА"
+
 
 class AgentMemory(BaseModel):
+    # Идентификатор запроса (trace_id трассировки, заголовок X-Request-ID)
+    request_id: str = ""
     query: str = ""
     alias: str = "bss.vip"
-    fail_answer: str = "НЕТ ОТВЕТА"
-    searching_candidates: list[dict] = Field(default_factory=list)
+    fail_answer: str = FAIL_ANSWER
+    # Candidate при parameters.slim_candidates, иначе исходные ranking_dict
+    searching_candidates: list[Union[dict, Candidate]] = Field(default_factory=list)
     temp_queries: list[str] = Field(default_factory=list)
     analysis_note: str = ""
     voting: str = ""
     answer: str = ""
     count: int = 1
     best_fragments: str = ""
+    # Токены по этапам: "context", "<этап>_prompt", "<этап>_completion"
+    token_usage: dict[str, int] = Field(default_factory=dict)
+    # Время начала обработки (ISO) и длительности этапов в секундах
+    created_at: str = ""
+    stage_timings: dict[str, float] = Field(default_factory=dict)
 
 
 class PromtsChain(BaseModel):
@@ -64,6 +254,45 @@ class PromtsChain(BaseModel):
     answer_generation: str
     classication: str
     answer_generation_with_votin: str
+    # Раскладка "messages" (см. render): системный промпт, общий контекст и ссылка на него
+    system_prompt: str = ""
+    shared_context_template: str = "ПОДБОРКА ФРАГМЕНТОВ БУХГАЛТЕРСКИХ ТЕКСТОВ:\n{}"
+    shared_context_reference: str = "(подборка фрагментов бухгалтерских текстов приведена в предыдущем сообщении)"
+
+    def render(self, name: str, *args, context: Optional[int] = None,
+               layout: str = "flat") -> Union[str, List[Dict[str, str]]]:
+        """
+        Подставляет аргументы в шаблон промпта.
+
+        В раскладке "flat" возвращает строку, как template.format(*args).
+        В раскладке "messages" возвращает список сообщений: системный промпт,
+        общий контекст (аргумент с индексом context) и инструкцию этапа, в которой
+        контекст заменен ссылкой на предыдущее сообщение. Первые сообщения
+        одинаковы для всех этапов запроса, поэтому провайдер может переиспользовать
+        их из кеша промптов.
+
+        :param name: Имя шаблона (поле класса).
+        :param args: Позиционные аргументы шаблона.
+        :param context: Индекс аргумента с общим контекстом (None — контекста нет).
+        :param layout: "flat" или "messages".
+        :return: Строка или список сообщений чата.
+        :raises ValueError: Если указана неизвестная раскладка.
+        """
+        template = getattr(self, name)
+        if layout == "flat":
+            return template.format(*args)
+        if layout != "messages":
+            raise ValueError(f"Неизвестная раскладка промптов: {layout}")
+
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        args = list(args)
+        if context is not None:
+            messages.append({"role": "user", "content": self.shared_context_template.format(args[context])})
+            args[context] = self.shared_context_reference
+        messages.append({"role": "user", "content": template.format(*args)})
+        return messages
 
     @classmethod
     def from_file(cls, file_path: str | Path):
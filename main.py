@@ -1,105 +1,227 @@
 # main.py
 
-from fastapi import FastAPI, HTTPException, Depends
-from typing import Annotated
-
-from piplines.expert_bot import bot_pipeline, BotDependencies
-from core.data_types import QueryRequest, AnswerResponse, Settings, Parameters, PromtsChain, AgentMemory
-from agents.ai_base import LLMGenerator
-from services.retriever import AsyncPostRequest
+import os
+import json
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import Annotated, Optional
+
+from piplines.expert_bot import bot_pipeline, bot_pipeline_stream, BotDependencies
+from piplines.dependencies import AppContainer
+from core.data_types import QueryRequest, AnswerResponse, Parameters, FAIL_ANSWER
 from agents.search_agent import SearchAgent
 from agents.classifying_agent import ClassifierAgent
-from agents.search_agent_units import AnalysisUnit, VotingUnit, AnswerGenerator, MemoryManager
+from services.resilience import DeadlineExceeded
+from services.single_flight import SingleFlight
+from services.metrics import REGISTRY
+from services.tracing import REQUEST_ID_HEADER, new_request_id, request_context
 
+logger = logging.getLogger(__name__)
 
-# --- Создание зависимостей ---
+# Число воркеров, запущенных python main.py (передается процессам uvicorn через окружение)
+WORKERS_ENV = "EXPERT_BOT_WORKERS"
 
-def get_settings() -> Settings:
-    return Settings()
 
-def get_parameters() -> Parameters:
-    return Parameters()
+# --- Жизненный цикл приложения ---
 
-def get_prompts() -> PromtsChain:
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     """
-    Зависимость для получения промптов.
-    Загружает промпты из внешнего JSON-файла.
+    Создает долгоживущие зависимости один раз при старте приложения
+    и освобождает их при остановке.
     """
-    # Путь к файлу с промптами
-    PROMPTS_FILE_PATH = "configs/prompts.json"
-    return PromtsChain.from_file(PROMPTS_FILE_PATH)
+    # Переопределения параметров — JSON-файл из EXPERT_BOT_PARAMETERS (например, адреса заглушек)
+    app.state.container = AppContainer.build(parameters=Parameters.from_env())
+    if int(os.environ.get(WORKERS_ENV, "1")) > 1:
+        # Метрики ведутся в памяти процесса: ряды каждого воркера помечаются его pid
+        REGISTRY.const_labels["worker"] = str(os.getpid())
+    await app.state.container.start()
+    yield
+    await app.state.container.aclose()
 
-# Создаем зависимости как функции, которые FastAPI сможет вызывать
-def get_ai_client(settings: Annotated[Settings, Depends(get_settings)]) -> LLMGenerator:
-    return LLMGenerator(api_key=settings.openai_api_key)
 
-def get_retriever(parameters: Annotated[Parameters, Depends(get_parameters)]) -> AsyncPostRequest:
-    return AsyncPostRequest(base_url=parameters.retrieval_base_url)
+# --- Зависимости ---
 
-def get_classifier_agent(
-    prompts: Annotated[PromtsChain, Depends(get_prompts)],
-    parameters: Annotated[Parameters, Depends(get_parameters)],
-    ai_client: Annotated[LLMGenerator, Depends(get_ai_client)],
-) -> ClassifierAgent:
-    # Память для классификатора обычно не требует сохранения между запросами
-    return ClassifierAgent(prompts, parameters, AgentMemory(), ai_client)
+def get_container(request: Request) -> AppContainer:
+    """Зависимость для получения контейнера, созданного в lifespan."""
+    return request.app.state.container
 
-def get_search_agent(
-    prompts: Annotated[PromtsChain, Depends(get_prompts)],
-    parameters: Annotated[Parameters, Depends(get_parameters)],
-    ai_client: Annotated[LLMGenerator, Depends(get_ai_client)],
-    retriever: Annotated[AsyncPostRequest, Depends(get_retriever)],
-) -> SearchAgent:
-    # Создание юнитов, которые будут внедрены в SearchAgent
-    analysis_unit = AnalysisUnit(ai_client, prompts, parameters)
-    voting_unit = VotingUnit(ai_client, prompts, parameters)
-    answer_generator = AnswerGenerator(ai_client, prompts, parameters)
-    memory_manager = MemoryManager(parameters)
-    
+def get_parameters(container: Annotated[AppContainer, Depends(get_container)]) -> Parameters:
+    return container.parameters
+
+def get_classifier_agent(container: Annotated[AppContainer, Depends(get_container)]) -> ClassifierAgent:
+    return container.classifier_agent
+
+def get_search_agent(container: Annotated[AppContainer, Depends(get_container)]) -> SearchAgent:
     # Память для поисковика создается новая для каждого запроса внутри агента
-    return SearchAgent(
-        prompts=prompts,
-        parameters=parameters,
-        memory=AgentMemory(),
-        ai_client=ai_client,
-        retriever=retriever,
-        analysis_unit=analysis_unit,
-        voting_unit=voting_unit,
-        answer_generator=answer_generator,
-        memory_manager=memory_manager,
-        voting_unit_is=True # Конфигурация
-    )
+    return container.search_agent
+
+def get_single_flight(request: Request) -> Optional[SingleFlight]:
+    # Контейнера нет, если приложение запущено без lifespan (тесты с подменой агентов)
+    container = getattr(request.app.state, "container", None)
+    return container.pipeline_single_flight if container is not None else None
 
 
 # Создаем экземпляр FastAPI
-app = FastAPI(title="LLM Chain Service")
+app = FastAPI(title="LLM Chain Service", lifespan=lifespan)
 
 
 @app.post("/expert_bot/", response_model=AnswerResponse)
 async def process_query(
     request: QueryRequest,
-    # FastAPI автоматически создаст и передаст зависимости
+    # FastAPI передаст долгоживущих агентов из контейнера приложения
     classifier: Annotated[ClassifierAgent, Depends(get_classifier_agent)],
     searcher: Annotated[SearchAgent, Depends(get_search_agent)],
+    parameters: Annotated[Parameters, Depends(get_parameters)],
+    single_flight: Annotated[Optional[SingleFlight], Depends(get_single_flight)],
+    http_request: Request,
+    response: Response,
 ):
     """
     Основной эндпоинт для обработки запросов пользователя.
     Использует систему внедрения зависимостей FastAPI для получения агентов.
+    Идентификатор запроса берется из заголовка X-Request-ID (или создается)
+    и возвращается в том же заголовке ответа.
     """
     # Собираем зависимости для основного конвейера
-    deps = BotDependencies(classifier_agent=classifier, search_agent=searcher)
+    deps = BotDependencies(
+        classifier_agent=classifier,
+        search_agent=searcher,
+        optimistic_retrieval=parameters.optimistic_retrieval,
+        request_timeout=parameters.request_timeout,
+        stage_budget_shares=parameters.stage_budget_shares,
+        single_flight=single_flight,
+    )
     
     # Вызываем основной конвейер
-    answer_text = await bot_pipeline(request.query, request.alias, deps)
-    print(f"Ответ: {answer_text}")
+    with request_context(http_request.headers.get(REQUEST_ID_HEADER, "")) as request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+        try:
+            answer_text = await bot_pipeline(request.query, request.alias, deps)
+        except DeadlineExceeded:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded",
+                                headers={REQUEST_ID_HEADER: request_id})
+    logger.debug(f"Ответ: {answer_text}")
         
-    if not answer_text or answer_text == "НЕТ ОТВЕТА":
+    if not answer_text or answer_text == FAIL_ANSWER:
         raise HTTPException(status_code=404, detail="No answer found")
     
     # В модели AnswerResponse два поля, формируем соответствующий ответ
     return AnswerResponse(answer=answer_text, answer_text=answer_text)
 
-# Запуск сервера (если файл запущен напрямую)
+def _sse_event(data: dict, event: str = "") -> str:
+    """Форматирует событие Server-Sent Events."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/expert_bot/stream/")
+async def process_query_stream(
+    request: QueryRequest,
+    classifier: Annotated[ClassifierAgent, Depends(get_classifier_agent)],
+    searcher: Annotated[SearchAgent, Depends(get_search_agent)],
+    parameters: Annotated[Parameters, Depends(get_parameters)],
+    http_request: Request,
+):
+    """
+    Потоковый эндпоинт (Server-Sent Events).
+
+    Фрагменты ответа отправляются событиями `data: {"delta": "..."}` по мере
+    генерации, в конце — событие `done` с полным ответом и признаком `found`.
+    При ошибке отправляется событие `error`.
+    """
+    deps = BotDependencies(
+        classifier_agent=classifier,
+        search_agent=searcher,
+        optimistic_retrieval=parameters.optimistic_retrieval,
+        request_timeout=parameters.request_timeout,
+        stage_budget_shares=parameters.stage_budget_shares,
+    )
+
+    request_id = http_request.headers.get(REQUEST_ID_HEADER, "") or new_request_id()
+
+    async def events():
+        chunks = []
+        try:
+            with request_context(request_id):
+                async for chunk in bot_pipeline_stream(request.query, request.alias, deps):
+                    chunks.append(chunk)
+                    yield _sse_event({"delta": chunk})
+        except DeadlineExceeded:
+            logger.error("Истек бюджет времени потокового запроса")
+            yield _sse_event({"detail": "Request deadline exceeded"}, event="error")
+            return
+        except Exception as e:
+            logger.error(f"Ошибка потоковой обработки запроса: {e}")
+            yield _sse_event({"detail": "Internal error"}, event="error")
+            return
+        answer_text = "".join(chunks)
+        found = bool(answer_text) and answer_text != FAIL_ANSWER
+        yield _sse_event({"answer": answer_text, "found": found}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", REQUEST_ID_HEADER: request_id},
+    )
+
+
+@app.get("/health")
+async def health(container: Annotated[AppContainer, Depends(get_container)]):
+    """Состояние сервиса, метрики пула соединений и предохранителя ретривера, кеша ответов."""
+    status = {"status": "ok", "retriever": container.retriever.stats()}
+    if status["retriever"].get("breaker", {}).get("state", "closed") != "closed":
+        status["status"] = "degraded"
+    if container.answer_cache is not None:
+        status["answer_cache"] = container.answer_cache.metrics()
+    if container.memory_manager.writer is not None:
+        status["memory_writer"] = container.memory_manager.writer.metrics()
+    if hasattr(container.ai_client, "metrics"):
+        status["llm_cache"] = container.ai_client.metrics()
+    status["llm_usage"] = container.ai_client.usage_metrics()
+    if container.pipeline_single_flight is not None:
+        status["pipeline_single_flight"] = container.pipeline_single_flight.metrics()
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Метрики процесса в текстовом формате Prometheus.
+
+    При нескольких воркерах ответ содержит ряды одного (случайного) воркера
+    с меткой worker; суммы по сервису считаются в Prometheus по всем воркерам.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def worker_count(requested: int) -> int:
+    """Число процессов-воркеров: заданное или, при 0, по числу ядер."""
+    return requested if requested > 0 else (os.cpu_count() or 1)
+
+
+# Запуск сервера (если файл запущен напрямую):
+#   python main.py --workers 0   # воркеров по числу ядер
+# Каждый воркер — отдельный процесс со своим контейнером; общий уровень кешей
+# задается Parameters.cache_backend, параметры — файлом из EXPERT_BOT_PARAMETERS.
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+
+    parameters = Parameters.from_env()
+    parser = argparse.ArgumentParser(description="LLM Chain Service")
+    parser.add_argument("--host", default=parameters.project_host)
+    parser.add_argument("--port", type=int, default=parameters.project_port)
+    parser.add_argument("--workers", type=int, default=parameters.workers, help="Число процессов (0 — по числу ядер)")
+    args = parser.parse_args()
+
+    workers = worker_count(args.workers)
+    if workers > 1 and parameters.cache_backend == "memory" and (
+            parameters.answer_cache_enabled or parameters.llm_cache_enabled):
+        logger.warning("Кеши включены с cache_backend='memory': каждый воркер прогревает свой кеш")
+    if workers > 1:
+        logger.warning("Метрики /metrics ведутся в каждом воркере отдельно: опрос попадает в случайный воркер, "
+                       "ряды помечены меткой worker, суммируйте их в Prometheus по всем воркерам")
+        os.environ[WORKERS_ENV] = str(workers)
+    # Несколько воркеров запускаются только по строке импорта приложения
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=workers)
\ No newline at end of file
@@ -0,0 +1,241 @@
+# piplines/dependencies.py
+
+import asyncio
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from core.data_types import Settings, Parameters, PromtsChain, AgentMemory
+from agents.ai_base import AsyncLLMClient, AsyncLLMGenerator, MemoizedLLMClient
+from services.retriever import AsyncPostRequest
+from agents.search_agent import SearchAgent
+from agents.classifying_agent import ClassifierAgent
+from agents.pre_classifier import build_pre_classifier
+from agents.answer_cache import AnswerCache, CachedSearchAgent
+from services.cache import TTLCache, SQLiteCache, build_shared_cache
+from services.rate_limiter import ModelRateLimiter
+from services.single_flight import SingleFlight
+from services.tokens import preload_encodings
+from services.metrics import REGISTRY, MetricsRegistry, set_known_aliases, stats_samples
+from services import tracing
+from services.resilience import CircuitBreaker, LatencyTracker, RetryPolicy
+from agents.search_agent_units import AnalysisUnit, VotingUnit, AnswerGenerator, MemoryManager
+
+logger = logging.getLogger(__name__)
+
+# Путь к файлу с промптами относительно корня проекта
+PROMPTS_FILE_PATH = Path(__file__).resolve().parent.parent / "configs" / "prompts.json"
+
+
+@dataclass
+class AppContainer:
+    """
+    Контейнер долгоживущих зависимостей приложения.
+
+    Создается один раз при старте (в lifespan FastAPI) и разделяется
+    всеми запросами: настройки и промпты читаются с диска однократно,
+    HTTP-клиенты LLM и ретривера переиспользуют пулы соединений,
+    а агенты не пересоздаются на каждый вызов. Единственный объект,
+    который создается на каждый запрос, — AgentMemory внутри SearchAgent.
+    """
+    settings: Settings
+    parameters: Parameters
+    prompts: PromtsChain
+    ai_client: AsyncLLMClient
+    retriever: AsyncPostRequest
+    memory_manager: MemoryManager
+    classifier_agent: ClassifierAgent
+    search_agent: Union[SearchAgent, CachedSearchAgent]
+    answer_cache: Optional[AnswerCache] = None
+    pipeline_single_flight: Optional[SingleFlight] = None
+
+    @classmethod
+    def build(cls,
+              settings: Optional[Settings] = None,
+              parameters: Optional[Parameters] = None,
+              prompts_path: str | Path = PROMPTS_FILE_PATH) -> "AppContainer":
+        """
+        Собирает все зависимости приложения.
+
+        :param settings: Настройки (по умолчанию читаются из .env).
+        :param parameters: Параметры приложения (по умолчанию значения из Parameters).
+        :param prompts_path: Путь к JSON-файлу с промптами.
+        :return: Готовый контейнер.
+        """
+        settings = settings or Settings()
+        parameters = parameters or Parameters()
+        prompts = PromtsChain.from_file(prompts_path)
+        tracing.set_exporter(tracing.build_exporter(parameters.tracing_exporter, parameters.tracing_path))
+        set_known_aliases(parameters.alias_to_site)
+
+        rate_limiter = ModelRateLimiter(parameters.llm_rate_limits) if parameters.llm_rate_limits else None
+        ai_client = AsyncLLMGenerator(
+            api_key=settings.openai_api_key,
+            base_url=parameters.llm_base_url,
+            stream_usage=parameters.llm_stream_usage,
+            rate_limiter=rate_limiter,
+            retry_policy=RetryPolicy(
+                max_retries=parameters.llm_max_retries,
+                base_delay=parameters.llm_retry_base_delay,
+                max_delay=parameters.llm_retry_max_delay,
+            ),
+            call_timeout=parameters.llm_call_timeout or None,
+            hedge_quantile=parameters.llm_hedge_quantile,
+            latency_tracker=LatencyTracker(min_samples=parameters.llm_hedge_min_samples),
+        )
+        def shared_cache(namespace: str, max_size: int, ttl: float):
+            return build_shared_cache(parameters.cache_backend, namespace, max_size=max_size, ttl=ttl,
+                                      path=parameters.cache_path, redis_url=parameters.cache_redis_url,
+                                      redis_timeout=parameters.cache_redis_timeout)
+
+        if parameters.llm_cache_enabled:
+            if parameters.llm_cache_path:
+                disk_cache = SQLiteCache(parameters.llm_cache_path, ttl=parameters.llm_cache_ttl)
+            else:
+                disk_cache = shared_cache("llm", 100_000, parameters.llm_cache_ttl)
+            ai_client = MemoizedLLMClient(
+                ai_client,
+                memory_cache=TTLCache(max_size=parameters.llm_cache_size, ttl=parameters.llm_cache_ttl),
+                disk_cache=disk_cache,
+            )
+        retriever = AsyncPostRequest(
+            base_url=parameters.retrieval_base_url,
+            connection_limit=parameters.retrieval_connection_limit,
+            limit_per_host=parameters.retrieval_limit_per_host,
+            keepalive_timeout=parameters.retrieval_keepalive_timeout,
+            dns_cache_ttl=parameters.retrieval_dns_cache_ttl,
+            breaker=CircuitBreaker(
+                failure_rate=parameters.retrieval_breaker_failure_rate,
+                window=parameters.retrieval_breaker_window,
+                min_calls=parameters.retrieval_breaker_min_calls,
+                reset_timeout=parameters.retrieval_breaker_reset_timeout,
+            ) if parameters.retrieval_breaker_window else None,
+            stale_cache=TTLCache(
+                max_size=parameters.retrieval_stale_cache_size,
+                ttl=parameters.retrieval_stale_cache_ttl,
+            ) if parameters.retrieval_stale_cache_size else None,
+            single_flight=SingleFlight() if parameters.retrieval_coalescing else None,
+            shared_stale_cache=shared_cache(
+                "retrieval", parameters.retrieval_stale_cache_size, parameters.retrieval_stale_cache_ttl
+            ) if parameters.retrieval_stale_cache_size else None,
+        )
+        memory_manager = MemoryManager.from_parameters(parameters)
+
+        pre_classifier = None
+        if parameters.pre_classifier_enabled:
+            pre_classifier = build_pre_classifier(
+                parameters.pre_classifier_model_path,
+                threshold=parameters.pre_classifier_threshold,
+            )
+
+        # Память для классификатора не требует сохранения между запросами
+        classifier_agent = ClassifierAgent(prompts, parameters, AgentMemory(), ai_client, pre_classifier)
+
+        search_agent = SearchAgent(
+            prompts=prompts,
+            parameters=parameters,
+            memory=AgentMemory(),
+            ai_client=ai_client,
+            retriever=retriever,
+            analysis_unit=AnalysisUnit(ai_client, prompts, parameters),
+            voting_unit=VotingUnit(ai_client, prompts, parameters),
+            answer_generator=AnswerGenerator(ai_client, prompts, parameters),
+            memory_manager=memory_manager,
+            voting_unit_is=True # Конфигурация
+        )
+
+        answer_cache = None
+        if parameters.answer_cache_enabled:
+            answer_cache = AnswerCache.from_parameters(
+                prompts, parameters,
+                shared=shared_cache("answers", parameters.answer_cache_size, parameters.answer_cache_ttl),
+            )
+            search_agent = CachedSearchAgent(search_agent, answer_cache)
+
+        logger.info("Контейнер зависимостей приложения создан")
+        container = cls(
+            settings=settings,
+            parameters=parameters,
+            prompts=prompts,
+            ai_client=ai_client,
+            retriever=retriever,
+            memory_manager=memory_manager,
+            classifier_agent=classifier_agent,
+            search_agent=search_agent,
+            answer_cache=answer_cache,
+            pipeline_single_flight=SingleFlight() if parameters.request_coalescing else None,
+        )
+        container.register_metrics()
+        return container
+
+    def register_metrics(self, registry: MetricsRegistry = REGISTRY):
+        """
+        Публикует в реестре метрик счетчики, которые компоненты ведут сами:
+        попадания кешей, запросы ретривера, состояние предохранителя,
+        схлопнутые запросы и фоновую запись памяти.
+        """
+        def cache_samples():
+            samples = []
+            if isinstance(self.ai_client, MemoizedLLMClient):
+                samples += stats_samples(self.ai_client.stats, cache="llm")
+            if self.answer_cache is not None:
+                samples += stats_samples(self.answer_cache.stats, cache="answer")
+            samples += stats_samples(
+                {"stale_responses": self.retriever.connection_stats["stale_responses"]}, cache="retrieval"
+            )
+            return samples
+
+        def breaker_samples():
+            if self.retriever.breaker is None:
+                return []
+            state = self.retriever.breaker.state
+            return [({"state": name}, float(name == state))
+                    for name in (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)]
+
+        def single_flight_samples():
+            samples = []
+            for layer, flight in (("pipeline", self.pipeline_single_flight), ("retrieval", self.retriever.single_flight)):
+                if flight is not None:
+                    samples += stats_samples(flight.stats, layer=layer)
+            return samples
+
+        def memory_writer_samples():
+            writer = self.memory_manager.writer
+            return stats_samples(writer.stats) if writer is not None else []
+
+        registry.callback("expert_bot_cache_events_total", "События кешей (попадания, промахи, записи)",
+                          "counter", cache_samples)
+        registry.callback("expert_bot_retriever_requests_total", "Запросы и соединения ретривера",
+                          "counter", lambda: stats_samples(self.retriever.connection_stats))
+        registry.callback("expert_bot_retriever_breaker_state", "Состояние предохранителя ретривера (1 — текущее)",
+                          "gauge", breaker_samples)
+        registry.callback("expert_bot_single_flight_total", "Вызовы и схлопнутые одинаковые вызовы",
+                          "counter", single_flight_samples)
+        registry.callback("expert_bot_memory_writer_total", "Фоновая запись памяти агента",
+                          "counter", memory_writer_samples)
+
+    async def start(self):
+        """
+        Открывает сетевые ресурсы, требующие работающего цикла событий, загружает
+        кодировки токенизатора и запускает фоновую запись памяти.
+        """
+        await self.retriever.start()
+        await preload_encodings([
+            self.parameters.ai_model_classifier,
+            self.parameters.ai_model_queries_generate,
+            self.parameters.ai_model_analisys_note,
+            self.parameters.ai_model_voting,
+            self.parameters.ai_model_answer_generator,
+        ])
+        self.memory_manager.start()
+
+    async def aclose(self):
+        """Освобождает сетевые ресурсы и дописывает очередь памяти при остановке приложения."""
+        await self.retriever.close()
+        await self.ai_client.aclose()
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+        await asyncio.to_thread(self.memory_manager.close)
+        tracing.set_exporter(None).close()
+        logger.info("Контейнер зависимостей приложения закрыт")
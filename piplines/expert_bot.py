@@ -2,18 +2,89 @@
 
 import re
 import asyncio
+import contextlib
 import logging
 from dataclasses import dataclass
+from typing import AsyncIterator, Optional
 from agents.classifying_agent import ClassifierAgent
 from agents.search_agent import SearchAgent
+from services.resilience import DeadlineExceeded, remaining, request_deadline
+from services.single_flight import SingleFlight
+from services.metrics import request_alias
+from services.tracing import current_request_id, span
+from utils.utils import normalize_query
 
 logger = logging.getLogger(__name__)
 
+# Готовые ответы для типов запросов, не требующих поиска
+answ_dict = {
+    1: "Рады приветствовать вас на нашем сайте",
+    2: "Рады, что смогли вам помочь",
+}
+
+# Типы запросов, для которых выполняется поиск
+SEARCH_TYPES = (3, 4)
+
+OTHER_TYPE_ANSWER = "Не удалось определить тип вашего запроса. Пожалуйста, переформулируйте его."
+
 # Используем dataclass для удобной передачи зависимостей
 @dataclass
 class BotDependencies:
     classifier_agent: ClassifierAgent
     search_agent: SearchAgent
+    # Запускать поиск параллельно с классификацией (см. bot_pipeline)
+    optimistic_retrieval: bool = False
+    # Бюджет времени на запрос (0 — без ограничения) и его доли по этапам
+    request_timeout: float = 0.0
+    stage_budget_shares: Optional[dict] = None
+    # Схлопывание одинаковых одновременных запросов (None — каждый запрос обрабатывается отдельно)
+    single_flight: Optional[SingleFlight] = None
+
+def _parse_query_type(query_type: str) -> int:
+    """
+    Извлекает номер типа запроса из ответа классификатора.
+
+    :param query_type: Ответ классификатора.
+    :return: Номер типа; 3, если номер извлечь не удалось.
+    """
+    # Используем безопасное извлечение числа
+    query_type_match = re.search(r"\d", query_type)
+
+    if not query_type_match:
+        logger.warning(f"Классификатор не смог определить тип запроса: '{query_type}'")
+        # По умолчанию считаем, что это вопрос, требующий поиска
+        return 3
+    return int(query_type_match.group(0))
+
+async def _optimistic_pipeline(query: str, alias: str, deps: BotDependencies) -> str:
+    """
+    Оптимистичный конвейер: поиск стартует одновременно с классификацией.
+
+    Почти весь трафик — бухгалтерские вопросы (типы 3/4), поэтому поиск
+    запускается сразу, а не после ответа классификатора. Для приветствий,
+    благодарностей и прочих запросов начатый поиск отменяется.
+    """
+    retrieval_task = asyncio.ensure_future(deps.search_agent.retrieve(query, alias))
+    try:
+        query_type = await deps.classifier_agent(query)
+    except BaseException:
+        retrieval_task.cancel()
+        raise
+    type_num = _parse_query_type(query_type)
+
+    if type_num in SEARCH_TYPES:
+        memory = await retrieval_task
+        return await deps.search_agent.answer(memory)
+
+    retrieval_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await retrieval_task
+
+    if type_num in answ_dict:
+        return answ_dict[type_num]
+
+    logger.info(f"Запрос классифицирован как 'Другое' (тип {type_num}). Поиск отменен.")
+    return OTHER_TYPE_ANSWER
 
 async def bot_pipeline(query: str, alias: str, deps: BotDependencies) -> str:
     """
@@ -24,30 +95,90 @@ async def bot_pipeline(query: str, alias: str, deps: BotDependencies) -> str:
     :param alias: Идентификатор источника данных.
     :param deps: Объект с зависимостями (агентами).
     :return: Сгенерированный ответ.
+    :raises DeadlineExceeded: Если истек бюджет времени запроса.
+
+    При включенном схлопывании (deps.single_flight) общее вычисление выполняется
+    в контексте первого запроса: присоединившиеся запросы получают его результат
+    или его исключение (в том числе DeadlineExceeded по его бюджету, если он
+    меньше собственного), а в заголовки ретривера, span'ы и сохраненную память
+    (AgentMemory.request_id) попадает только идентификатор первого запроса.
+    Связь "присоединившийся -> первый" записывается в лог SingleFlight.
     """
-    answ_dict = {
-        1: "Рады приветствовать вас на нашем сайте", 
-        2: "Рады, что смогли вам помочь",
-    }
+    with request_deadline(deps.request_timeout, deps.stage_budget_shares), request_alias(alias), \
+            span("bot_pipeline", alias=alias):
+        if deps.single_flight is None:
+            return await _bot_pipeline(query, alias, deps)
+        # Одинаковые вопросы, пришедшие одновременно, ждут одно вычисление;
+        # каждый ждет не дольше собственного бюджета времени
+        key = ("bot_pipeline", normalize_query(query), alias)
+        compute = lambda: _bot_pipeline(query, alias, deps)
+        try:
+            return await asyncio.wait_for(
+                deps.single_flight.do(key, compute, tag=current_request_id() or None), remaining()
+            )
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded):
+                raise
+            raise DeadlineExceeded("Истек бюджет времени запроса") from e
 
-    query_type = deps.classifier_agent(query)
-    # Используем безопасное извлечение числа
-    query_type_match = re.search(r"\d", query_type)
+async def _bot_pipeline(query: str, alias: str, deps: BotDependencies) -> str:
+    if deps.optimistic_retrieval:
+        return await _optimistic_pipeline(query, alias, deps)
 
-    if not query_type_match:
-        logger.warning(f"Классификатор не смог определить тип запроса: '{query_type}'")
-        # По умолчанию считаем, что это вопрос, требующий поиска
-        type_num = 3 
-    else:
-        type_num = int(query_type_match.group(0))
+    query_type = await deps.classifier_agent(query)
+    type_num = _parse_query_type(query_type)
 
     if type_num in answ_dict:
         return answ_dict[type_num]
 
     # Если вопрос бухгалтерский или классификатор ошибся
-    if type_num in [3, 4]:
+    if type_num in SEARCH_TYPES:
         search_result = await deps.search_agent(query, alias)
         return search_result
-    
+
     logger.info(f"Запрос классифицирован как 'Другое' (тип {type_num}). Поиск не будет выполнен.")
-    return "Не удалось определить тип вашего запроса. Пожалуйста, переформулируйте его."
\ No newline at end of file
+    return OTHER_TYPE_ANSWER
+
+async def bot_pipeline_stream(query: str, alias: str, deps: BotDependencies) -> AsyncIterator[str]:
+    """
+    Потоковый вариант bot_pipeline: итоговый ответ отдается фрагментами
+    по мере генерации токенов моделью. Готовые ответы (приветствие,
+    благодарность, «Другое») отдаются одним фрагментом.
+
+    :param query: Вопрос от пользователя.
+    :param alias: Идентификатор источника данных.
+    :param deps: Объект с зависимостями (агентами).
+    :return: Асинхронный итератор фрагментов ответа.
+    """
+    with request_deadline(deps.request_timeout, deps.stage_budget_shares), request_alias(alias), \
+            span("bot_pipeline_stream", alias=alias):
+        async for chunk in _bot_pipeline_stream(query, alias, deps):
+            yield chunk
+
+async def _bot_pipeline_stream(query: str, alias: str, deps: BotDependencies) -> AsyncIterator[str]:
+    retrieval_task = None
+    if deps.optimistic_retrieval:
+        retrieval_task = asyncio.ensure_future(deps.search_agent.retrieve(query, alias))
+    try:
+        query_type = await deps.classifier_agent(query)
+    except BaseException:
+        if retrieval_task is not None:
+            retrieval_task.cancel()
+        raise
+    type_num = _parse_query_type(query_type)
+
+    if type_num in SEARCH_TYPES:
+        if retrieval_task is not None:
+            memory = await retrieval_task
+        else:
+            memory = await deps.search_agent.retrieve(query, alias)
+        async for chunk in deps.search_agent.stream_answer(memory):
+            yield chunk
+        return
+
+    if retrieval_task is not None:
+        retrieval_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await retrieval_task
+
+    yield answ_dict.get(type_num, OTHER_TYPE_ANSWER)
@@ -0,0 +1,281 @@
+# services/cache.py
+
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Union
+
+from services.resilience import remaining
+
+try:
+    import redis
+except ImportError:  # Общий кеш в Redis — опциональная возможность
+    redis = None
+
+# Бэкенды общего (межпроцессного) уровня кешей: "memory" — без общего уровня
+CACHE_BACKENDS = ("memory", "sqlite", "redis")
+
+
+class TTLCache:
+    """
+    Потокобезопасный in-memory кеш с ограничением размера (LRU) и временем жизни записей (TTL).
+
+    При превышении max_size вытесняется запись, к которой дольше всего не обращались.
+    Просроченные записи удаляются лениво, при обращении к ним.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 3600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_size: Максимальное число записей.
+        :param ttl: Время жизни записи в секундах (None — без ограничения).
+        :param clock: Источник времени (подменяется в тестах).
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Возвращает значение по ключу и отмечает его как недавно использованное.
+
+        :param key: Ключ записи.
+        :param default: Значение, возвращаемое при промахе.
+        :return: Сохраненное значение или default.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= self._clock():
+                del self._data[key]
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Сохраняет значение, вытесняя самые старые записи при переполнении.
+
+        :param key: Ключ записи.
+        :param value: Значение.
+        :param ttl: Индивидуальное время жизни (по умолчанию self.ttl).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def delete(self, key: Hashable):
+        """Удаляет запись, если она есть."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Очищает кеш."""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and (item[1] is None or item[1] > self._clock())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Возвращает счетчики кеша и долю попаданий."""
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._data),
+            "hit_ratio": self.stats["hits"] / total if total else 0.0,
+        }
+
+
+class SQLiteCache:
+    """
+    Дисковый кеш на SQLite с TTL и ограничением числа записей.
+
+    Переживает перезапуск воркера и разделяется между процессами одной машины
+    (режим WAL). Значения хранятся в виде строк;
+    при превышении max_size удаляются записи с самым давним обращением.
+    """
+
+    def __init__(self, path: str, max_size: int = 100_000, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        :param path: Путь к файлу базы данных.
+        :param max_size: Максимальное число записей.
+        :param ttl: Время жизни записи в секундах (None — без ограничения).
+        :param clock: Источник времени (подменяется в тестах).
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Файл может использоваться несколькими процессами: ждем снятия блокировки записи
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Возвращает значение по ключу или default."""
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return default
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Сохраняет значение и при необходимости вытесняет старые записи."""
+        ttl = self.ttl if ttl is None else ttl
+        now = self._clock()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if count > self.max_size:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_size,),
+                )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def close(self):
+        """Закрывает соединение с базой данных."""
+        with self._lock:
+            self._conn.close()
+
+
+class RedisCache:
+    """
+    Общий кеш в Redis (или совместимом сервере) с тем же интерфейсом, что у SQLiteCache.
+
+    Записи хранятся под префиксом namespace; время жизни задается средствами
+    Redis, вытеснение — его политикой maxmemory.
+    """
+
+    def __init__(self, url: str, namespace: str, ttl: Optional[float] = None, timeout: float = 1.0):
+        """
+        :param url: Адрес сервера, например "redis://127.0.0.1:6379/0".
+        :param namespace: Префикс ключей.
+        :param ttl: Время жизни записи в секундах (None — без ограничения).
+        :param timeout: Таймаут соединения и операций в секундах.
+        :raises RuntimeError: Если пакет redis не установлен.
+        """
+        if redis is None:
+            raise RuntimeError("Для общего кеша в Redis установите пакет redis")
+        self.namespace = namespace
+        self.ttl = ttl
+        # Без таймаутов redis-py ждет недоступный сервер бесконечно
+        self._client = redis.Redis.from_url(
+            url, decode_responses=True, socket_timeout=timeout, socket_connect_timeout=timeout,
+        )
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Возвращает значение по ключу или default."""
+        value = self._client.get(self.namespace + key)
+        return default if value is None else value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Сохраняет значение."""
+        ttl = self.ttl if ttl is None else ttl
+        self._client.set(self.namespace + key, value, px=int(ttl * 1000) if ttl is not None else None)
+
+    def __len__(self) -> int:
+        # Полный обход ключей пространства имен: только для отладки
+        return sum(1 for _ in self._client.scan_iter(match=self.namespace + "*", count=1000))
+
+    def close(self):
+        """Закрывает соединения с сервером."""
+        self._client.close()
+
+
+SharedCache = Union[SQLiteCache, RedisCache]
+
+
+def cache_key(*parts: Any) -> str:
+    """Строковый ключ общего кеша из частей составного ключа (хеш их JSON-представления)."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+async def shared_get(cache: SharedCache, key: str) -> Any:
+    """
+    Читает общий уровень кеша в отдельном потоке, не дольше оставшегося времени запроса.
+
+    :param cache: Общий уровень кеша.
+    :param key: Ключ (см. cache_key).
+    :return: Значение или None.
+    :raises asyncio.TimeoutError: Если значение не получено до дедлайна запроса.
+    """
+    return await asyncio.wait_for(asyncio.to_thread(cache.get, key), remaining())
+
+
+def build_shared_cache(backend: str,
+                       namespace: str,
+                       max_size: int = 100_000,
+                       ttl: Optional[float] = None,
+                       path: str = os.path.join("data", "cache"),
+                       redis_url: str = "redis://127.0.0.1:6379/0",
+                       redis_timeout: float = 1.0) -> Optional[SharedCache]:
+    """
+    Создает общий уровень кеша, доступный всем процессам-воркерам.
+
+    :param backend: "memory" (общего уровня нет), "sqlite" (файл на машине) или "redis".
+    :param namespace: Имя кеша: файл <path>/<namespace>.sqlite или префикс ключей в Redis.
+    :param max_size: Максимальное число записей (для SQLite).
+    :param ttl: Время жизни записи в секундах.
+    :param path: Каталог файлов SQLite.
+    :param redis_url: Адрес сервера Redis.
+    :param redis_timeout: Таймаут соединения и операций Redis в секундах.
+    :return: Кеш или None для "memory".
+    :raises ValueError: Для неизвестного бэкенда.
+    """
+    if backend == "memory":
+        return None
+    if backend == "sqlite":
+        os.makedirs(path, exist_ok=True)
+        return SQLiteCache(os.path.join(path, f"{namespace}.sqlite"), max_size=max_size, ttl=ttl)
+    if backend == "redis":
+        return RedisCache(redis_url, f"expert_bot:{namespace}:", ttl=ttl, timeout=redis_timeout)
+    raise ValueError(f"Неизвестный бэкенд кеша: {backend}")
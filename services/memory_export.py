@@ -0,0 +1,307 @@
+# services/memory_export.py
+
+"""
+Экспорт сохраненной памяти агента в Parquet для аналитики.
+
+Записи из JSON-файлов и JSONL-сегментов памяти пишутся в набор данных,
+разбитый по дате сохранения и alias (каталоги date=YYYY-MM-DD/alias=...).
+Кандидаты хранятся вложенным столбцом (список структур с фрагментами),
+объемные тексты можно не выгружать. Файлы обрабатываются параллельно
+в пуле процессов, каждый — пачками не больше batch_size записей и примерно
+batch_bytes байт текста. Некорректные записи пропускаются и учитываются в errors.
+
+Нужен пакет pyarrow. Запуск из корня проекта:
+    python -m services.memory_export --memory-path data/memory --output data/export --since 2025-06-01
+Чтение:
+    pyarrow.dataset.dataset("data/export", partitioning="hive").to_table()
+"""
+import os
+import glob
+import json
+import logging
+import argparse
+import datetime
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from services.memory_writer import SEGMENT_PREFIX, iter_segment
+from services.memory_index import record_models, record_outcome
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Экспорт в Parquet — опциональная возможность
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Поля с объемными текстами, которые не выгружаются при drop_texts
+BULKY_FIELDS = ("analysis_note", "best_fragments", "answer")
+
+# Пачка на процесс по умолчанию: записи с фрагментами бывают размером около 0,5 МБ
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_BYTES = 64 * 2 ** 20
+
+
+def _schema(drop_texts: bool) -> "pa.Schema":
+    fragment = pa.struct([("text", pa.string()), ("score", pa.float64())])
+    candidate = pa.struct([
+        ("mod_id", pa.string()),
+        ("doc_id", pa.string()),
+        ("title", pa.string()),
+        ("link", pa.string()),
+        ("fragments", pa.list_(fragment)),
+    ])
+    fields = [
+        ("request_id", pa.string()),
+        ("query", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("saved_at", pa.timestamp("us")),
+        ("outcome", pa.string()),
+        ("voting", pa.string()),
+        ("temp_queries", pa.list_(pa.string())),
+        ("candidates", pa.list_(candidate)),
+        ("token_usage", pa.map_(pa.string(), pa.int64())),
+        ("stage_timings", pa.map_(pa.string(), pa.float64())),
+        ("models", pa.map_(pa.string(), pa.string())),
+    ]
+    if not drop_texts:
+        fields += [(name, pa.string()) for name in BULKY_FIELDS]
+    return pa.schema(fields)
+
+
+def _timestamp(value: Any) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.fromisoformat(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+def _candidate(item: Dict[str, Any], drop_texts: bool) -> Dict[str, Any]:
+    # Кандидат — исходный ranking_dict или Candidate.to_dict(); текст фрагментов объемный
+    fragments = [] if drop_texts else [
+        {"text": str(text), "score": float(score)} for text, score in item.get("best_fragments_scores") or []
+    ]
+    return {
+        "mod_id": str(item.get("mod_id", "")),
+        "doc_id": str(item.get("doc_id", "")),
+        "title": item.get("title") or "",
+        "link": item.get("link") or "",
+        "fragments": fragments,
+    }
+
+
+def export_row(record: Dict[str, Any], drop_texts: bool = False) -> Dict[str, Any]:
+    """
+    Преобразует запись памяти в строку набора данных (без столбцов разбиения).
+
+    :param record: Запись памяти.
+    :param drop_texts: Не выгружать объемные тексты (записка, фрагменты, ответ, тексты фрагментов кандидатов).
+    :return: Словарь "столбец -> значение".
+    """
+    row = {
+        "request_id": record.get("request_id") or "",
+        "query": record.get("query") or "",
+        "created_at": _timestamp(record.get("created_at")),
+        "saved_at": _timestamp(record.get("saved_at")),
+        "outcome": record_outcome(record),
+        "voting": record.get("voting") or "",
+        "temp_queries": [str(q) for q in record.get("temp_queries") or []],
+        "candidates": [_candidate(item, drop_texts) for item in record.get("searching_candidates") or []],
+        "token_usage": [(k, int(v)) for k, v in (record.get("token_usage") or {}).items()],
+        "stage_timings": [(k, float(v)) for k, v in (record.get("stage_timings") or {}).items()],
+        "models": [(k, str(v)) for k, v in record_models(record).items()],
+    }
+    if not drop_texts:
+        row.update({name: record.get(name) or "" for name in BULKY_FIELDS})
+    return row
+
+
+def _row_bytes(row: Dict[str, Any]) -> int:
+    """Приблизительный объем строки: длина текстовых значений, включая тексты фрагментов кандидатов."""
+    size = sum(len(value) for value in row.values() if isinstance(value, str))
+    for candidate in row["candidates"]:
+        size += len(candidate["title"]) + len(candidate["link"])
+        size += sum(len(fragment["text"]) for fragment in candidate["fragments"])
+    return size
+
+
+def _iter_task(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Читает записи файлов задачи; для записей без времени сохранения берется время изменения файла."""
+    for path in paths:
+        fallback = datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+        try:
+            if path.endswith(".json"):
+                with open(path, "r", encoding="utf-8") as f:
+                    records: Any = [json.load(f)]
+            else:
+                records = iter_segment(path)
+            for record in records:
+                record.setdefault("saved_at", fallback)
+                yield record
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать {path}: {e}")
+
+
+def _partition_dir(output_dir: str, date: str, alias: str) -> str:
+    """Каталог раздела; значения экранируются как URL (разбиение hive в pyarrow их декодирует)."""
+    return os.path.join(output_dir,
+                        f"date={urllib.parse.quote(date, safe='')}",
+                        f"alias={urllib.parse.quote(alias, safe='')}")
+
+
+def _export_task(name: str,
+                 paths: List[str],
+                 output_dir: str,
+                 since: Optional[str],
+                 until: Optional[str],
+                 drop_texts: bool,
+                 batch_size: int,
+                 batch_bytes: int) -> Dict[str, int]:
+    """
+    Выгружает записи группы файлов (выполняется в процессе пула).
+
+    В каждом разделе задача пишет один файл part-<name>.parquet, пачки становятся
+    его группами строк, поэтому в памяти одновременно находится не больше batch_size
+    записей и примерно batch_bytes байт текста. Запись, которую не удалось
+    преобразовать, пропускается и учитывается в errors, не прерывая экспорт.
+    """
+    schema = _schema(drop_texts)
+    writers: Dict[Tuple[str, str], "pq.ParquetWriter"] = {}
+    pending: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    stats = {"records": 0, "skipped": 0, "errors": 0, "files": 0}
+
+    def flush(key: Tuple[str, str]):
+        rows = pending.pop(key, [])
+        if not rows:
+            return
+        if key not in writers:
+            directory = _partition_dir(output_dir, *key)
+            os.makedirs(directory, exist_ok=True)
+            writers[key] = pq.ParquetWriter(os.path.join(directory, f"part-{name}.parquet"), schema)
+        writers[key].write_table(pa.Table.from_pylist(rows, schema=schema))
+
+    try:
+        buffered = buffered_bytes = 0
+        for record in _iter_task(paths):
+            date = str(record["saved_at"])[:10]
+            if (since and date < since) or (until and date > until):
+                stats["skipped"] += 1
+                continue
+            try:
+                row = export_row(record, drop_texts)
+            except Exception as e:
+                stats["errors"] += 1
+                logger.warning(f"Пропущена некорректная запись {record.get('request_id') or '?'} ({name}): {e}")
+                continue
+            key = (date, str(record.get("alias") or "unknown"))
+            pending.setdefault(key, []).append(row)
+            stats["records"] += 1
+            buffered += 1
+            buffered_bytes += _row_bytes(row)
+            if buffered >= batch_size or buffered_bytes >= batch_bytes:
+                for key in list(pending):
+                    flush(key)
+                buffered = buffered_bytes = 0
+        for key in list(pending):
+            flush(key)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    stats["files"] = len(writers)
+    return stats
+
+
+def _tasks(memory_path: str, since: Optional[str]) -> List[Tuple[str, List[str]]]:
+    """
+    Группирует файлы памяти в задачи (имя части, файлы).
+
+    Сегмент — отдельная задача, JSON-файлы группируются по дню из имени файла
+    (YYYYMMDD_HHMMSS_...). Имя части зависит только от сегмента или дня, а не от
+    набора файлов, поэтому новые файлы и другой --since не порождают вторую копию
+    уже выгруженных записей: часть раздела перезаписывается целиком.
+    """
+    json_files = sorted(glob.glob(os.path.join(memory_path, "*.json")))
+    segments = sorted(glob.glob(os.path.join(memory_path, f"{SEGMENT_PREFIX}*.jsonl*")))
+    if since:
+        # Файл, не менявшийся с начала периода, не может содержать записей периода
+        threshold = datetime.datetime.fromisoformat(since).timestamp()
+        json_files = [p for p in json_files if os.path.getmtime(p) >= threshold]
+        segments = [p for p in segments if os.path.getmtime(p) >= threshold]
+    tasks = [(os.path.basename(path).split(".")[0], [path]) for path in segments]
+    days: Dict[str, List[str]] = {}
+    for path in json_files:
+        days.setdefault(os.path.basename(path).split("_")[0], []).append(path)
+    tasks += [(f"json_{day}", paths) for day, paths in sorted(days.items())]
+    return tasks
+
+
+def export_memory(memory_path: str,
+                  output_dir: str,
+                  since: Optional[str] = None,
+                  until: Optional[str] = None,
+                  drop_texts: bool = False,
+                  batch_size: int = DEFAULT_BATCH_SIZE,
+                  workers: Optional[int] = None,
+                  batch_bytes: int = DEFAULT_BATCH_BYTES) -> Dict[str, int]:
+    """
+    Выгружает память агента в набор Parquet-файлов, разбитый по дате и alias.
+
+    Имена файлов определяются исходным сегментом или днем JSON-файлов, поэтому
+    повторный экспорт в тот же каталог (в том числе после появления новых файлов)
+    перезаписывает прежние файлы, а не дублирует записи. Значения разделов
+    экранируются как URL, alias вида "../x" не выходит за пределы output_dir.
+
+    :param memory_path: Директория памяти.
+    :param output_dir: Каталог набора данных.
+    :param since: Первая дата (YYYY-MM-DD, включительно).
+    :param until: Последняя дата (YYYY-MM-DD, включительно).
+    :param drop_texts: Не выгружать объемные тексты.
+    :param batch_size: Число записей в пачке (группе строк) на процесс.
+    :param workers: Число процессов (None — по числу ядер, 1 — в текущем процессе).
+    :param batch_bytes: Примерный объем текста пачки на процесс, байт.
+    :return: Счетчики: records, skipped, errors, files, tasks.
+    :raises RuntimeError: Если пакет pyarrow не установлен.
+    """
+    if pa is None:
+        raise RuntimeError("Для экспорта в Parquet установите пакет pyarrow")
+    tasks = _tasks(memory_path, since)
+    totals = {"records": 0, "skipped": 0, "errors": 0, "files": 0, "tasks": len(tasks)}
+    args = (output_dir, since, until, drop_texts, batch_size, batch_bytes)
+    if workers == 1 or len(tasks) <= 1:
+        results = [_export_task(name, paths, *args) for name, paths in tasks]
+    else:
+        names, paths = zip(*tasks)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_export_task, names, paths, *([value] * len(tasks) for value in args)))
+    for stats in results:
+        for name, value in stats.items():
+            totals[name] += value
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт памяти агента в Parquet")
+    parser.add_argument("--memory-path", default=os.path.join("data", "memory"))
+    parser.add_argument("--output", required=True, help="Каталог набора данных")
+    parser.add_argument("--since", help="Первая дата, YYYY-MM-DD")
+    parser.add_argument("--until", help="Последняя дата, YYYY-MM-DD")
+    parser.add_argument("--drop-texts", action="store_true", help="Не выгружать записки, фрагменты и ответы")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--batch-mb", type=float, default=DEFAULT_BATCH_BYTES / 2 ** 20,
+                        help="Примерный объем текста пачки на процесс, МБ")
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов (по умолчанию — по числу ядер)")
+    args = parser.parse_args()
+
+    started = datetime.datetime.now()
+    stats = export_memory(args.memory_path, args.output, args.since, args.until,
+                          args.drop_texts, args.batch_size, args.workers, int(args.batch_mb * 2 ** 20))
+    elapsed = (datetime.datetime.now() - started).total_seconds()
+    print(f"Записей: {stats['records']} (вне периода: {stats['skipped']}, с ошибками: {stats['errors']}), "
+          f"файлов: {stats['files']}, задач: {stats['tasks']}, время: {elapsed:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+# services/memory_index.py
+
+"""
+Индекс SQLite по сохраненной памяти агента.
+
+Для каждой записи хранятся запрос, alias, время, исход, длительности
+этапов, модели и ссылка на запись (файл, смещение, длина), поэтому отбор
+по дате, alias или исходу не требует чтения директории памяти, а полная
+запись читается одним обращением к диску.
+
+Индекс пополняется MemoryManager по мере записи; для уже существующих
+файлов используется sync(). Запуск из корня проекта:
+    python -m services.memory_index sync --memory-path data/memory
+    python -m services.memory_index query --since 2025-06-01 --alias bss.vip --outcome not_found
+    python -m services.memory_index summary --since 2025-06-01
+    python -m services.memory_index show 42
+"""
+import os
+import json
+import glob
+import sqlite3
+import logging
+import argparse
+import datetime
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.data_types import FAIL_ANSWER
+from services.memory_writer import SEGMENT_PREFIX, WrittenEntry, iter_entries, read_entry
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.sqlite"
+OUTCOMES = ("answered", "not_found")
+
+_COLUMNS = (
+    "request_id", "query", "alias", "created_at", "saved_at", "day", "duration", "outcome",
+    "candidates", "tokens", "stage_timings", "models", "path", "offset", "length", "line",
+)
+
+
+def default_index_path(memory_path: str) -> str:
+    return os.path.join(memory_path, INDEX_FILENAME)
+
+
+def _duration(created_at: str, saved_at: str) -> Optional[float]:
+    try:
+        started = datetime.datetime.fromisoformat(created_at)
+        finished = datetime.datetime.fromisoformat(saved_at)
+    except (TypeError, ValueError):
+        return None
+    return (finished - started).total_seconds()
+
+
+def record_outcome(record: Dict[str, Any]) -> str:
+    """Исход запроса по записи памяти: "answered" или "not_found"."""
+    answer = record.get("answer") or ""
+    return "answered" if answer and answer != record.get("fail_answer", FAIL_ANSWER) else "not_found"
+
+
+def record_models(record: Dict[str, Any]) -> Dict[str, str]:
+    """Модели этапов по записи памяти (в ранних записях — только модель ответа)."""
+    models = record.get("models") or {}
+    if not models and record.get("model_answer_generator"):
+        models = {"answer_generator": record["model_answer_generator"]}
+    return models
+
+
+def index_row(record: Dict[str, Any], path: str, offset: int, length: int, line: int = 0) -> Dict[str, Any]:
+    """
+    Извлекает из записи памяти поля индекса.
+
+    :param record: Запись памяти (AgentMemory.model_dump() и дополнительные поля).
+    :param path: Файл, в котором лежит запись.
+    :param offset: Смещение записи (или zstd-кадра) в файле.
+    :param length: Длина в байтах.
+    :param line: Номер строки внутри zstd-кадра.
+    :return: Словарь со значениями столбцов.
+    """
+    saved_at = str(record.get("saved_at") or "")
+    created_at = str(record.get("created_at") or "")
+    return {
+        "request_id": record.get("request_id") or "",
+        "query": record.get("query") or "",
+        "alias": record.get("alias") or "",
+        "created_at": created_at,
+        "saved_at": saved_at,
+        "day": saved_at[:10],
+        "duration": _duration(created_at, saved_at),
+        "outcome": record_outcome(record),
+        "candidates": len(record.get("searching_candidates") or []),
+        "tokens": sum((record.get("token_usage") or {}).values()),
+        "stage_timings": json.dumps(record.get("stage_timings") or {}),
+        "models": json.dumps(record_models(record), ensure_ascii=False),
+        "path": path,
+        "offset": offset,
+        "length": length,
+        "line": line,
+    }
+
+
+class MemoryIndex:
+    """
+    Дополняемый индекс записей памяти агента в SQLite.
+
+    Записи только добавляются; файлы, уже учтенные в индексе, при sync()
+    пропускаются, если их размер не изменился. Все методы потокобезопасны:
+    индекс пополняется из потока MemoryWriter, а читается из любого потока.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Путь к файлу базы данных (создается при необходимости).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # Индекс может пополняться несколькими процессами-воркерами: ждем снятия блокировки записи
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id INTEGER PRIMARY KEY, request_id TEXT, query TEXT, alias TEXT, created_at TEXT, saved_at TEXT, "
+            "day TEXT, duration REAL, outcome TEXT, candidates INTEGER, tokens INTEGER, stage_timings TEXT, "
+            "models TEXT, path TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, line INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_saved_at ON records (saved_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_alias ON records (alias, saved_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_outcome ON records (outcome, saved_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_request_id ON records (request_id)")
+        # Учтенные файлы и их размер на момент индексации
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self._conn.commit()
+
+    # --- Пополнение ---
+
+    def _insert(self, rows: Iterable[Dict[str, Any]]):
+        self._conn.executemany(
+            f"INSERT INTO records ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            [tuple(row[column] for column in _COLUMNS) for row in rows],
+        )
+
+    def add(self, path: str, entries: List[WrittenEntry]):
+        """
+        Добавляет записи пачки (обработчик MemoryWriter.on_written).
+
+        :param path: Путь к сегменту.
+        :param entries: Положения записей в сегменте.
+        """
+        rows = [index_row(record, path, offset, length, line) for record, offset, length, line in entries]
+        with self._lock:
+            self._insert(rows)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size) VALUES (?, ?)", (path, os.path.getsize(path))
+            )
+            self._conn.commit()
+
+    def add_file(self, path: str, record: Dict[str, Any]):
+        """Добавляет запись, сохраненную отдельным JSON-файлом."""
+        self.add(path, [(record, 0, os.path.getsize(path), 0)])
+
+    def _index_segment(self, path: str) -> List[Dict[str, Any]]:
+        # В сжатом сегменте запись указывается своим zstd-кадром и номером строки в нем
+        return [index_row(record, path, offset, length, line) for record, offset, length, line in iter_entries(path)]
+
+    def sync(self, memory_path: str) -> int:
+        """
+        Добавляет в индекс файлы памяти, которых в нем нет или которые выросли с прошлой индексации.
+
+        Выросший файл индексируется заново целиком. Предназначен для файлов, записанных
+        без индекса; сегмент, в который одновременно пишет MemoryWriter, может учесться дважды.
+
+        :param memory_path: Директория памяти.
+        :return: Число добавленных записей.
+        """
+        with self._lock:
+            known = dict(self._conn.execute("SELECT path, size FROM files").fetchall())
+        paths = sorted(glob.glob(os.path.join(memory_path, "*.json")))
+        paths += sorted(glob.glob(os.path.join(memory_path, f"{SEGMENT_PREFIX}*.jsonl*")))
+        added = 0
+        for path in paths:
+            size = os.path.getsize(path)
+            if known.get(path) == size:
+                continue
+            try:
+                if path.endswith(".json"):
+                    with open(path, "r", encoding="utf-8") as f:
+                        record = json.load(f)
+                    # В ранних файлах памяти нет времени сохранения — берем время изменения файла
+                    if not record.get("saved_at"):
+                        record["saved_at"] = datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+                    rows = [index_row(record, path, 0, size)]
+                else:
+                    rows = self._index_segment(path)
+            except Exception as e:
+                logger.warning(f"Не удалось проиндексировать {path}: {e}")
+                continue
+            with self._lock:
+                (previous,) = self._conn.execute("SELECT COUNT(*) FROM records WHERE path = ?", (path,)).fetchone()
+                self._conn.execute("DELETE FROM records WHERE path = ?", (path,))
+                self._insert(rows)
+                self._conn.execute("INSERT OR REPLACE INTO files (path, size) VALUES (?, ?)", (path, size))
+                self._conn.commit()
+            added += len(rows) - previous
+        return added
+
+    # --- Чтение ---
+
+    @staticmethod
+    def _where(since: Optional[str], until: Optional[str], alias: Optional[str],
+               outcome: Optional[str], contains: Optional[str]) -> tuple:
+        conditions, params = [], []
+        if since:
+            conditions.append("saved_at >= ?")
+            params.append(since)
+        if until:
+            # Дата без времени включает весь день
+            conditions.append("saved_at < ?" if len(until) > 10 else "day <= ?")
+            params.append(until)
+        if alias:
+            conditions.append("alias = ?")
+            params.append(alias)
+        if outcome:
+            if outcome not in OUTCOMES:
+                raise ValueError(f"Неизвестный исход: {outcome}")
+            conditions.append("outcome = ?")
+            params.append(outcome)
+        if contains:
+            conditions.append("query LIKE ?")
+            params.append(f"%{contains}%")
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def query(self,
+              since: Optional[str] = None,
+              until: Optional[str] = None,
+              alias: Optional[str] = None,
+              outcome: Optional[str] = None,
+              contains: Optional[str] = None,
+              limit: int = 100,
+              offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Отбирает записи индекса, новые первыми.
+
+        :param since: Начало периода (дата или время ISO, включительно).
+        :param until: Конец периода (дата — включительно, время — исключительно).
+        :param alias: Alias.
+        :param outcome: Исход: "answered" или "not_found".
+        :param contains: Подстрока вопроса.
+        :param limit: Максимальное число записей.
+        :param offset: Число пропускаемых записей.
+        :return: Строки индекса в виде словарей.
+        :raises ValueError: Для неизвестного исхода.
+        """
+        where, params = self._where(since, until, alias, outcome, contains)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM records{where} ORDER BY saved_at DESC, id DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        result = []
+        for row in rows:
+            item = dict(row)
+            item["stage_timings"] = json.loads(item["stage_timings"] or "{}")
+            item["models"] = json.loads(item["models"] or "{}")
+            result.append(item)
+        return result
+
+    def summary(self,
+                since: Optional[str] = None,
+                until: Optional[str] = None,
+                alias: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Сводка по дням и alias: число запросов, доля ответов, средние длительность и токены.
+
+        :param since: Начало периода.
+        :param until: Конец периода.
+        :param alias: Alias.
+        """
+        where, params = self._where(since, until, alias, None, None)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, alias, COUNT(*) AS requests, "
+                "SUM(outcome = 'answered') * 1.0 / COUNT(*) AS answered_ratio, "
+                "AVG(duration) AS avg_duration, AVG(tokens) AS avg_tokens "
+                f"FROM records{where} GROUP BY day, alias ORDER BY day, alias",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, record_id: int) -> Optional[Dict[str, Any]]:
+        """Строка индекса по идентификатору."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM records WHERE id = ?", (record_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def load(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Читает полную запись памяти по строке индекса."""
+        return read_entry(row["path"], row["offset"], row["length"], row["line"])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def close(self):
+        """Закрывает соединение с базой данных."""
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индекс сохраненной памяти агента")
+    parser.add_argument("--memory-path", default=os.path.join("data", "memory"))
+    parser.add_argument("--index-path", default="", help="Файл индекса (по умолчанию <memory-path>/index.sqlite)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync", help="Проиндексировать новые файлы памяти")
+    for name in ("query", "summary"):
+        command = commands.add_parser(name)
+        command.add_argument("--since", help="Дата или время ISO")
+        command.add_argument("--until", help="Дата или время ISO")
+        command.add_argument("--alias")
+        command.add_argument("--json", action="store_true")
+        if name == "query":
+            command.add_argument("--outcome", choices=OUTCOMES)
+            command.add_argument("--contains", help="Подстрока вопроса")
+            command.add_argument("--limit", type=int, default=50)
+    show = commands.add_parser("show", help="Вывести полную запись")
+    show.add_argument("id", type=int)
+    args = parser.parse_args()
+
+    index = MemoryIndex(args.index_path or default_index_path(args.memory_path))
+    try:
+        if args.command == "sync":
+            print(f"Добавлено записей: {index.sync(args.memory_path)}, всего: {len(index)}")
+        elif args.command == "show":
+            row = index.get(args.id)
+            if row is None:
+                raise SystemExit(f"Запись {args.id} не найдена")
+            print(json.dumps(index.load(row), ensure_ascii=False, indent=2))
+        elif args.command == "summary":
+            rows = index.summary(args.since, args.until, args.alias)
+            if args.json:
+                print(json.dumps(rows, ensure_ascii=False, indent=2))
+                return
+            for row in rows:
+                print(f"{row['day']}  {row['alias']:<10} запросов {row['requests']:6d}  "
+                      f"с ответом {row['answered_ratio']:.1%}  длительность {row['avg_duration'] or 0:.2f} с  "
+                      f"токенов {row['avg_tokens'] or 0:.0f}")
+        else:
+            rows = index.query(args.since, args.until, args.alias, args.outcome, args.contains, args.limit)
+            if args.json:
+                print(json.dumps(rows, ensure_ascii=False, indent=2))
+                return
+            for row in rows:
+                duration = f"{row['duration']:.2f} с" if row["duration"] is not None else "—"
+                print(f"{row['id']:6d}  {row['saved_at'][:19]}  {row['alias']:<8} {row['outcome']:<9} "
+                      f"{duration:>8}  {row['query'][:80]}")
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+# services/memory_writer.py
+
+import io
+import os
+import json
+import queue
+import logging
+import datetime
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # Сжатие сегментов — опциональная возможность
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "memory_"
+DROP_POLICIES = ("drop_newest", "drop_oldest")
+
+# Положение записи в сегменте: (запись, смещение, длина, номер строки).
+# Без сжатия смещение и длина задают строку записи, номер строки равен 0;
+# со сжатием — zstd-кадр пачки и номер строки внутри него.
+WrittenEntry = Tuple[Dict[str, Any], int, int, int]
+
+
+class MemoryWriter:
+    """
+    Фоновая запись памяти агента в компактные JSONL-сегменты.
+
+    save() на пути запроса только кладет запись в ограниченную очередь;
+    отдельный поток забирает записи пачками, сериализует их без отступов
+    и дописывает в текущий сегмент (опционально со сжатием zstd).
+    При превышении segment_max_bytes открывается новый сегмент.
+    После записи пачки вызывается on_written с путем сегмента и положением
+    каждой записи в нем (например, для индекса MemoryIndex).
+
+    Если очередь заполнена, запись не блокирует цикл событий, а применяется
+    политика сброса: drop_newest отбрасывает новую запись, drop_oldest —
+    самую старую из ожидающих.
+    """
+
+    def __init__(self,
+                 path: str,
+                 segment_max_bytes: int = 64 * 1024 * 1024,
+                 compression: Optional[str] = None,
+                 queue_size: int = 1000,
+                 batch_size: int = 50,
+                 flush_interval: float = 1.0,
+                 drop_policy: str = "drop_newest",
+                 on_written: Optional[Callable[[str, List[WrittenEntry]], None]] = None):
+        """
+        :param path: Директория для сегментов.
+        :param segment_max_bytes: Размер сегмента (в байтах на диске), после которого он ротируется.
+        :param compression: None или "zstd".
+        :param queue_size: Максимальное число записей, ожидающих записи.
+        :param batch_size: Максимальное число записей в одной пачке.
+        :param flush_interval: Максимальное время (сек.) ожидания перед записью неполной пачки.
+        :param drop_policy: Политика при переполнении очереди: drop_newest или drop_oldest.
+        :param on_written: Вызывается в потоке записи после каждой пачки: (путь сегмента, положения записей).
+        :raises ValueError: Если указана неизвестная политика или сжатие.
+        :raises RuntimeError: Если запрошено сжатие zstd, а пакет zstandard не установлен.
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Неизвестная политика сброса: {drop_policy}")
+        if compression not in (None, "", "zstd"):
+            raise ValueError(f"Неизвестный тип сжатия: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("Для сжатия сегментов памяти установите пакет zstandard")
+
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.compression = compression or None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.on_written = on_written
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._compressor = zstandard.ZstdCompressor(level=3) if self.compression else None
+        self._segment_path: Optional[str] = None
+        self._segment_bytes = 0
+        self._segment_counter = 0
+        self._stats_lock = threading.Lock()
+        self.stats = {"submitted": 0, "written": 0, "dropped": 0, "batches": 0, "segments": 0, "errors": 0}
+        os.makedirs(self.path, exist_ok=True)
+
+    # --- Публичный интерфейс ---
+
+    def start(self):
+        """Запускает фоновый поток записи."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict[str, Any]) -> bool:
+        """
+        Ставит запись в очередь без блокировки.
+
+        :param record: Словарь для сохранения.
+        :return: True, если запись принята; False, если она отброшена.
+        """
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.drop_policy == "drop_newest":
+                self._count("dropped")
+                logger.warning("Очередь записи памяти переполнена, запись отброшена")
+                return False
+            # drop_oldest: освобождаем место, вытесняя самую старую запись
+            try:
+                self._queue.get_nowait()
+                self._count("dropped")
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self._count("dropped")
+                return False
+        self._count("submitted")
+        return True
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """
+        Дописывает оставшиеся записи и останавливает поток.
+
+        :param timeout: Максимальное время ожидания завершения потока.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def metrics(self) -> Dict[str, Any]:
+        """Возвращает счетчики записи и текущую длину очереди."""
+        with self._stats_lock:
+            return {**self.stats, "queue_size": self._queue.qsize(), "segment": self._segment_path}
+
+    # --- Фоновый поток ---
+
+    def _count(self, name: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[Dict[str, Any]] = []
+            if first is None:
+                stop = True
+            else:
+                batch.append(first)
+            while len(batch) < self.batch_size and not stop:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+            if stop:
+                # Дописываем все, что успело попасть в очередь до остановки
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        batch.append(item)
+            if batch:
+                self._write_batch(batch)
+
+    def _new_segment_path(self) -> str:
+        self._segment_counter += 1
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix = ".jsonl.zst" if self.compression else ".jsonl"
+        name = f"{SEGMENT_PREFIX}{timestamp}_{os.getpid()}_{self._segment_counter:04d}{suffix}"
+        return os.path.join(self.path, name)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        """Сериализует пачку и дописывает ее в текущий сегмент."""
+        try:
+            lines = [
+                (json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+                for record in batch
+            ]
+            payload = b"".join(lines)
+            if self._compressor is not None:
+                # Каждая пачка — самостоятельный zstd-кадр; кадры читаются подряд
+                payload = self._compressor.compress(payload)
+
+            if self._segment_path is None or self._segment_bytes >= self.segment_max_bytes:
+                self._segment_path = self._new_segment_path()
+                self._segment_bytes = 0
+                self._count("segments")
+
+            with open(self._segment_path, "ab") as f:
+                start = f.tell()
+                f.write(payload)
+            self._segment_bytes += len(payload)
+            self._count("written", len(batch))
+            self._count("batches")
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"Не удалось записать пачку памяти ({len(batch)} записей): {e}")
+            return
+
+        if self.on_written is None:
+            return
+        if self._compressor is not None:
+            entries = [(record, start, len(payload), i) for i, record in enumerate(batch)]
+        else:
+            entries, offset = [], start
+            for record, line in zip(batch, lines):
+                entries.append((record, offset, len(line), 0))
+                offset += len(line)
+        try:
+            self.on_written(self._segment_path, entries)
+        except Exception as e:
+            logger.error(f"Ошибка обработчика записи памяти: {e}")
+
+
+def iter_segment(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Читает записи из JSONL-сегмента (сжатого или нет).
+
+    :param path: Путь к файлу сегмента.
+    :return: Итератор словарей.
+    """
+    if path.endswith(".zst") and zstandard is None:
+        raise RuntimeError("Для чтения сжатых сегментов установите пакет zstandard")
+    with open(path, "rb") as raw:
+        if path.endswith(".zst"):
+            raw = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        for line in io.TextIOWrapper(raw, encoding="utf-8"):
+            if line.strip():
+                yield json.loads(line)
+
+
+def _zstd_frames(f, chunk_size: int = 1 << 16) -> Iterator[Tuple[int, int, bytes]]:
+    """Разбирает поток zstd-кадров: (смещение кадра, его длина, распакованные данные)."""
+    decompressor = zstandard.ZstdDecompressor()
+    offset, pending = 0, b""
+    while True:
+        frame = decompressor.decompressobj()
+        data, fed, chunks = pending or f.read(chunk_size), 0, []
+        pending = b""
+        while data:
+            fed += len(data)
+            chunks.append(frame.decompress(data))
+            if frame.eof:
+                pending = frame.unused_data
+                break
+            data = f.read(chunk_size)
+        if not frame.eof:
+            # Конец файла или кадр, который еще дописывается
+            return
+        length = fed - len(pending)
+        yield offset, length, b"".join(chunks)
+        offset += length
+
+
+def iter_entries(path: str) -> Iterator[WrittenEntry]:
+    """
+    Читает записи сегмента вместе с их положением в файле (как в on_written MemoryWriter).
+
+    :param path: Путь к файлу сегмента.
+    :return: Итератор (запись, смещение, длина, номер строки).
+    """
+    if path.endswith(".zst") and zstandard is None:
+        raise RuntimeError("Для чтения сжатых сегментов установите пакет zstandard")
+    with open(path, "rb") as f:
+        if path.endswith(".zst"):
+            for offset, length, data in _zstd_frames(f):
+                for line, raw in enumerate(data.splitlines()):
+                    yield json.loads(raw), offset, length, line
+            return
+        offset = 0
+        for raw in f:
+            if raw.strip():
+                yield json.loads(raw), offset, len(raw), 0
+            offset += len(raw)
+
+
+def read_entry(path: str, offset: int = 0, length: int = -1, line: int = 0) -> Dict[str, Any]:
+    """
+    Читает одну запись по ее положению в файле (см. WrittenEntry), не разбирая весь сегмент.
+
+    :param path: Путь к сегменту или JSON-файлу памяти.
+    :param offset: Смещение строки записи или zstd-кадра пачки.
+    :param length: Длина в байтах (-1 — до конца файла).
+    :param line: Номер строки внутри zstd-кадра.
+    :return: Запись.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Для чтения сжатых сегментов установите пакет zstandard")
+        # Кадр пачки или весь сегмент (несколько кадров подряд)
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+        data = reader.read().splitlines()[line]
+    return json.loads(data)
@@ -0,0 +1,353 @@
+# services/metrics.py
+
+import math
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextlib
+import contextvars
+import inspect
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительности (сек.): от быстрых локальных этапов до долгих вызовов LLM
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+
+# Alias текущего запроса для меток метрик; задается в конвейере (см. request_alias)
+_alias: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_alias", default="")
+# Допустимые значения метки alias (None — без ограничения) и метка для остальных:
+# alias приходит в теле запроса, и число наборов меток не должно зависеть от клиента
+_known_aliases: Optional[frozenset] = None
+OTHER_ALIAS = "other"
+# Длительности этапов текущего запроса "этап -> сек." для памяти агента (см. track_stage_timings)
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "stage_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    """Базовый класс метрик реестра: имя, описание, метки и вывод в текстовом формате Prometheus."""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self, const_labels: Optional[Dict[str, str]] = None) -> List[str]:
+        """
+        Строки метрики в текстовом формате Prometheus.
+
+        :param const_labels: Метки, добавляемые ко всем значениям (например, воркер процесса).
+        """
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        """Увеличивает счетчик с заданными метками."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Текущее значение счетчика с заданными метками."""
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self, const_labels: Optional[Dict[str, str]] = None) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            labels = {**(const_labels or {}), **dict(zip(self.labelnames, key))}
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами (как в Prometheus)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: Dict[Labels, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        """Добавляет наблюдение с заданными метками."""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: str) -> int:
+        """Число наблюдений с заданными метками."""
+        item = self._values.get(self._key(labels))
+        return sum(item[0]) if item else 0
+
+    def render(self, const_labels: Optional[Dict[str, str]] = None) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            labels = {**(const_labels or {}), **dict(zip(self.labelnames, key))}
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Метрика, значения которой считываются при каждом экспорте.
+
+    Подходит для счетчиков, которые компоненты уже ведут сами
+    (кеши, пул соединений, предохранитель): они не дублируются.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, callback: Callable[[], Iterable[Sample]]):
+        """
+        :param name: Имя метрики.
+        :param documentation: Описание.
+        :param kind: Тип для Prometheus: "counter" или "gauge".
+        :param callback: Функция, возвращающая пары (метки, значение).
+        """
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self, const_labels: Optional[Dict[str, str]] = None) -> List[str]:
+        lines = self._header()
+        try:
+            samples = list(self.callback())
+        except Exception as e:
+            logger.warning(f"Не удалось получить значения метрики {self.name}: {e}")
+            return []
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels({**(const_labels or {}), **labels})} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик с экспортом в текстовом формате Prometheus.
+
+    Метрики ведутся в памяти процесса. При нескольких воркерах за одним портом
+    каждый опрос попадает в случайный воркер, поэтому в const_labels задается
+    метка воркера: ряды разных процессов не смешиваются, а суммы по воркерам
+    считаются в Prometheus (sum without (worker)).
+    """
+
+    def __init__(self, const_labels: Optional[Dict[str, str]] = None):
+        """
+        :param const_labels: Метки, добавляемые ко всем значениям при экспорте.
+        """
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.const_labels: Dict[str, str] = dict(const_labels or {})
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Добавляет метрику; метрика с тем же именем заменяется (например, при пересоздании контейнера)."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str,
+                 callback: Callable[[], Iterable[Sample]]) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, kind, callback))
+
+    def render(self) -> str:
+        """Возвращает все метрики в текстовом формате Prometheus (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render(self.const_labels))
+        return "\n".join(lines) + "\n"
+
+
+# Реестр процесса и метрики конвейера
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "expert_bot_stage_duration_seconds", "Длительность этапа обработки запроса", ("stage", "alias"))
+STAGE_ERRORS = REGISTRY.counter(
+    "expert_bot_stage_errors_total", "Число этапов, завершившихся исключением", ("stage", "alias"))
+STAGE_TOKENS = REGISTRY.counter(
+    "expert_bot_stage_tokens_total", "Токены по этапам (локальная оценка)", ("stage", "alias"))
+LLM_REQUEST_DURATION = REGISTRY.histogram(
+    "expert_bot_llm_request_duration_seconds", "Длительность одного вызова API LLM", ("model",))
+LLM_REQUESTS = REGISTRY.counter(
+    "expert_bot_llm_requests_total", "Вызовы LLM по исходу (ok, error, deadline)", ("model", "outcome"))
+LLM_TOKENS = REGISTRY.counter(
+    "expert_bot_llm_tokens_total", "Токены по данным провайдера (prompt, cached_prompt, completion)", ("model", "kind"))
+
+
+def set_known_aliases(aliases: Optional[Iterable[str]]):
+    """
+    Задает допустимые значения метки alias.
+
+    :param aliases: Известные alias (например, ключи Parameters.alias_to_site); None — без ограничения.
+    """
+    global _known_aliases
+    _known_aliases = frozenset(aliases) if aliases is not None else None
+
+
+def metric_alias(alias: str) -> str:
+    """Значение метки alias: неизвестные alias сводятся к OTHER_ALIAS."""
+    if _known_aliases is not None and alias not in _known_aliases:
+        return OTHER_ALIAS
+    return alias
+
+
+@contextlib.contextmanager
+def request_alias(alias: str) -> Iterator[None]:
+    """Задает alias запроса для меток метрик на время блока (см. metric_alias)."""
+    token = _alias.set(metric_alias(alias))
+    try:
+        yield
+    finally:
+        try:
+            _alias.reset(token)
+        except ValueError:
+            # Асинхронный генератор возобновлен в другом контексте
+            _alias.set("")
+
+
+def current_alias() -> str:
+    """Alias текущего запроса (пустая строка, если не задан)."""
+    return _alias.get()
+
+
+@contextlib.contextmanager
+def track_stage_timings(timings: Dict[str, float]) -> Iterator[Dict[str, float]]:
+    """
+    Собирает длительности этапов (observe_stage) внутри блока в словарь timings.
+
+    Повторные замеры одного этапа суммируются.
+
+    :param timings: Словарь "этап -> сек.", обычно из памяти запроса.
+    """
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        try:
+            _stage_timings.reset(token)
+        except ValueError:
+            # Асинхронный генератор возобновлен в другом контексте
+            _stage_timings.set(None)
+
+
+@contextlib.contextmanager
+def observe_stage(stage: str) -> Iterator[None]:
+    """Замеряет длительность блока как этап stage, считает исключения и открывает span трассировки."""
+    alias = _alias.get()
+    started_at = time.perf_counter()
+    try:
+        with span(stage, alias=alias):
+            yield
+    except BaseException as e:
+        # Отмена — не ошибка этапа (например, отмененный оптимистичный поиск)
+        if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+            STAGE_ERRORS.inc(stage=stage, alias=alias)
+        raise
+    finally:
+        duration = time.perf_counter() - started_at
+        STAGE_DURATION.observe(duration, stage=stage, alias=alias)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + duration
+
+
+def timed_stage(stage: str):
+    """
+    Декоратор асинхронной функции или асинхронного генератора: замеряет этап stage (см. observe_stage).
+
+    Для генератора длительность считается от первого до последнего фрагмента.
+    """
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def gen_wrapper(*args, **kwargs):
+                with observe_stage(stage):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return gen_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_stage_tokens(stage: str, tokens: int):
+    """Добавляет токены этапа к метрикам процесса."""
+    STAGE_TOKENS.inc(tokens, stage=stage, alias=_alias.get())
+
+
+def stats_samples(stats: Optional[Dict[str, float]], **labels: str) -> List[Sample]:
+    """Превращает словарь числовых счетчиков компонента в пары (метки, значение) с меткой name."""
+    return [
+        ({**labels, "name": name}, float(value))
+        for name, value in (stats or {}).items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
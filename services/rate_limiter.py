@@ -0,0 +1,110 @@
+# services/rate_limiter.py
+
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Асинхронное «ведро токенов»: не более rate единиц в минуту с запасом capacity.
+
+    Ожидающие получают единицы в порядке очереди: ожидание выполняется
+    под блокировкой, поэтому крупный запрос не голодает из-за мелких.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param rate_per_minute: Скорость пополнения (единиц в минуту).
+        :param capacity: Емкость ведра (по умолчанию — минутный лимит).
+        :param clock: Источник времени (подменяется в тестах).
+        """
+        if rate_per_minute <= 0:
+            raise ValueError("Скорость пополнения должна быть положительной")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """
+        Забирает amount единиц, при необходимости дожидаясь пополнения.
+
+        Запрос больше емкости ведра ждет полного ведра и опустошает его.
+
+        :param amount: Число единиц (запросов или токенов).
+        :return: Время ожидания в секундах.
+        """
+        amount = min(amount, self.capacity)
+        started_at = self._clock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return self._clock() - started_at
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class ModelRateLimiter:
+    """
+    Лимиты провайдера по моделям: запросы в минуту (RPM) и токены в минуту (TPM).
+
+    Лимиты задаются словарем {"модель": {"rpm": ..., "tpm": ...}}; ключ "*"
+    задает лимиты для остальных моделей. Модели без лимитов не ограничиваются.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, float]], clock: Callable[[], float] = time.monotonic):
+        """
+        :param limits: Лимиты по моделям.
+        :param clock: Источник времени (подменяется в тестах).
+        """
+        self.limits = limits
+        self._clock = clock
+        self._buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self.stats = {"acquired": 0, "throttled": 0, "wait_seconds": 0.0}
+
+    def _model_buckets(self, model: str) -> Dict[str, TokenBucket]:
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            limits = self.limits.get(model, self.limits.get("*", {}))
+            buckets = {
+                name: TokenBucket(limits[name], clock=self._clock)
+                for name in ("rpm", "tpm") if limits.get(name)
+            }
+            self._buckets[model] = buckets
+        return buckets
+
+    async def acquire(self, model: str, tokens: int = 0):
+        """
+        Дожидается, пока запрос к модели уложится в лимиты.
+
+        :param model: Имя модели.
+        :param tokens: Оценка токенов запроса (промпт + max_tokens), учитывается в TPM.
+        """
+        buckets = self._model_buckets(model)
+        waited = 0.0
+        if "rpm" in buckets:
+            waited += await buckets["rpm"].acquire(1)
+        if "tpm" in buckets and tokens:
+            waited += await buckets["tpm"].acquire(tokens)
+        self.stats["acquired"] += 1
+        if waited > 0.001:
+            self.stats["throttled"] += 1
+            self.stats["wait_seconds"] += waited
+            logger.debug(f"Запрос к модели {model} ожидал лимита провайдера {waited:.2f} с")
+
+    def metrics(self) -> dict:
+        """Возвращает число запросов, задержанных лимитами, и суммарное ожидание."""
+        return dict(self.stats)
@@ -0,0 +1,275 @@
+# services/resilience.py
+
+import time
+import random
+import logging
+import contextlib
+import contextvars
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки запроса в порядке выполнения
+STAGES = ("classifier", "retrieval", "analysis", "voting", "answer")
+
+# Доли бюджета времени запроса по этапам (см. stage_deadline)
+DEFAULT_STAGE_SHARES = {
+    "classifier": 0.1,
+    "retrieval": 0.15,
+    "analysis": 0.35,
+    "voting": 0.15,
+    "answer": 0.25,
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Исчерпан бюджет времени запроса."""
+
+
+class StageDeadlineExceeded(DeadlineExceeded):
+    """Исчерпана доля бюджета этапа, но время запроса еще осталось: этап завершается, запрос продолжается."""
+
+
+@dataclass(frozen=True)
+class _Deadline:
+    expires_at: float
+    shares: Dict[str, float]
+    # Дедлайн всего запроса (у дедлайна этапа expires_at раньше)
+    request_expires_at: float
+
+
+# Дедлайн текущего запроса (момент time.monotonic()); дочерние задачи asyncio
+# наследуют его вместе с контекстом
+_deadline: contextvars.ContextVar[Optional[_Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Оставшееся время (сек.) до дедлайна текущего запроса или этапа; None — дедлайна нет."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline.expires_at - time.monotonic()
+
+
+def cap_timeout(timeout: float) -> float:
+    """Ограничивает таймаут операции оставшимся временем запроса."""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Истек бюджет времени запроса")
+    return min(timeout, left)
+
+
+@contextlib.contextmanager
+def _set_deadline(deadline: _Deadline) -> Iterator[None]:
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            # Асинхронный генератор возобновлен в другом контексте
+            _deadline.set(None)
+
+
+@contextlib.contextmanager
+def request_deadline(timeout: float, shares: Optional[Dict[str, float]] = None) -> Iterator[None]:
+    """
+    Задает бюджет времени на весь запрос.
+
+    :param timeout: Бюджет в секундах (0 или меньше — без ограничения).
+    :param shares: Доли бюджета по этапам (по умолчанию DEFAULT_STAGE_SHARES).
+    """
+    if timeout <= 0:
+        yield
+        return
+    expires_at = time.monotonic() + timeout
+    with _set_deadline(_Deadline(expires_at, shares or DEFAULT_STAGE_SHARES, expires_at)):
+        yield
+
+
+@contextlib.contextmanager
+def stage_deadline(stage: str) -> Iterator[None]:
+    """
+    Ограничивает этап частью оставшегося бюджета запроса.
+
+    Этап получает долю оставшегося времени, пропорциональную своей доле среди
+    этого и последующих этапов. Время, не израсходованное ранними этапами,
+    переходит к поздним. Без дедлайна запроса ничего не делает.
+
+    Если доля этапа истекла раньше бюджета запроса, DeadlineExceeded изнутри
+    этапа заменяется на StageDeadlineExceeded: вызывающий код завершает этап
+    запасным результатом, а не весь запрос.
+
+    :param stage: Имя этапа из STAGES.
+    :raises StageDeadlineExceeded: Если истекла доля этапа, а бюджет запроса — нет.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        yield
+        return
+    now = time.monotonic()
+    later = STAGES[STAGES.index(stage):] if stage in STAGES else (stage,)
+    total = sum(deadline.shares.get(name, 0.0) for name in later)
+    share = deadline.shares.get(stage, 0.0) / total if total else 1.0
+    expires_at = min(deadline.expires_at, now + (deadline.expires_at - now) * share)
+    try:
+        with _set_deadline(_Deadline(expires_at, deadline.shares, deadline.request_expires_at)):
+            yield
+    except DeadlineExceeded as e:
+        if isinstance(e, StageDeadlineExceeded) or time.monotonic() >= deadline.request_expires_at:
+            raise
+        raise StageDeadlineExceeded(f"Истекла доля бюджета времени этапа {stage}") from e
+
+
+@dataclass
+class RetryPolicy:
+    """Экспоненциальная задержка между повторами с «полным» джиттером."""
+    max_retries: int = 2
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Задержка перед повтором.
+
+        :param attempt: Номер неудачной попытки (с 0).
+        :param retry_after: Задержка, запрошенная сервером (заголовок Retry-After).
+        :return: Задержка в секундах.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей вызовов по моделям для оценки квантилей."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        :param window: Число последних наблюдений на модель.
+        :param min_samples: Минимум наблюдений, после которого квантиль считается надежным.
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, key: str, seconds: float):
+        """Добавляет наблюдение."""
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def quantile(self, key: str, q: float) -> Optional[float]:
+        """Возвращает квантиль q длительности или None, если наблюдений мало."""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitOpenError(ConnectionError):
+    """Вызов отклонен: предохранитель разомкнут, сервис считается недоступным."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для вызовов внешнего сервиса.
+
+    Состояния:
+    - closed — вызовы проходят, исходы копятся в скользящем окне из window вызовов;
+      при доле ошибок не ниже failure_rate (и не менее min_calls исходов) предохранитель размыкается;
+    - open — вызовы отклоняются сразу, без ожидания таймаута, в течение reset_timeout секунд;
+    - half_open — пропускается один пробный вызов: успех замыкает предохранитель, ошибка снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self,
+                 failure_rate: float = 0.5,
+                 window: int = 20,
+                 min_calls: int = 5,
+                 reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param failure_rate: Доля ошибок в окне, при которой предохранитель размыкается.
+        :param window: Число последних вызовов в окне.
+        :param min_calls: Минимум вызовов в окне для принятия решения.
+        :param reset_timeout: Время (сек.) в разомкнутом состоянии до пробного вызова.
+        :param clock: Источник времени (подменяется в тестах).
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self.stats = {"rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние; разомкнутый предохранитель по истечении reset_timeout переходит в half_open."""
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_started_at = None
+        return self._state
+
+    def allow(self) -> bool:
+        """Проверяет, можно ли выполнить вызов, и резервирует пробный вызов в состоянии half_open."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            now = self._clock()
+            # Пробный вызов, не сообщивший исход (например, отмененный), не блокирует навсегда
+            if self._probe_started_at is None or now - self._probe_started_at >= self.reset_timeout:
+                self._probe_started_at = now
+                return True
+        self.stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        """Учитывает успешный вызов."""
+        if self._state != self.CLOSED:
+            logger.info("Предохранитель замкнут: сервис снова отвечает")
+            self._state = self.CLOSED
+            self._outcomes.clear()
+        self._outcomes.append(True)
+
+    def record_failure(self):
+        """Учитывает неудачный вызов и при необходимости размыкает предохранитель."""
+        if self._state == self.HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if (self._state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate):
+            self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._probe_started_at = None
+        self.stats["opened"] += 1
+        logger.warning(f"Предохранитель разомкнут на {self.reset_timeout:.0f} с")
+
+    def metrics(self) -> dict:
+        """Возвращает состояние, долю ошибок в окне и счетчики отклоненных вызовов и размыканий."""
+        outcomes = len(self._outcomes)
+        return {
+            "state": self.state,
+            "failure_rate": self._outcomes.count(False) / outcomes if outcomes else 0.0,
+            **self.stats,
+        }
@@ -1,10 +1,16 @@
 # services/retriever.py
 
+import json
 import aiohttp
 import asyncio
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 import logging
 
+from services.cache import TTLCache, SharedCache, cache_key, shared_get
+from services.resilience import CircuitBreaker, CircuitOpenError
+from services.single_flight import SingleFlight
+from services.tracing import REQUEST_ID_HEADER, current_request_id, span
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -12,13 +18,188 @@ class AsyncPostRequest:
     """
     Класс для выполнения асинхронных POST-запросов к сервису поиска (ретриверу).
     Использует aiohttp для эффективной работы в асинхронной среде FastAPI.
+
+    Экземпляр владеет одной долгоживущей сессией aiohttp с пулом keep-alive
+    соединений, поэтому параллельные запросы не платят за TCP/TLS-рукопожатие
+    на каждый вызов. Сессия открывается методом start() и закрывается close()
+    в lifespan приложения.
+
+    Если задан предохранитель (breaker), при недоступности сервиса запросы
+    отклоняются сразу, а не ждут таймаута. Если задан кеш stale_cache, успешные
+    ответы запоминаются, и при сбое или разомкнутом предохранителе возвращается
+    последний ответ на тот же запрос; общий уровень shared_stale_cache делает
+    эти ответы доступными всем процессам-воркерам. Если задан single_flight,
+    одинаковые одновременные запросы отправляются на сервер один раз.
     """
-    def __init__(self, base_url: str = ""):
+    def __init__(self,
+                 base_url: str = "",
+                 connection_limit: int = 100,
+                 limit_per_host: int = 32,
+                 keepalive_timeout: float = 30.0,
+                 dns_cache_ttl: int = 300,
+                 breaker: Optional[CircuitBreaker] = None,
+                 stale_cache: Optional[TTLCache] = None,
+                 single_flight: Optional[SingleFlight] = None,
+                 shared_stale_cache: Optional[SharedCache] = None):
         """
         :param base_url: Базовый URL для всех запросов.
+        :param connection_limit: Максимальное число одновременных соединений в пуле.
+        :param limit_per_host: Максимальное число соединений к одному хосту.
+        :param keepalive_timeout: Время (сек.) жизни простаивающего keep-alive соединения.
+        :param dns_cache_ttl: Время (сек.) кеширования результатов DNS.
+        :param breaker: Предохранитель (None — без него).
+        :param stale_cache: Кеш последних успешных ответов для деградации (None — без него).
+        :param single_flight: Схлопывание одинаковых одновременных запросов (None — без него).
+        :param shared_stale_cache: Общий для процессов уровень кеша последних ответов (None — без него).
         """
         self.base_url = base_url.rstrip('/') if base_url else ""
-        
+        self.connection_limit = connection_limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.breaker = breaker
+        self.stale_cache = stale_cache
+        self.single_flight = single_flight
+        self.shared_stale_cache = shared_stale_cache
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Незавершенные фоновые записи в общий кеш по ключам запросов
+        self._shared_writes: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.connection_stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "stale_responses": 0,
+        }
+
+    def _make_trace_config(self) -> aiohttp.TraceConfig:
+        """Создает трассировку aiohttp для подсчета новых и переиспользованных соединений."""
+        async def on_connection_create_end(session, context, params):
+            self.connection_stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.connection_stats["connections_reused"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    async def start(self):
+        """
+        Открывает долгоживущую сессию с пулом keep-alive соединений.
+        Вызывается один раз при старте приложения.
+        """
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            trace_configs=[self._make_trace_config()],
+        )
+        logger.info(
+            f"Открыта сессия ретривера: limit={self.connection_limit}, "
+            f"limit_per_host={self.limit_per_host}, keepalive={self.keepalive_timeout}s"
+        )
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула. Вызывается при остановке приложения."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f"Сессия ретривера закрыта: {self.stats()}")
+        self._session = None
+        if self._shared_writes:
+            await asyncio.gather(*self._shared_writes.values(), return_exceptions=True)
+        if self.shared_stale_cache is not None:
+            self.shared_stale_cache.close()
+            self.shared_stale_cache = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает открытую сессию, создавая ее при первом обращении."""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики переиспользования соединений.
+
+        :return: Словарь со счетчиками запросов, новых и переиспользованных соединений
+                 и долей переиспользования.
+        """
+        created = self.connection_stats["connections_created"]
+        reused = self.connection_stats["connections_reused"]
+        total = created + reused
+        stats = {
+            **self.connection_stats,
+            "connection_reuse_ratio": reused / total if total else 0.0,
+        }
+        if self.breaker is not None:
+            stats["breaker"] = self.breaker.metrics()
+        if self.single_flight is not None:
+            stats["single_flight"] = self.single_flight.metrics()
+        return stats
+
+    def _record_failure(self):
+        if self.breaker is not None:
+            self.breaker.record_failure()
+
+    async def _stale_response(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        """Последний успешный ответ на тот же запрос, если он сохранен (в процессе или на общем уровне)."""
+        response_data = self.stale_cache.get(key) if self.stale_cache is not None else None
+        if response_data is None and self.shared_stale_cache is not None:
+            try:
+                cached = await shared_get(self.shared_stale_cache, cache_key(*key))
+            except Exception as e:
+                logger.warning(f"Общий кеш ответов ретривера недоступен: {e!r}")
+                cached = None
+            response_data = json.loads(cached) if cached is not None else None
+        if response_data is not None:
+            self.connection_stats["stale_responses"] += 1
+            logger.warning(f"Ретривер недоступен, используется сохраненный ответ для {key[0]}")
+        return response_data
+
+    def _remember(self, key: Tuple[str, str], response_data: Dict[str, Any]):
+        """
+        Запоминает успешный ответ для деградации.
+
+        Запись в общий кеш (сериализация и обращение к SQLite/Redis) выполняется
+        в фоне и не задерживает ответ; пока идет запись по ключу, новые ответы
+        на тот же запрос в общий кеш не пишутся.
+        """
+        if self.stale_cache is not None:
+            self.stale_cache.set(key, response_data)
+        if self.shared_stale_cache is not None and key not in self._shared_writes:
+            task = asyncio.ensure_future(self._write_shared(key, response_data))
+            self._shared_writes[key] = task
+            task.add_done_callback(lambda _: self._shared_writes.pop(key, None))
+
+    async def _write_shared(self, key: Tuple[str, str], response_data: Dict[str, Any]):
+        shared = self.shared_stale_cache
+        try:
+            await asyncio.to_thread(
+                lambda: shared.set(cache_key(*key), json.dumps(response_data, ensure_ascii=False))
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить ответ ретривера в общий кеш: {e}")
+
+    async def _send(self, url: str, request_body: Dict[str, Any],
+                    headers: Optional[Dict[str, str]], timeout: float) -> Tuple[int, Any]:
+        """Отправляет запрос и возвращает HTTP-статус и разобранный JSON ответа."""
+        session = await self._get_session()
+        self.connection_stats["requests"] += 1
+        async with session.post(
+            url,
+            json=request_body,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            return response.status, await response.json()
+
     async def post(
         self,
         endpoint: str,
@@ -36,40 +217,86 @@ class AsyncPostRequest:
         :param alias: Идентификатор источника.
         :param headers: Заголовки запроса.
         :param timeout: Таймаут ожидания ответа.
-        :return: Ответ сервера в виде словаря.
+        :return: Ответ сервера в виде словаря (при сбое — сохраненный ответ на тот же запрос, если есть).
         :raises ValueError: Если сервер вернул ошибку клиента (например, 404).
         :raises ConnectionError: В случае сетевых проблем.
+        :raises CircuitOpenError: Если предохранитель разомкнут и сохраненного ответа нет.
         """
         url = f"{self.base_url}{endpoint}"
         request_body = {"query": query, "alias": alias}
         if additional_data:
             request_body.update(additional_data)
-        
+        stale_key = (url, json.dumps(request_body, sort_keys=True, ensure_ascii=False))
+
+        if self.single_flight is not None:
+            # Одинаковые одновременные запросы (в т.ч. от разных пользователей) выполняются один раз
+            return await self.single_flight.do(
+                stale_key, lambda: self._post(url, request_body, stale_key, headers, timeout)
+            )
+        return await self._post(url, request_body, stale_key, headers, timeout)
+
+    async def _post(self, url: str, request_body: Dict[str, Any], stale_key: Tuple[str, str],
+                    headers: Optional[Dict[str, str]], timeout: float) -> Dict[str, Any]:
+        """Выполняет запрос с учетом предохранителя и кеша последних ответов (см. post)."""
+        request_id = current_request_id()
+        if request_id:
+            headers = {**(headers or {}), REQUEST_ID_HEADER: request_id}
+        with span("retriever.post", url=url, query=request_body["query"]) as current:
+            response_data = await self._post_guarded(url, request_body, stale_key, headers, timeout)
+            if current is not None and isinstance(response_data, dict):
+                current.set_attribute("results", len(response_data.get("ranking_dicts", [])))
+            return response_data
+
+    async def _post_guarded(self, url: str, request_body: Dict[str, Any], stale_key: Tuple[str, str],
+                            headers: Optional[Dict[str, str]], timeout: float) -> Dict[str, Any]:
+        if self.breaker is not None and not self.breaker.allow():
+            stale = await self._stale_response(stale_key)
+            if stale is not None:
+                return stale
+            raise CircuitOpenError(f"Сервис поиска недоступен (предохранитель: {self.breaker.state})")
+
         try:
             logger.info(f"Отправка POST-запроса на {url} с данными: {request_body}")
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json=request_body,
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=timeout)
-                ) as response:
-                    
-                    response_data = await response.json()
-                    
-                    if response.status >= 400:
-                        error_msg = f"Ошибка сервера: HTTP {response.status}\nОтвет: {response_data}"
-                        logger.error(error_msg)
-                        raise ValueError(error_msg)
-                    
-                    logger.info(f"Успешный ответ от {url}")
-                    return response_data
-                    
+
+            try:
+                status, response_data = await self._send(url, request_body, headers, timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self._record_failure()
+                stale = await self._stale_response(stale_key)
+                if stale is not None:
+                    return stale
+                raise
+            except Exception:
+                # Например, некорректный JSON в ответе: исход должен быть учтен,
+                # иначе пробный вызов полуоткрытого предохранителя не завершится
+                self._record_failure()
+                raise
+
+            if status >= 500:
+                self._record_failure()
+                stale = await self._stale_response(stale_key)
+                if stale is not None:
+                    return stale
+            elif self.breaker is not None:
+                # Ответ 4xx тоже означает, что сервис жив
+                self.breaker.record_success()
+
+            if status >= 400:
+                error_msg = f"Ошибка сервера: HTTP {status}\nОтвет: {response_data}"
+                logger.error(error_msg)
+                raise ValueError(error_msg)
+
+            self._remember(stale_key, response_data)
+            logger.info(f"Успешный ответ от {url}")
+            return response_data
+
         except aiohttp.ClientError as e:
             error_msg = f"Сетевая ошибка: {str(e)}"
             logger.error(error_msg)
             raise ConnectionError(error_msg)
+        except ValueError:
+            # Ошибочный HTTP-статус или некорректный JSON ответа
+            raise
         except Exception as e:
             error_msg = f"Неожиданная ошибка: {str(e)}"
             logger.error(error_msg)
@@ -80,4 +307,4 @@ class AsyncPostRequest:
         Магический метод, позволяющий вызывать экземпляр класса как функцию.
         Является оберткой над методом post для удобства.
         """
-        return await self.post(**kwargs)
\ No newline at end of file
+        return await self.post(**kwargs)
@@ -0,0 +1,82 @@
+# services/single_flight.py
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Схлопывание одинаковых одновременных вызовов (single-flight).
+
+    Первый вызов с данным ключом запускает вычисление в отдельной задаче,
+    остальные вызовы с тем же ключом, пришедшие до его завершения, ждут
+    ту же задачу и получают тот же результат или то же исключение.
+    Результат не кешируется: следующий вызов после завершения вычисляет заново.
+
+    Отмена одного ожидающего не отменяет вычисление для остальных; задача
+    отменяется, только когда ее больше никто не ждет. Вычисление выполняется
+    в контексте первого вызова (учет токенов, дедлайн). Результат общий
+    для всех ожидающих, изменять его нельзя.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        # Метки вызовов, запустивших вычисления (например, идентификаторы запросов)
+        self._tags: Dict[Hashable, Any] = {}
+        self.stats = {"calls": 0, "collapsed": 0}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]], tag: Any = None) -> Any:
+        """
+        Выполняет вычисление или присоединяется к уже идущему с тем же ключом.
+
+        :param key: Ключ вызова.
+        :param factory: Функция без аргументов, возвращающая корутину вычисления.
+        :param tag: Метка вызова; если задана, присоединение записывается в лог
+            как связь "метка присоединившегося -> метка первого вызова".
+        :return: Результат вычисления.
+        """
+        self.stats["calls"] += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            self._waiters[key] = 0
+            self._tags[key] = tag
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.stats["collapsed"] += 1
+            if tag is not None:
+                logger.info(f"Вызов {tag} присоединен к выполняющемуся вызову {self._tags[key]}: {key!r}")
+            else:
+                logger.debug(f"Вызов присоединен к выполняющемуся: {key!r}")
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._in_flight.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not task.done():
+                    task.cancel()
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+            del self._waiters[key]
+            del self._tags[key]
+        # Исключение отмененной или никем не дождавшейся задачи не должно попасть в лог как необработанное
+        if not task.cancelled():
+            task.exception()
+
+    def metrics(self) -> dict:
+        """Возвращает число вызовов, число схлопнутых и число выполняющихся вычислений."""
+        calls = self.stats["calls"]
+        return {
+            **self.stats,
+            "in_flight": len(self._in_flight),
+            "collapsed_ratio": self.stats["collapsed"] / calls if calls else 0.0,
+        }
@@ -0,0 +1,139 @@
+# services/tokens.py
+
+import math
+import asyncio
+import logging
+import contextlib
+import contextvars
+import functools
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+from services.metrics import record_stage_tokens
+
+try:
+    import tiktoken
+except ImportError:  # Точный подсчет токенов — опциональная возможность
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Кодировка по умолчанию для моделей, неизвестных tiktoken
+DEFAULT_ENCODING = "o200k_base"
+
+# Учет токенов текущего запроса: словарь "этап -> число токенов".
+# Задается в SearchAgent на время обработки запроса; дочерние задачи
+# asyncio наследуют контекст и пишут в тот же словарь.
+_token_usage: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("token_usage", default=None)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Загружает кодировку tiktoken для модели; None, если это невозможно."""
+    if tiktoken is None:
+        return None
+    # Модели указываются с префиксом провайдера: "openai/gpt-4o-mini"
+    name = model.split("/")[-1]
+    try:
+        try:
+            return tiktoken.encoding_for_model(name)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # Например, нет доступа к сети для загрузки файла кодировки
+        logger.warning(f"Не удалось загрузить кодировку tiktoken для '{model}', используется оценка: {e}")
+        return None
+
+
+async def preload_encodings(models: Iterable[str]):
+    """
+    Загружает кодировки tiktoken для моделей в отдельном потоке.
+
+    Загрузка файла кодировки может обращаться к сети, поэтому выполняется
+    при запуске приложения, а не в первом запросе на цикле событий.
+
+    :param models: Имена моделей.
+    """
+    for model in dict.fromkeys(models):
+        await asyncio.to_thread(_get_encoding, model)
+
+
+class TokenCounter:
+    """
+    Подсчет токенов локальным токенизатором.
+
+    Использует tiktoken, если он установлен и кодировка доступна,
+    иначе — консервативную оценку по числу символов. Кодировки заранее
+    загружает preload_encodings() при запуске приложения; если этого не
+    произошло, кодировка загружается при первом подсчете.
+    """
+
+    def __init__(self, model: str = "", chars_per_token: float = 3.0, use_tiktoken: bool = True):
+        """
+        :param model: Имя модели (определяет кодировку tiktoken).
+        :param chars_per_token: Среднее число символов на токен для оценки без tiktoken.
+        :param use_tiktoken: Использовать tiktoken, если он доступен.
+        """
+        self.model = model
+        self.chars_per_token = chars_per_token
+        self.use_tiktoken = use_tiktoken
+        self._encoding_loaded = False
+        self._encoding_value = None
+
+    @property
+    def _encoding(self):
+        if not self._encoding_loaded:
+            # При ошибке загрузки _get_encoding возвращает None — используется оценка по символам
+            self._encoding_value = _get_encoding(self.model) if self.use_tiktoken else None
+            self._encoding_loaded = True
+        return self._encoding_value
+
+    @property
+    def exact(self) -> bool:
+        """True, если подсчет выполняется токенизатором, а не оценкой."""
+        return self._encoding is not None
+
+    def count(self, text: Union[str, List[Dict[str, str]]]) -> int:
+        """Возвращает число токенов в тексте или в списке сообщений чата."""
+        if isinstance(text, list):
+            # Служебные токены разметки сообщений (оценка по формату OpenAI)
+            return sum(self.count(message.get("content", "")) + 3 for message in text) + 3
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезает текст до max_tokens токенов (без учета границ предложений)."""
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self._encoding.decode(tokens[:max_tokens])
+        return text[:int(max_tokens * self.chars_per_token)]
+
+
+@contextlib.contextmanager
+def track_token_usage(usage: Dict[str, int]) -> Iterator[Dict[str, int]]:
+    """
+    Направляет учет токенов в переданный словарь на время блока.
+
+    :param usage: Словарь "этап -> число токенов" (например, AgentMemory.token_usage).
+    """
+    token = _token_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        try:
+            _token_usage.reset(token)
+        except ValueError:
+            # Асинхронный генератор возобновлен в другом контексте
+            _token_usage.set(None)
+
+
+def record_tokens(stage: str, tokens: int):
+    """Добавляет токены этапа к учету текущего запроса (если он ведется) и к метрикам процесса."""
+    record_stage_tokens(stage, tokens)
+    usage = _token_usage.get()
+    if usage is not None:
+        usage[stage] = usage.get(stage, 0) + tokens
@@ -0,0 +1,270 @@
+# services/tracing.py
+
+import json
+import time
+import asyncio
+import uuid
+import queue
+import logging
+import threading
+import contextlib
+import contextvars
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором идентификатор запроса передается во внешние сервисы
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Идентификатор текущего запроса и текущий span; дочерние задачи asyncio наследуют их вместе с контекстом
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="")
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    """Отрезок выполнения: этап конвейера, вызов LLM или HTTP-запрос."""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_time: float = 0.0
+    end_time: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+    error: str = ""
+
+    @property
+    def duration(self) -> float:
+        """Длительность в секундах."""
+        return self.end_time - self.start_time
+
+    def set_attribute(self, name: str, value: Any):
+        self.attributes[name] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "duration": self.duration}
+
+
+class SpanExporter:
+    """Получатель завершенных span'ов. Базовая реализация ничего не делает."""
+    enabled = False
+
+    def export(self, span: Span):
+        pass
+
+    def close(self):
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    """Хранит завершенные span'ы в памяти процесса (для тестов и отладки)."""
+    enabled = True
+
+    def __init__(self, max_spans: int = 10_000):
+        """
+        :param max_spans: Максимальное число хранимых span'ов (старые отбрасываются).
+        """
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            if len(self.spans) > self.max_spans:
+                del self.spans[:len(self.spans) - self.max_spans]
+
+    def find(self, name: str) -> List[Span]:
+        """Возвращает span'ы с заданным именем."""
+        with self._lock:
+            return [span for span in self.spans if span.name == name]
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Дописывает завершенные span'ы в JSONL-файл, по одному на строку.
+
+    export() только ставит span в очередь; сериализация и запись на диск
+    выполняются пачками в фоновом потоке (как в MemoryWriter), поэтому
+    цикл событий не блокируется на файловом вводе-выводе. При переполнении
+    очереди новые span'ы отбрасываются.
+    """
+    enabled = True
+
+    def __init__(self, path: str, queue_size: int = 10_000, batch_size: int = 200):
+        """
+        :param path: Путь к файлу (создается при необходимости).
+        :param queue_size: Максимальная длина очереди span'ов.
+        :param batch_size: Максимальное число span'ов, записываемых за один flush.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _start(self):
+        # Поток запускается при первом span'е: получатель, созданный и не использованный, потоков не оставляет
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def export(self, span: Span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            stop = False
+            while not stop:
+                batch = [self._queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = []
+                for span in batch:
+                    if span is None:
+                        stop = True
+                        continue
+                    lines.append(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                try:
+                    f.writelines(lines)
+                    f.flush()
+                except OSError as e:
+                    logger.warning(f"Не удалось записать трассировку в {self.path}: {e}")
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """
+        Дописывает оставшиеся span'ы и останавливает поток.
+
+        :param timeout: Максимальное время ожидания завершения потока.
+        """
+        with self._lock:
+            self._closed = True
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+
+_exporter: SpanExporter = SpanExporter()
+
+
+def set_exporter(exporter: Optional[SpanExporter]) -> SpanExporter:
+    """
+    Задает получателя span'ов для процесса.
+
+    :param exporter: Получатель (None — трассировка выключена).
+    :return: Предыдущий получатель.
+    """
+    global _exporter
+    previous = _exporter
+    _exporter = exporter or SpanExporter()
+    return previous
+
+
+def build_exporter(kind: str, path: str = "") -> SpanExporter:
+    """
+    Создает получателя span'ов по имени из настроек.
+
+    :param kind: "none", "memory" или "file".
+    :param path: Путь к файлу для "file".
+    :raises ValueError: Для неизвестного kind или "file" без пути.
+    """
+    if kind == "none":
+        return SpanExporter()
+    if kind == "memory":
+        return InMemorySpanExporter()
+    if kind == "file":
+        if not path:
+            raise ValueError("Для записи трассировки в файл нужен путь")
+        return FileSpanExporter(path)
+    raise ValueError(f"Неизвестный получатель трассировки: {kind}")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_request_id() -> str:
+    """Идентификатор текущего запроса (пустая строка вне запроса)."""
+    return _request_id.get()
+
+
+@contextlib.contextmanager
+def _set(var: contextvars.ContextVar, value, reset_value) -> Iterator[None]:
+    token = var.set(value)
+    try:
+        yield
+    finally:
+        try:
+            var.reset(token)
+        except ValueError:
+            # Асинхронный генератор возобновлен в другом контексте
+            var.set(reset_value)
+
+
+@contextlib.contextmanager
+def request_context(request_id: str = "") -> Iterator[str]:
+    """
+    Задает идентификатор запроса на время блока; он же — trace_id span'ов.
+
+    :param request_id: Идентификатор (например, из заголовка X-Request-ID); пустой — сгенерировать.
+    :return: Идентификатор запроса.
+    """
+    request_id = request_id or new_request_id()
+    with _set(_request_id, request_id, ""):
+        yield request_id
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Открывает span, вложенный в текущий. При выключенной трассировке ничего не делает и отдает None.
+
+    :param name: Имя span'а.
+    :param attributes: Атрибуты span'а.
+    """
+    exporter = _exporter
+    if not exporter.enabled:
+        yield None
+        return
+    parent = _current_span.get()
+    trace_id = parent.trace_id if parent is not None else (_request_id.get() or new_request_id())
+    current = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent is not None else None,
+        start_time=time.time(),
+        attributes=attributes,
+    )
+    try:
+        with _set(_current_span, current, None):
+            yield current
+    except BaseException as e:
+        current.status = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+        current.error = repr(e)
+        raise
+    finally:
+        current.end_time = time.time()
+        try:
+            exporter.export(current)
+        except Exception as e:
+            logger.warning(f"Не удалось выгрузить span {name}: {e}")
+
@@ -0,0 +1,235 @@
+# tests/agents/test_ai_base.py
+
+import asyncio
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from openai import APIConnectionError, APIStatusError
+
+from agents.ai_base import AsyncLLMClient, AsyncLLMGenerator, MemoizedLLMClient
+from services.cache import TTLCache, SQLiteCache
+from services.resilience import (
+    DeadlineExceeded, LatencyTracker, RetryPolicy, StageDeadlineExceeded, request_deadline, stage_deadline,
+)
+from services.tokens import track_token_usage
+
+pytestmark = pytest.mark.asyncio
+
+
+def _completion(content: str) -> MagicMock:
+    """Собирает объект, похожий на ответ chat.completions.create."""
+    response = MagicMock()
+    response.choices = [MagicMock()]
+    response.choices[0].message.content = content
+    return response
+
+
+async def test_async_generator_returns_content():
+    """Тест: асинхронный клиент ожидает ответ API и возвращает текст."""
+    client = AsyncLLMGenerator(api_key="fake_api_key")
+    client.client.chat.completions.create = AsyncMock(return_value=_completion("ответ"))
+
+    result = await client("промпт", model="openai/gpt-4o-mini", temperature=0.1)
+
+    assert result == "ответ"
+    call_kwargs = client.client.chat.completions.create.call_args.kwargs
+    assert call_kwargs["messages"] == [{"role": "user", "content": "промпт"}]
+    assert call_kwargs["model"] == "openai/gpt-4o-mini"
+
+
+async def test_async_generator_wraps_errors():
+    """Тест: ошибки клиента оборачиваются в RuntimeError."""
+    client = AsyncLLMGenerator(api_key="fake_api_key")
+    client.client.chat.completions.create = AsyncMock(side_effect=ValueError("boom"))
+
+    with pytest.raises(RuntimeError, match="Unexpected error in LLM generation"):
+        await client("промпт", model="openai/gpt-4o-mini")
+
+
+async def test_memoized_client_caches_identical_calls(tmp_path):
+    """Тест: одинаковые вызовы отдаются из кеша, use_cache=False обходит его."""
+    inner = AsyncMock()
+    inner.generate = AsyncMock(return_value="ответ")
+    disk_path = str(tmp_path / "llm.sqlite")
+    client = MemoizedLLMClient(inner, TTLCache(max_size=10), SQLiteCache(disk_path))
+
+    assert await client("промпт", model="m", temperature=0.1, max_tokens=10) == "ответ"
+    assert await client("промпт", model="m", temperature=0.1, max_tokens=10) == "ответ"
+    await client("промпт", model="m", temperature=1.0, max_tokens=10, use_cache=False)
+    assert inner.generate.await_count == 2
+    assert client.metrics()["memory_hits"] == 1
+    client.disk_cache.close()
+
+    # Новый воркер с пустой памятью получает ответ с диска
+    restarted = MemoizedLLMClient(inner, TTLCache(max_size=10), SQLiteCache(disk_path))
+    assert await restarted("промпт", model="m", temperature=0.1, max_tokens=10) == "ответ"
+    assert inner.generate.await_count == 2
+    assert restarted.metrics()["disk_hits"] == 1
+    restarted.disk_cache.close()
+
+
+async def test_memoized_client_key_covers_all_parameters():
+    """Тест: вызовы с другим stop или response_format не попадают в чужую запись кеша."""
+    inner = AsyncMock()
+    inner.generate = AsyncMock(side_effect=["текст", "до точки", '{"ok": true}'])
+    client = MemoizedLLMClient(inner, TTLCache(max_size=10))
+
+    assert await client("промпт", model="m") == "текст"
+    assert await client("промпт", model="m", stop=["."]) == "до точки"
+    assert await client("промпт", model="m", response_format={"type": "json_object"}) == '{"ok": true}'
+    assert await client("промпт", model="m", stop=["."]) == "до точки"
+    assert inner.generate.await_count == 3
+
+
+async def test_async_generator_stream_yields_deltas():
+    """Тест: потоковый режим отдает непустые фрагменты по мере поступления."""
+    def chunk(content):
+        item = MagicMock()
+        item.choices = [MagicMock()]
+        item.choices[0].delta.content = content
+        return item
+
+    async def response():
+        for content in ["Отв", None, "ет"]:
+            yield chunk(content)
+
+    client = AsyncLLMGenerator(api_key="fake_api_key")
+    client.client.chat.completions.create = AsyncMock(return_value=response())
+
+    chunks = [c async for c in client.stream("промпт", model="openai/gpt-4o-mini")]
+
+    assert chunks == ["Отв", "ет"]
+    assert client.client.chat.completions.create.call_args.kwargs["stream"] is True
+
+
+async def test_async_generator_accounts_cached_prompt_tokens():
+    """Тест: учитываются входные токены из кеша провайдера и без него, промпт может быть списком сообщений."""
+    response = _completion("ответ")
+    response.usage.prompt_tokens = 2000
+    response.usage.prompt_tokens_details.cached_tokens = 1536
+    response.usage.completion_tokens = 100
+    client = AsyncLLMGenerator(api_key="fake_api_key")
+    client.client.chat.completions.create = AsyncMock(return_value=response)
+    messages = [{"role": "system", "content": "система"}, {"role": "user", "content": "вопрос"}]
+
+    usage = {}
+    with track_token_usage(usage):
+        await client(messages, model="openai/gpt-4o-mini")
+
+    assert client.client.chat.completions.create.call_args.kwargs["messages"] == messages
+    assert usage == {"provider_prompt": 2000, "provider_cached_prompt": 1536, "provider_completion": 100}
+    metrics = client.usage_metrics()
+    assert metrics["uncached_prompt_tokens"] == 464
+    assert metrics["cached_prompt_ratio"] == pytest.approx(0.768)
+
+
+async def test_generate_many_bounds_concurrency_and_keeps_order():
+    """Тест: промпты выполняются параллельно не более max_concurrency, результаты — в порядке промптов."""
+    class SlowClient(AsyncLLMClient):
+        active = peak = 0
+
+        async def generate(self, prompt, use_cache=True, **kwargs):
+            SlowClient.active += 1
+            SlowClient.peak = max(SlowClient.peak, SlowClient.active)
+            await asyncio.sleep(0.01 * (5 - int(prompt)))  # поздние промпты завершаются раньше
+            SlowClient.active -= 1
+            if prompt == "3":
+                raise RuntimeError("boom")
+            return f"ответ {prompt}"
+
+    results = await SlowClient().generate_many(
+        [str(i) for i in range(5)], max_concurrency=2, return_exceptions=True, model="m"
+    )
+
+    assert results[:3] == ["ответ 0", "ответ 1", "ответ 2"] and results[4] == "ответ 4"
+    assert isinstance(results[3], RuntimeError)
+    assert SlowClient.peak == 2
+    with pytest.raises(RuntimeError):
+        await SlowClient().generate_many(["3", "4"], model="m")
+
+
+async def test_async_generator_retries_transient_errors():
+    """Тест: временные ошибки повторяются с задержкой, постоянные — сразу оборачиваются в RuntimeError."""
+    client = AsyncLLMGenerator(api_key="fake_api_key", retry_policy=RetryPolicy(max_retries=2, base_delay=0.001))
+    connection_error = APIConnectionError(request=httpx.Request("POST", "https://example.com"))
+    client.client.chat.completions.create = AsyncMock(side_effect=[connection_error, _completion("ответ")])
+
+    assert await client("промпт", model="m") == "ответ"
+    assert client.usage_metrics()["resilience"]["retries"] == 1
+
+    client.client.chat.completions.create = AsyncMock(side_effect=connection_error)
+    with pytest.raises(RuntimeError):
+        await client("промпт", model="m")
+    assert client.client.chat.completions.create.await_count == 3
+
+
+async def test_async_generator_throttles_every_attempt(mocker):
+    """Тест: повтор после 429 снова проходит через лимиты провайдера."""
+    mocker.patch("agents.ai_base.TokenCounter")
+    rate_limiter = MagicMock()
+    rate_limiter.acquire = AsyncMock()
+    client = AsyncLLMGenerator(api_key="fake_api_key", rate_limiter=rate_limiter,
+                               retry_policy=RetryPolicy(max_retries=2, base_delay=0.001))
+    too_many = APIStatusError("rate limit", response=httpx.Response(429, request=httpx.Request("POST", "https://x")),
+                              body=None)
+    client.client.chat.completions.create = AsyncMock(side_effect=[too_many, _completion("ответ")])
+
+    assert await client("промпт", model="m") == "ответ"
+    assert rate_limiter.acquire.await_count == 2
+
+
+async def test_async_generator_respects_request_deadline():
+    """Тест: вызов LLM прерывается по дедлайну запроса и не повторяется."""
+    async def slow(**kwargs):
+        await asyncio.sleep(1)
+        return _completion("поздно")
+
+    client = AsyncLLMGenerator(api_key="fake_api_key")
+    client.client.chat.completions.create = AsyncMock(side_effect=slow)
+
+    with request_deadline(0.05):
+        with pytest.raises(DeadlineExceeded):
+            await client("промпт", model="m")
+    assert client.client.chat.completions.create.await_count == 1
+
+
+async def test_async_generator_stage_timeout_is_deadline():
+    """Тест: таймаут попытки по дедлайну этапа — это истечение бюджета, а не ошибка API."""
+    async def slow(**kwargs):
+        await asyncio.sleep(1)
+        return _completion("поздно")
+
+    client = AsyncLLMGenerator(api_key="fake_api_key", call_timeout=5)
+    client.client.chat.completions.create = AsyncMock(side_effect=slow)
+
+    with request_deadline(10.0, {"classifier": 0.005, "answer": 0.995}):
+        with pytest.raises(StageDeadlineExceeded):
+            with stage_deadline("classifier"):
+                await client("промпт", model="m")
+    assert client.client.chat.completions.create.await_count == 1
+
+
+async def test_async_generator_hedges_slow_calls():
+    """Тест: если ответ задерживается дольше квантиля, отправляется дублирующий запрос."""
+    calls = 0
+    loser_cancelled = asyncio.Event()
+
+    async def first_slow(**kwargs):
+        nonlocal calls
+        calls += 1
+        try:
+            await asyncio.sleep(1 if calls == 1 else 0)
+        except asyncio.CancelledError:
+            loser_cancelled.set()
+            raise
+        return _completion(f"ответ {calls}")
+
+    tracker = LatencyTracker(min_samples=1)
+    tracker.observe("m", 0.01)
+    client = AsyncLLMGenerator(api_key="fake_api_key", hedge_quantile=0.95, latency_tracker=tracker)
+    client.client.chat.completions.create = AsyncMock(side_effect=first_slow)
+
+    assert await client("промпт", model="m") == "ответ 2"
+    assert client.usage_metrics()["resilience"]["hedge_wins"] == 1
+    # Проигравший запрос отменен к моменту возврата ответа
+    assert loser_cancelled.is_set()
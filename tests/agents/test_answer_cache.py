@@ -0,0 +1,107 @@
+# tests/agents/test_answer_cache.py
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from agents.answer_cache import AnswerCache, CachedSearchAgent
+from core.data_types import AgentMemory
+from services.cache import SQLiteCache
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_cache(**kwargs) -> AnswerCache:
+    return AnswerCache(prompts_version="v1", models_signature="m1", **kwargs)
+
+
+def make_agent(answer: str = "Ответ") -> MagicMock:
+    agent = MagicMock()
+    agent.memory = AgentMemory()
+    agent.action_pipeline = AsyncMock(return_value=answer)
+    return agent
+
+
+async def test_exact_hit_skips_agent():
+    """Тест: повторный нормализованный запрос отдается из кеша."""
+    agent = make_agent()
+    cached_agent = CachedSearchAgent(agent, make_cache())
+
+    assert await cached_agent("Кто платит НДФЛ?", "bss.vip") == "Ответ"
+    assert await cached_agent("  кто платит   ндфл ", "bss.vip") == "Ответ"
+
+    agent.action_pipeline.assert_awaited_once()
+    assert cached_agent.cache.metrics()["exact_hits"] == 1
+
+
+async def test_alias_is_part_of_key():
+    """Тест: одинаковый вопрос для разных alias не смешивается."""
+    agent = make_agent()
+    cached_agent = CachedSearchAgent(agent, make_cache())
+
+    await cached_agent("Кто платит НДФЛ?", "bss.vip")
+    await cached_agent("Кто платит НДФЛ?", "uss")
+
+    assert agent.action_pipeline.await_count == 2
+
+
+async def test_fail_answer_not_cached():
+    """Тест: «НЕТ ОТВЕТА» не кешируется."""
+    agent = make_agent(answer=AgentMemory().fail_answer)
+    cached_agent = CachedSearchAgent(agent, make_cache())
+
+    await cached_agent("вопрос", "bss.vip")
+    await cached_agent("вопрос", "bss.vip")
+
+    assert agent.action_pipeline.await_count == 2
+
+
+async def test_semantic_hit():
+    """Тест: близкая переформулировка попадает в семантический уровень."""
+    cache = make_cache(semantic=True, similarity_threshold=0.8)
+    cache.set("кто должен сдавать отчет 3-ндфл", "bss.vip", "Ответ про 3-НДФЛ")
+
+    assert cache.get("кто должен сдавать отчет 3-НДФЛ в 2025", "bss.vip") == "Ответ про 3-НДФЛ"
+    assert cache.get("как ип на упрощенке вернуть ндс", "bss.vip") is None
+    assert cache.get("кто должен сдавать отчет 3-ндфл в 2025", "uss") is None
+    assert cache.metrics()["semantic_hits"] == 1
+
+
+async def test_semantic_lookup_scoped_and_bounded():
+    """Тест: семантический уровень ищет только в своей области, вытесняет старые и просроченные векторы."""
+    now = [0.0]
+    cache = make_cache(semantic=True, similarity_threshold=0.8, max_size=2, ttl=10.0, clock=lambda: now[0])
+    cached_agent = CachedSearchAgent(make_agent(), cache)
+    cache.set("кто должен сдавать отчет 3-ндфл", "bss.vip", "Ответ про 3-НДФЛ")
+    cache.set("как ип вернуть ндс", "uss", "Ответ про НДС")
+
+    assert await cached_agent("кто должен сдавать отчет 3-НДФЛ в 2025", "bss.vip") == "Ответ про 3-НДФЛ"
+    assert set(cache._buckets) == {cache._scope("bss.vip"), cache._scope("uss")}
+
+    # Вытесняется давно не использованный вектор, а не найденный семантически
+    cache.set("какие сроки уплаты усн", "uss", "Ответ про УСН")
+    assert len(cache._vectors) == 2 and cache._scope("bss.vip") in cache._buckets
+    assert list(cache._buckets[cache._scope("uss")]) == [cache.make_key("какие сроки уплаты усн", "uss")]
+
+    now[0] = 20.0
+    assert cache.get("какие сроки уплаты усн в 2025", "uss") is None
+    assert cache._scope("uss") not in cache._buckets and len(cache._vectors) == 1
+    metrics = cache.metrics()
+    assert (metrics["semantic_hits"], metrics["misses"], metrics["stores"]) == (1, 1, 3)
+
+
+async def test_shared_level_between_workers(tmp_path):
+    """Тест: ответ, закешированный одним воркером, отдается другому через общий уровень."""
+    path = str(tmp_path / "answers.sqlite")
+    first_agent, second_agent = make_agent(), make_agent(answer="Другой ответ")
+    first = CachedSearchAgent(first_agent, make_cache(shared=SQLiteCache(path)))
+    second = CachedSearchAgent(second_agent, make_cache(shared=SQLiteCache(path)))
+
+    assert await first("Кто платит НДФЛ?", "bss.vip") == "Ответ"
+    assert await second("кто платит ндфл", "bss.vip") == "Ответ"
+    assert await second("кто платит ндфл", "bss.vip") == "Ответ"
+
+    second_agent.action_pipeline.assert_not_awaited()
+    metrics = second.cache.metrics()
+    assert (metrics["shared_hits"], metrics["exact_hits"], metrics["misses"]) == (1, 1, 0)
+    first.cache.close()
+    second.cache.close()
@@ -0,0 +1,56 @@
+# tests/agents/test_candidates.py
+
+import pytest
+
+from agents.candidates import merge_candidates, top_fragments
+from core.data_types import Candidate
+
+
+def _doc(doc_id, *fragments, title="Документ"):
+    return {"mod_id": "86", "doc_id": doc_id, "title": title, "text": "текст",
+            "best_fragments_scores": [list(f) for f in fragments]}
+
+
+def test_merge_dedupes_documents_and_fragments_with_max():
+    """Тест: один документ из разных выдач схлопывается, оценка фрагмента — максимум."""
+    query_1 = [_doc("1", ("Фрагмент А", 0.5), ("Фрагмент Б", 0.4)), _doc("2", ("Фрагмент В", 0.3))]
+    query_2 = [_doc("1", ("фрагмент  а", 0.9))]
+
+    merged = merge_candidates([query_1, query_2], fusion="max")
+
+    assert [d["doc_id"] for d in merged] == ["1", "2"]
+    assert merged[0]["best_fragments_scores"] == [["Фрагмент А", 0.9], ["Фрагмент Б", 0.4]]
+    # Полный ranking_dict сохраняется, исходные данные не изменяются
+    assert merged[0]["text"] == "текст"
+    assert query_1[0]["best_fragments_scores"][0] == ["Фрагмент А", 0.5]
+
+
+def test_merge_rrf_promotes_fragments_found_by_several_queries():
+    """Тест: при RRF фрагмент из нескольких выдач обгоняет более высокую одиночную оценку."""
+    query_1 = [Candidate("86", "1", best_fragments_scores=[("одиночный", 0.99), ("общий", 0.5)])]
+    query_2 = [Candidate("86", "2", best_fragments_scores=[("другой", 0.7)]),
+               Candidate("86", "1", best_fragments_scores=[("общий", 0.6)])]
+
+    merged = merge_candidates([query_1, query_2], fusion="rrf", rrf_k=60)
+    scores = dict(merged[0].best_fragments_scores)
+
+    assert scores["общий"] == pytest.approx(1 / 62 + 1 / 62)
+    assert scores["общий"] > scores["одиночный"] == pytest.approx(1 / 61)
+
+
+def test_merge_rejects_unknown_fusion():
+    with pytest.raises(ValueError):
+        merge_candidates([[]], fusion="sum")
+
+
+def test_top_fragments_matches_sorted_order_without_duplicates():
+    """Тест: выбор через кучу совпадает с полной сортировкой, повторы фрагментов отбрасываются."""
+    candidates = [
+        _doc("1", ("а", 0.5), ("б", 0.9)),
+        _doc("2", ("в", 0.5), ("б", 0.7)),
+        Candidate("86", "3", best_fragments_scores=[("г", 0.1)]),
+    ]
+
+    top = top_fragments(candidates, 3)
+
+    assert [(c.doc_id, text, score) for c, text, score in top] == [("1", "б", 0.9), ("1", "а", 0.5), ("2", "в", 0.5)]
@@ -1,11 +1,14 @@
 import pytest
 from agents.classifying_agent import ClassifierAgent
 from core.data_types import PromtsChain, Parameters, AgentMemory
-from agents.ai_base import LLMGenerator
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock
+from agents.pre_classifier import RulePreClassifier
+from services.resilience import StageDeadlineExceeded
 
-def test_classifier_agent_action(
-    mock_ai_client: MagicMock, 
+pytestmark = pytest.mark.asyncio
+
+async def test_classifier_agent_action(
+    mock_ai_client: AsyncMock, 
     prompts: PromtsChain, 
     parameters: Parameters
 ):
@@ -22,17 +25,51 @@ def test_classifier_agent_action(
     query = "Добрый день! У работницы предприятия двое детей..."
 
     # 2. Действие (Act)
-    result = agent.action_pipeline(query)
+    result = await agent.action_pipeline(query)
 
     # 3. Проверка (Assert)
     # Проверяем, что результат соответствует ожиданиям
     assert result == expected_classification
 
     # Проверяем, что наш мок-клиент был вызван один раз
-    mock_ai_client.assert_called_once()
+    mock_ai_client.assert_awaited_once()
     
     # Проверяем, что клиент был вызван с правильными аргументами
     call_args, call_kwargs = mock_ai_client.call_args
     assert query in call_args[0] # Проверяем, что запрос пользователя есть в промпте
     assert call_kwargs['model'] == parameters.ai_model_classifier
-    assert call_kwargs['temperature'] == 0.5
\ No newline at end of file
+    assert call_kwargs['temperature'] == 0.5
+
+
+async def test_classifier_agent_uses_pre_classifier(
+    mock_ai_client: AsyncMock, 
+    prompts: PromtsChain, 
+    parameters: Parameters
+):
+    """
+    Тестирует, что очевидные запросы классифицируются локально без вызова LLM,
+    а остальные передаются в LLM.
+    """
+    mock_ai_client.return_value = "5. Другое"
+    agent = ClassifierAgent(prompts, parameters, AgentMemory(), mock_ai_client, RulePreClassifier())
+
+    assert await agent("Спасибо!") == "2"
+    mock_ai_client.assert_not_awaited()
+
+    assert await agent("Сколько будет 2+2") == "5. Другое"
+    mock_ai_client.assert_awaited_once()
+
+
+async def test_classifier_stage_overrun_falls_back_to_search(
+    mock_ai_client: AsyncMock,
+    prompts: PromtsChain,
+    parameters: Parameters
+):
+    """
+    Тестирует, что при истечении доли бюджета классификатора запрос
+    считается бухгалтерским вопросом, а не завершается ошибкой.
+    """
+    mock_ai_client.side_effect = StageDeadlineExceeded("classifier")
+    agent = ClassifierAgent(prompts, parameters, AgentMemory(), mock_ai_client)
+
+    assert await agent("Как заполнить 6-НДФЛ?") == "3"
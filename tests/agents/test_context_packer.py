@@ -0,0 +1,55 @@
+# tests/agents/test_context_packer.py
+
+from agents.context_packer import ContextPacker, FRAGMENT_TEMPLATE
+from core.data_types import Candidate, Parameters
+from services.tokens import TokenCounter
+
+
+def _counter() -> TokenCounter:
+    # Оценка по символам делает тест независимым от наличия tiktoken
+    return TokenCounter(chars_per_token=1.0, use_tiktoken=False)
+
+
+def test_truncate_sentences_keeps_whole_sentences():
+    """Тест: длинный фрагмент обрезается по границе предложения."""
+    packer = ContextPacker(_counter())
+    text = "Первое предложение. Второе предложение. Третье предложение."
+
+    assert packer.truncate_sentences(text, 100) == text
+    assert packer.truncate_sentences(text, 45) == "Первое предложение. Второе предложение.…"
+    # Первое предложение не помещается — обрезка по токенам
+    assert packer.truncate_sentences(text, 11) == "Первое пре…"
+
+
+def test_pack_fills_budget_greedily_by_score():
+    """Тест: фрагменты добавляются по убыванию оценки, пока хватает бюджета."""
+    doc = Candidate(title="Т", link="L")
+    header_tokens = len(FRAGMENT_TEMPLATE.format(title="Т", link="L", text=""))
+    fragments = [(doc, "а" * 60, 0.9), (doc, "б" * 500, 0.8), (doc, "в" * 40, 0.7)]
+    budget = 2 * header_tokens + 60 + 2 + 40
+
+    packed = ContextPacker(_counter(), budget_tokens=budget, min_fragment_tokens=50).pack(fragments)
+
+    # Второй фрагмент не помещается даже после обрезки и пропускается
+    assert packed.text == FRAGMENT_TEMPLATE.format(title="Т", link="L", text="а" * 60) + "\n\n" + \
+        FRAGMENT_TEMPLATE.format(title="Т", link="L", text="в" * 40)
+    assert (packed.fragments, packed.skipped, packed.tokens) == (2, 1, budget)
+
+
+def test_pack_respects_fragment_limits():
+    """Тест: ограничения на число и длину фрагментов."""
+    doc = Candidate(title="Т", link="L")
+    fragments = [(doc, "Длинное предложение. " * 20, 0.9), (doc, "короткий", 0.8), (doc, "лишний", 0.7)]
+
+    packed = ContextPacker(_counter(), max_fragment_tokens=50, max_fragments=2).pack(fragments)
+
+    assert packed.fragments == 2 and packed.truncated == 1
+    assert "лишний" not in packed.text
+
+
+def test_from_parameters_uses_smallest_model_budget():
+    """Тест: строка фрагментов общая для трех промптов, берется наименьший бюджет."""
+    parameters = Parameters(ai_model_voting="small-model", context_token_budgets={"small-model": 1000})
+
+    assert ContextPacker.from_parameters(parameters).budget_tokens == 1000
+    assert ContextPacker.from_parameters(Parameters(context_token_budget=0)).budget_tokens == 0
@@ -0,0 +1,80 @@
+# tests/agents/test_pre_classifier.py
+
+import json
+import pytest
+from pathlib import Path
+
+from agents.pre_classifier import (
+    RulePreClassifier, NgramPreClassifier, PreClassifier, load_memory_samples,
+    SEED_SAMPLES, GREETING, THANKS, QUESTION
+)
+
+MEMORY_PATH = Path(__file__).resolve().parents[2] / "data" / "memory"
+
+
+@pytest.mark.parametrize("query, label", [
+    ("Добрый день!", GREETING),
+    ("Здравствуйте", GREETING),
+    ("Спасибо большое!", THANKS),
+    ("Благодарю за помощь", THANKS),
+    ("Как ИП на упрощенке вернуть НДС?", QUESTION),
+    ("Подскажите, кто должен сдавать 3-НДФЛ", QUESTION),
+])
+def test_rule_pre_classifier_known_patterns(query, label):
+    """Тест: правила распознают очевидные запросы."""
+    result = RulePreClassifier().classify(query)
+    assert result is not None
+    assert result.label == label
+
+
+def test_rule_pre_classifier_greeting_with_question_is_not_greeting():
+    """Тест: приветствие с вопросом не считается приветствием."""
+    result = RulePreClassifier().classify("Добрый день! Подскажите, нужно ли платить НДФЛ с подарка?")
+    assert result is not None
+    assert result.label == QUESTION
+
+
+def test_rule_pre_classifier_unknown_returns_none():
+    """Тест: неочевидный запрос передается LLM-классификатору."""
+    assert RulePreClassifier().classify("Сколько будет 2+2") is None
+
+
+@pytest.mark.parametrize("query", [
+    "пенсия как получить?",
+    "основной вопрос: как быть?",
+    "тип документа нужно ли",
+])
+def test_rule_pre_classifier_ignores_abbreviations_inside_words(query):
+    """Тест: аббревиатуры (енс, осно, ип) внутри обычных слов не делают запрос бухгалтерским."""
+    assert RulePreClassifier().classify(query) is None
+
+
+def test_ngram_pre_classifier_roundtrip(tmp_path):
+    """Тест: модель обучается на памяти агента, сохраняется и загружается."""
+    samples = load_memory_samples(MEMORY_PATH) + SEED_SAMPLES
+    assert any(label == QUESTION for _, label in samples)
+
+    model = NgramPreClassifier(threshold=0.5).fit(samples)
+    model_path = tmp_path / "model.json"
+    model.save(model_path)
+    loaded = NgramPreClassifier.load(model_path)
+
+    assert loaded.classify("Большое спасибо").label == THANKS
+    assert loaded.classify("кто должен платить ндфл с зарплаты?").label == QUESTION
+    assert loaded.predict_proba("привет") == pytest.approx(model.predict_proba("привет"))
+
+
+def test_pre_classifier_threshold_falls_back():
+    """Тест: при низкой уверенности модели композиция возвращает None."""
+    model = NgramPreClassifier(threshold=1.1).fit(SEED_SAMPLES)
+    pre_classifier = PreClassifier([RulePreClassifier(rules={}), model])
+    assert pre_classifier.classify("Привет") is None
+
+
+def test_load_memory_samples_reads_segments(tmp_path):
+    """Тест: обучающие примеры собираются и из JSON-файлов, и из JSONL-сегментов памяти."""
+    (tmp_path / "20250601_100000_abcd.json").write_text(json.dumps({"query": "вопрос 1"}), encoding="utf-8")
+    (tmp_path / "memory_20250601_100000_1_0001.jsonl").write_text(
+        json.dumps({"query": "вопрос 2"}) + "\n" + json.dumps({"query": ""}) + "\n", encoding="utf-8"
+    )
+    assert load_memory_samples(tmp_path) == [("вопрос 1", QUESTION), ("вопрос 2", QUESTION)]
@@ -0,0 +1,245 @@
+# tests/agents/test_search_agent.py
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from agents.search_agent import SearchAgent
+from agents.search_agent_units import MemoryManager
+from core.data_types import AgentMemory, Candidate
+from services.resilience import StageDeadlineExceeded
+from services.tracing import request_context
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_search_agent(prompts, parameters, retriever, **kwargs) -> SearchAgent:
+    """Собирает SearchAgent с мок-юнитами."""
+    analysis_unit = MagicMock()
+    analysis_unit.generate = AsyncMock(return_value=("записка", "фрагменты"))
+    voting_unit = MagicMock()
+    voting_unit.vote = AsyncMock(return_value=True)
+    answer_generator = MagicMock()
+    answer_generator.generate = AsyncMock(side_effect=lambda query, *args: f"ответ: {query}")
+    return SearchAgent(
+        prompts=prompts,
+        parameters=parameters,
+        memory=AgentMemory(),
+        ai_client=AsyncMock(),
+        retriever=retriever,
+        analysis_unit=analysis_unit,
+        voting_unit=voting_unit,
+        answer_generator=answer_generator,
+        memory_manager=MagicMock(spec=MemoryManager),
+        **kwargs
+    )
+
+
+async def test_concurrent_requests_do_not_share_memory(prompts, parameters):
+    """Тест: один экземпляр агента обслуживает параллельные запросы без смешивания памяти."""
+    async def retriever(query, alias, **kwargs):
+        await asyncio.sleep(0.01)
+        return {"ranking_dicts": [{"title": query, "best_fragments_scores": []}]}
+
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+
+    answers = await asyncio.gather(agent("вопрос 1", "bss"), agent("вопрос 2", "uss"))
+
+    assert answers == ["ответ: вопрос 1", "ответ: вопрос 2"]
+    saved = [call.args[0] for call in agent.memory_manager.save.call_args_list]
+    assert {(m["query"], m["alias"]) for m in saved} == {("вопрос 1", "bss"), ("вопрос 2", "uss")}
+    for m in saved:
+        assert [c["title"] for c in m["searching_candidates"]] == [m["query"]]
+    # Шаблонная память агента не изменяется
+    assert agent.memory.searching_candidates == []
+
+
+async def test_speculative_answer_cancelled_on_negative_vote(prompts, parameters):
+    """Тест: при отрицательном голосовании спекулятивная генерация ответа отменяется."""
+    parameters.speculative_answer = True
+    answer_started = asyncio.Event()
+    answer_cancelled = asyncio.Event()
+
+    async def slow_answer(*args):
+        answer_started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            answer_cancelled.set()
+            raise
+
+    async def vote(*args):
+        await answer_started.wait()  # ответ уже генерируется во время голосования
+        return False
+
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+    agent.answer_generator.generate = AsyncMock(side_effect=slow_answer)
+    agent.voting_unit.vote = AsyncMock(side_effect=vote)
+
+    answer = await asyncio.wait_for(agent("вопрос"), timeout=1)
+
+    assert answer == AgentMemory().fail_answer
+    assert answer_cancelled.is_set()
+
+
+async def test_speculative_answer_failure_ignored_on_negative_vote(prompts, parameters):
+    """Тест: ошибка спекулятивной генерации не мешает вернуть отказ при отрицательном голосовании."""
+    parameters.speculative_answer = True
+    answer_failed = asyncio.Event()
+
+    async def failing_answer(*args):
+        answer_failed.set()
+        raise RuntimeError("LLM недоступна")
+
+    async def vote(*args):
+        await answer_failed.wait()  # генерация завершилась ошибкой до вердикта
+        return False
+
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+    agent.answer_generator.generate = AsyncMock(side_effect=failing_answer)
+    agent.voting_unit.vote = AsyncMock(side_effect=vote)
+
+    answer = await asyncio.wait_for(agent("вопрос"), timeout=1)
+
+    assert answer == AgentMemory().fail_answer
+
+
+async def test_speculative_answer_returned_on_positive_vote(prompts, parameters):
+    """Тест: при положительном голосовании возвращается спекулятивно сгенерированный ответ."""
+    parameters.speculative_answer = True
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+
+    answer = await agent("вопрос")
+
+    assert answer == "ответ: вопрос"
+    agent.voting_unit.vote.assert_awaited_once()
+    agent.answer_generator.generate.assert_awaited_once()
+
+
+async def test_overlap_query_generation_starts_search_early(prompts, parameters):
+    """Тест: поиск по исходному запросу стартует до окончания генерации доп. запросов."""
+    parameters.overlap_query_generation = True
+    searched = []
+
+    async def retriever(query, alias, **kwargs):
+        searched.append(query)
+        return {"ranking_dicts": [{"title": query}]}
+
+    agent = make_search_agent(prompts, parameters, retriever, queries_generate=True)
+
+    async def generate_queries(prompt, **kwargs):
+        await asyncio.sleep(0)
+        assert searched == ["исходный вопрос"]
+        return "Вопрос1: первый\nВопрос2: второй"
+
+    agent.ai_client.side_effect = generate_queries
+
+    await agent("исходный вопрос")
+
+    saved = agent.memory_manager.save.call_args.args[0]
+    assert saved["temp_queries"] == ["исходный вопрос", "первый", "второй"]
+    assert searched == ["исходный вопрос", "первый", "второй"]
+
+
+async def test_stream_pipeline_yields_chunks_and_saves_answer(prompts, parameters):
+    """Тест: потоковый конвейер отдает фрагменты ответа и сохраняет полный ответ."""
+    async def stream(*args):
+        for chunk in ["Ответ ", "по ", "частям"]:
+            yield chunk
+
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+    agent.answer_generator.stream = stream
+
+    chunks = [chunk async for chunk in agent.stream_pipeline("вопрос")]
+
+    assert chunks == ["Ответ ", "по ", "частям"]
+    saved = agent.memory_manager.save.call_args.args[0]
+    assert saved["answer"] == "Ответ по частям"
+
+
+async def test_slim_candidates_projected_at_ingest(prompts, parameters):
+    """Тест: кандидаты хранятся в компактном виде, у сервиса поиска запрашивается подмножество полей."""
+    parameters.retrieval_fields = ["mod_id", "doc_id", "title", "best_fragments_scores"]
+    retriever = AsyncMock(return_value={"ranking_dicts": [{
+        "mod_id": "86", "doc_id": "1", "title": "doc", "text": "полный текст",
+        "best_fragments_scores": [["фрагмент", 0.5]],
+    }]})
+    agent = make_search_agent(prompts, parameters, retriever)
+
+    memory = await agent.retrieve("вопрос", "bss.vip")
+
+    assert retriever.call_args.kwargs["additional_data"] == {"fields": parameters.retrieval_fields}
+    candidate = memory.searching_candidates[0]
+    assert isinstance(candidate, Candidate)
+    assert candidate.link == "https://vip.1gl.ru?#/document/86/1/"
+    assert "text" not in memory.model_dump()["searching_candidates"][0]
+
+    parameters.slim_candidates = False
+    memory = await agent.retrieve("вопрос", "bss.vip")
+    assert memory.searching_candidates[0]["text"] == "полный текст"
+
+
+async def test_overlapping_query_results_are_merged(prompts, parameters):
+    """Тест: пересекающиеся выдачи сгенерированных запросов объединяются по документу."""
+    async def retriever(query, alias, **kwargs):
+        return {"ranking_dicts": [{"mod_id": "86", "doc_id": "1", "title": "doc",
+                                   "best_fragments_scores": [["общий фрагмент", 0.5]]}]}
+
+    agent = make_search_agent(prompts, parameters, retriever, queries_generate=True)
+    agent.ai_client = AsyncMock(return_value="Вопрос1: первый\nВопрос2: второй")
+
+    memory = await agent.retrieve("вопрос", "bss.vip")
+
+    assert len(memory.temp_queries) == 3
+    assert len(memory.searching_candidates) == 1
+    assert memory.searching_candidates[0].best_fragments_scores == [("общий фрагмент", 0.5)]
+
+
+async def test_saved_memory_carries_request_id(prompts, parameters):
+    """Тест: идентификатор запроса попадает в сохраненную память агента."""
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+
+    with request_context("req-7"):
+        await agent("вопрос", "bss")
+
+    assert agent.memory_manager.save.call_args.args[0]["request_id"] == "req-7"
+
+
+async def test_saved_memory_carries_stage_timings_and_models(prompts, parameters):
+    """Тест: в сохраненную память попадают время начала, длительности этапов и модели."""
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+
+    await agent("вопрос", "bss")
+
+    call = agent.memory_manager.save.call_args
+    assert call.args[0]["created_at"]
+    assert "retrieval" in call.args[0]["stage_timings"]
+    assert call.kwargs["models"]["answer_generator"] == parameters.ai_model_answer_generator
+
+
+@pytest.mark.parametrize("speculative", [False, True])
+async def test_voting_stage_overrun_keeps_answer(prompts, parameters, speculative):
+    """Тест: голосование, не уложившееся в долю этапа, пропускается, ответ возвращается."""
+    parameters.speculative_answer = speculative
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+    agent.voting_unit.vote = AsyncMock(side_effect=StageDeadlineExceeded("voting"))
+
+    assert await agent("вопрос") == "ответ: вопрос"
+
+
+async def test_analysis_stage_overrun_returns_fail_answer(prompts, parameters):
+    """Тест: без аналитической записки возвращается ответ по умолчанию, память сохраняется."""
+    retriever = AsyncMock(return_value={"ranking_dicts": [{"title": "doc"}]})
+    agent = make_search_agent(prompts, parameters, retriever, voting_unit_is=True)
+    agent.analysis_unit.generate = AsyncMock(side_effect=StageDeadlineExceeded("analysis"))
+
+    assert await agent("вопрос") == AgentMemory().fail_answer
+    agent.answer_generator.generate.assert_not_awaited()
+    agent.memory_manager.save.assert_called_once()
@@ -1,28 +1,31 @@
 # tests/agents/test_search_agent_units.py
 
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock
 
-from agents.ai_base import LLMGenerator
 from agents.search_agent_units import AnalysisUnit, VotingUnit, AnswerGenerator
 from core.data_types import PromtsChain, Parameters
+from services.tokens import track_token_usage
+from tests.conftest import PROMPTS_FILE_PATH
+
+pytestmark = pytest.mark.asyncio
 
 @pytest.fixture
 def mock_ai_client():
-    """Фикстура для мока LLM-клиента."""
-    return MagicMock(spec=LLMGenerator)
+    """Фикстура для мока асинхронного LLM-клиента."""
+    return AsyncMock()
 
 @pytest.fixture
 def prompts():
     """Фикстура с промптами."""
-    return PromtsChain()
+    return PromtsChain.from_file(PROMPTS_FILE_PATH)
 
 @pytest.fixture
 def parameters():
     """Фикстура с параметрами."""
     return Parameters()
 
-def test_analysis_unit(mock_ai_client, prompts, parameters):
+async def test_analysis_unit(mock_ai_client, prompts, parameters):
     """Тестирует юнит для создания аналитической записки."""
     # Настройка
     mock_ai_client.return_value = "Сгенерированная аналитическая записка"
@@ -35,46 +38,97 @@ def test_analysis_unit(mock_ai_client, prompts, parameters):
     ]
 
     # Действие
-    note, fragments_str = analysis_unit.generate(query, candidates)
+    note, fragments_str = await analysis_unit.generate(query, candidates)
 
     # Проверка
     assert note == "Сгенерированная аналитическая записка"
     assert "Заголовок текста: Doc 1" in fragments_str
     assert "Фрагмент: fragment 1" in fragments_str
-    mock_ai_client.assert_called_once() # Проверяем, что LLM была вызвана
+    mock_ai_client.assert_awaited_once() # Проверяем, что LLM была вызвана
 
-def test_voting_unit_success(mock_ai_client, prompts, parameters):
+async def test_voting_unit_success(mock_ai_client, prompts, parameters):
     """Тестирует успешный исход голосования."""
     mock_ai_client.return_value = "ОБЩЕЕ МНЕНИЕ: ЕСТЬ ОТВЕТ"
     voting_unit = VotingUnit(mock_ai_client, prompts, parameters)
 
-    result = voting_unit.vote("query", "note", "fragments")
+    result = await voting_unit.vote("query", "note", "fragments")
     
     assert result is True
 
-def test_voting_unit_failure(mock_ai_client, prompts, parameters):
+async def test_voting_unit_failure(mock_ai_client, prompts, parameters):
     """Тестирует неуспешный исход голосования."""
     mock_ai_client.return_value = "ОБЩЕЕ МНЕНИЕ: НЕТ ОТВЕТА"
     voting_unit = VotingUnit(mock_ai_client, prompts, parameters)
 
-    result = voting_unit.vote("query", "note", "fragments")
+    result = await voting_unit.vote("query", "note", "fragments")
 
     assert result is False
 
-def test_answer_generator(mock_ai_client, prompts, parameters):
+async def test_answer_generator(mock_ai_client, prompts, parameters):
     """Тестирует генератор ответов."""
     mock_ai_client.return_value = "Финальный ответ"
     answer_generator = AnswerGenerator(mock_ai_client, prompts, parameters)
 
     # Сценарий с включенным голосованием
-    answer_with_voting = answer_generator.generate("q", "n", "f", voting_enabled=True)
+    answer_with_voting = await answer_generator.generate("q", "n", "f", voting_enabled=True)
     assert answer_with_voting == "Финальный ответ"
     # Проверяем, что использовался правильный промпт
     call_args, _ = mock_ai_client.call_args
     assert "Аналитическая записка:" in call_args[0]
     
     # Сценарий с выключенным голосованием
-    answer_without_voting = answer_generator.generate("q", "n", "f", voting_enabled=False)
+    answer_without_voting = await answer_generator.generate("q", "n", "f", voting_enabled=False)
     assert answer_without_voting == "Финальный ответ"
     call_args, _ = mock_ai_client.call_args
-    assert 'Если из полученной "Аналитической записки" и "Текстов материалов" нельзя ответить' in call_args[0]
\ No newline at end of file
+    assert 'Если из полученной "Аналитической записки" и "Текстов материалов" нельзя ответить' in call_args[0]
+
+
+async def test_units_record_token_usage(mock_ai_client, prompts, parameters):
+    """Тестирует учет токенов по этапам в памяти запроса."""
+    mock_ai_client.return_value = "ОБЩЕЕ МНЕНИЕ: ЕСТЬ ОТВЕТ"
+    candidates = [{"title": "Doc 1", "link": "http://1", "best_fragments_scores": [("fragment 1", 0.9)]}]
+    usage = {}
+
+    with track_token_usage(usage):
+        note, fragments_str = await AnalysisUnit(mock_ai_client, prompts, parameters).generate("вопрос", candidates)
+        await VotingUnit(mock_ai_client, prompts, parameters).vote("вопрос", note, fragments_str)
+
+    assert set(usage) == {"context", "analysis_prompt", "analysis_completion", "voting_prompt", "voting_completion"}
+    assert usage["analysis_prompt"] > usage["context"] > 0
+
+
+async def test_answer_stream_counts_completion_once(prompts, parameters, mocker):
+    """Тестирует, что токены потокового ответа считаются один раз по собранному тексту."""
+    async def stream(*args, **kwargs):
+        for chunk in ("Финальный ", "ответ"):
+            yield chunk
+
+    ai_client = AsyncMock()
+    ai_client.stream = stream
+    generator = AnswerGenerator(ai_client, prompts, parameters)
+    count = mocker.spy(generator.token_counter, "count")
+    usage = {}
+
+    with track_token_usage(usage):
+        chunks = [chunk async for chunk in generator.stream("вопрос", "записка", "фрагменты", True)]
+
+    assert chunks == ["Финальный ", "ответ"]
+    assert count.call_args_list[-1].args == ("Финальный ответ",)
+    assert count.call_count == 2  # промпт и собранный ответ
+    assert usage["answer_completion"] == generator.token_counter.count("Финальный ответ")
+
+
+async def test_voting_unit_multiple_experts_majority(prompts, parameters):
+    """Тестирует голосование несколькими независимыми вызовами: итог по большинству."""
+    parameters.voting_experts = 3
+    ai_client = AsyncMock()
+    ai_client.generate_many = AsyncMock(return_value=[
+        "ОБЩЕЕ МНЕНИЕ: ЕСТЬ ОТВЕТ", RuntimeError("timeout"), "ОБЩЕЕ МНЕНИЕ: ЕСТЬ ОТВЕТ",
+    ])
+
+    assert await VotingUnit(ai_client, prompts, parameters).vote("query", "note", "fragments") is True
+    call = ai_client.generate_many.call_args
+    assert len(call.args[0]) == 3 and call.kwargs["use_cache"] is False
+
+    ai_client.generate_many.return_value = ["ОБЩЕЕ МНЕНИЕ: ЕСТЬ ОТВЕТ", "ОБЩЕЕ МНЕНИЕ: НЕТ ОТВЕТА"]
+    assert await VotingUnit(ai_client, prompts, parameters).vote("query", "note", "fragments") is False
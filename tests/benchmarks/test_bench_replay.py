@@ -0,0 +1,101 @@
+# tests/benchmarks/test_bench_replay.py
+
+import json
+import asyncio
+import pytest
+from pathlib import Path
+
+from benchmarks.bench_replay import LoopLagMonitor, percentile, replay
+from benchmarks.stubs import (
+    LatencyModel, ReplayData, StubServer, build_llm_app, build_retriever_app, load_records, replay_request_id,
+)
+from core.data_types import Settings, Parameters
+from piplines.dependencies import AppContainer
+
+MEMORY_PATH = Path(__file__).resolve().parents[2] / "data" / "memory"
+
+RECORDS = [
+    {"query": "Кто платит НДФЛ?", "answer": "Работодатель.", "searching_candidates": [{"title": "doc 1"}]},
+    {"query": "Как вернуть НДС?", "answer": "Через декларацию.", "searching_candidates": [{"title": "doc 2"}]},
+]
+
+
+def test_percentile_edge_cases():
+    """Тест: пустой список дает 0, один элемент — сам элемент, иначе ближайший ранг."""
+    assert percentile([], 0.99) == 0.0
+    assert percentile([3.5], 0.0) == percentile([3.5], 0.5) == percentile([3.5], 1.0) == 3.5
+    values = list(range(1, 101))
+    assert (percentile(values, 0.5), percentile(values, 0.99), percentile(values, 1.0)) == (50, 99, 100)
+
+
+def test_load_records_skips_incomplete_and_respects_limit(tmp_path):
+    """Тест: читаются файлы *.json и JSONL-сегменты, записи без вопроса или кандидатов пропускаются."""
+    (tmp_path / "a.json").write_text(json.dumps(RECORDS[0], ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    lines = [RECORDS[1], {"query": "без кандидатов"}, {"searching_candidates": [{"title": "без вопроса"}]}]
+    (tmp_path / "memory_0001.jsonl").write_text(
+        "\n".join(json.dumps(record, ensure_ascii=False) for record in lines) + "\n", encoding="utf-8",
+    )
+
+    assert load_records(str(tmp_path)) == RECORDS
+    assert load_records(str(tmp_path), limit=1) == RECORDS[:1]
+
+
+def test_record_for_matches_request_id_then_query(prompts):
+    """Тест: запись выбирается по X-Request-ID, затем по вопросу в тексте, иначе — первая."""
+    data = ReplayData(RECORDS, prompts)
+
+    assert data.record_for(replay_request_id(1)) is RECORDS[1]
+    assert data.record_for("replay-7-abc", "как вернуть ндс?") is RECORDS[1]  # номер вне диапазона
+    assert data.record_for("", "Вопрос пользователя: кто платит ндфл?") is RECORDS[0]
+    assert data.record_for("", "неизвестный вопрос") is RECORDS[0]
+    with pytest.raises(ValueError):
+        ReplayData([], prompts)
+
+
+def test_stage_detected_by_prompt_prefix(prompts):
+    """Тест: этап определяется по постоянному началу шаблона промпта."""
+    data = ReplayData(RECORDS, prompts)
+
+    assert data.stage(prompts.classication.format("вопрос")) == "classication"
+    assert data.stage(prompts.validation_plan.format("вопрос", "фрагменты")) == "validation_plan"
+    assert data.stage("произвольный текст") == ""
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_collects_lags():
+    """Тест: монитор замеряет задержку цикла событий и останавливается без ошибок."""
+    monitor = LoopLagMonitor(interval=0.001)
+    monitor.start()
+    await asyncio.sleep(0.02)
+    await monitor.stop()
+
+    assert monitor.lags and all(lag >= 0 for lag in monitor.lags)
+
+
+@pytest.mark.asyncio
+async def test_replay_through_stub_servers(tmp_path, prompts, mocker):
+    """Тест: записи памяти воспроизводятся через настоящий контейнер и локальные заглушки."""
+    mocker.patch("services.tokens._get_encoding", return_value=None)
+    records = load_records(str(MEMORY_PATH), limit=2)
+    data = ReplayData(records, prompts)
+    llm = StubServer(build_llm_app(data, LatencyModel()))
+    retriever = StubServer(build_retriever_app(data, LatencyModel()))
+
+    with llm, retriever:
+        parameters = Parameters(
+            memory_path=str(tmp_path),
+            retrieval_base_url=retriever.url,
+            llm_base_url=f"{llm.url}/v1",
+        )
+        container = AppContainer.build(settings=Settings(openai_api_key="replay"), parameters=parameters)
+        await container.start()
+        try:
+            report = await replay(records, container, requests=4, concurrency=2)
+        finally:
+            await container.aclose()
+
+    assert report["requests"] == 4 and report["errors"] == {}
+    assert report["throughput_rps"] > 0
+    latency = report["latency_s"]
+    assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
@@ -0,0 +1,39 @@
+# tests/benchmarks/test_load_generator.py
+
+import random
+
+from benchmarks.load_generator import StepResult, arrival_times
+
+
+def _step(completions, latency: float, errors: int = 0) -> StepResult:
+    result = StepResult(target_rps=10.0)
+    result.duration = 1.0
+    result.sent = len(completions) + errors
+    result.completions = list(completions)
+    result.latencies = [latency] * len(completions)
+    if errors:
+        result.errors["HTTP 503"] = errors
+    return result
+
+
+def test_report_detects_saturation():
+    """Тест: ступень насыщена, если сервис не держит интенсивность, нарушает SLO по p95 или ошибается."""
+    sustained = _step([i / 10 for i in range(10)], latency=0.2)
+    assert sustained.report(slo_p95=1.0, max_error_rate=0.05)["saturated"] == []
+
+    # Ответы растянулись на 3 с при отправке 10 запросов за 1 с
+    lagging = _step([i / 3 for i in range(10)], latency=2.0)
+    assert lagging.report(slo_p95=1.0, max_error_rate=0.05)["saturated"] == ["throughput", "p95"]
+
+    failing = _step([i / 10 for i in range(8)], latency=0.2, errors=2)
+    report = failing.report(slo_p95=1.0, max_error_rate=0.05)
+    assert "errors" in report["saturated"] and report["error_rate"] == 0.2
+
+
+def test_arrival_times():
+    """Тест: равномерный поток дает rps * duration отправок, пуассоновский — примерно столько же."""
+    assert arrival_times(4, 1.0, "constant", random.Random(0)) == [0.0, 0.25, 0.5, 0.75]
+    assert arrival_times(0, 1.0, "constant", random.Random(0)) == []
+    times = arrival_times(200, 5.0, "poisson", random.Random(0))
+    assert times == sorted(times) and all(0 < t < 5.0 for t in times)
+    assert 900 < len(times) < 1100
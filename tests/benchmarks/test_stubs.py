@@ -0,0 +1,63 @@
+# tests/benchmarks/test_stubs.py
+
+import json
+import pytest
+from aiohttp.test_utils import TestServer
+
+from agents.ai_base import AsyncLLMGenerator
+from benchmarks import stubs
+from benchmarks.stubs import STATS, LatencyModel, ReplayData, build_llm_app
+from services.resilience import RetryPolicy
+
+pytestmark = pytest.mark.asyncio
+
+RECORD = {
+    "query": "Кто платит НДФЛ?",
+    "answer": "НДФЛ удерживает и перечисляет налоговый агент — работодатель.",
+    "searching_candidates": [{"title": "doc"}],
+}
+
+
+async def test_llm_stub_streams_answer_with_usage(prompts):
+    """Тест: AsyncLLMGenerator.stream получает записанный ответ по SSE и учитывает usage последнего фрагмента."""
+    app = build_llm_app(ReplayData([RECORD], prompts), LatencyModel(), stream_chunk_chars=10)
+    prompt = prompts.answer_generation.split("{")[0] + RECORD["query"]
+
+    async with TestServer(app) as server:
+        client = AsyncLLMGenerator(api_key="fake_api_key", base_url=str(server.make_url("/v1")), stream_usage=True)
+        chunks = [chunk async for chunk in client.stream(prompt, model="openai/gpt-4o-mini")]
+        await client.aclose()
+
+    assert len(chunks) > 1 and "".join(chunks) == RECORD["answer"]
+    assert app[STATS]["streams"] == 1
+    usage = client.usage_metrics()
+    assert usage["calls"] == 1 and usage["completion_tokens"] == len(RECORD["answer"]) // 3
+
+
+async def test_llm_stub_injects_errors(prompts):
+    """Тест: при error_rate=1 заглушка отвечает ошибкой, и клиент сообщает о ней RuntimeError."""
+    app = build_llm_app(ReplayData([RECORD], prompts), LatencyModel(), error_rate=1.0, error_status=503)
+
+    async with TestServer(app) as server:
+        client = AsyncLLMGenerator(api_key="fake_api_key", base_url=str(server.make_url("/v1")),
+                                   retry_policy=RetryPolicy(max_retries=1, base_delay=0.001))
+        with pytest.raises(RuntimeError):
+            await client("промпт", model="openai/gpt-4o-mini")
+        await client.aclose()
+
+    assert app[STATS]["errors"] == app[STATS]["requests"] == 2
+
+
+async def test_main_reports_stats_on_interrupt(tmp_path, monkeypatch, capsys):
+    """Тест: python -m benchmarks.stubs по Ctrl+C печатает счетчики запросов заглушек и завершается."""
+    (tmp_path / "record.json").write_text(json.dumps(RECORD, ensure_ascii=False), encoding="utf-8")
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(stubs, "wait_for_interrupt", interrupt)
+    stubs.main(["--memory-path", str(tmp_path), "--llm-port", "0", "--retriever-port", "0"])
+
+    output = capsys.readouterr().out
+    assert "Записей: 1" in output
+    assert "Запросов: LLM {'requests': 0" in output
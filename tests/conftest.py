@@ -1,20 +1,22 @@
 import pytest
-from unittest.mock import MagicMock
-from agents.ai_base import LLMGenerator
+from pathlib import Path
+from unittest.mock import AsyncMock
 from core.data_types import PromtsChain, Parameters, Settings
 
+PROMPTS_FILE_PATH = Path(__file__).resolve().parent.parent / "configs" / "prompts.json"
+
 @pytest.fixture
-def mock_ai_client() -> MagicMock:
+def mock_ai_client() -> AsyncMock:
     """
-    Фикстура, которая создает мок (заглушку) для LLMGenerator.
+    Фикстура, которая создает асинхронный мок (заглушку) для AsyncLLMGenerator.
     Это позволяет тестировать логику агентов, не делая реальных вызовов к API.
     """
-    return MagicMock(spec=LLMGenerator)
+    return AsyncMock()
 
 @pytest.fixture
 def prompts() -> PromtsChain:
     """Фикстура, предоставляющая экземпляр с промптами."""
-    return PromtsChain()
+    return PromtsChain.from_file(PROMPTS_FILE_PATH)
 
 @pytest.fixture
 def parameters() -> Parameters:
@@ -1,5 +1,6 @@
 import pytest
-from core.data_types import Settings, Parameters, AgentMemory, PromtsChain, QueryRequest, AnswerResponse
+from core.data_types import Settings, Parameters, AgentMemory, PromtsChain, QueryRequest, AnswerResponse, Candidate
+from tests.conftest import PROMPTS_FILE_PATH
 
 def test_settings_creation(mocker):
     """
@@ -23,6 +24,24 @@ def test_parameters_instantiation():
     except Exception as e:
         pytest.fail(f"Ошибка при создании объекта Parameters: {e}")
 
+
+def test_parameters_from_env(tmp_path, monkeypatch):
+    """Проверяет загрузку переопределений Parameters из файла, заданного переменной окружения."""
+    monkeypatch.delenv("EXPERT_BOT_PARAMETERS", raising=False)
+    assert Parameters.from_env() == Parameters()
+
+    path = tmp_path / "parameters.json"
+    path.write_text('{"llm_base_url": "http://127.0.0.1:8001/v1", "request_timeout": 5}', encoding="utf-8")
+    monkeypatch.setenv("EXPERT_BOT_PARAMETERS", str(path))
+    parameters = Parameters.from_env()
+    assert parameters.llm_base_url == "http://127.0.0.1:8001/v1"
+    assert parameters.request_timeout == 5
+    assert parameters.retrieval_endpoint == Parameters().retrieval_endpoint
+
+    monkeypatch.setenv("EXPERT_BOT_PARAMETERS", str(tmp_path / "missing.json"))
+    with pytest.raises(FileNotFoundError):
+        Parameters.from_env()
+
 def test_agent_memory_instantiation():
     """Проверяет, что объект AgentMemory создается без ошибок."""
     try:
@@ -41,4 +60,43 @@ def test_request_response_models():
     assert query.query == "test?"
     
     answer = AnswerResponse(answer="Ответ", answer_text="Текст ответа")
-    assert answer.answer == "Ответ"
\ No newline at end of file
+    assert answer.answer == "Ответ"
+
+
+def test_candidate_projection_keeps_only_needed_fields():
+    """Проверяет, что Candidate отбрасывает текст документа и собирает ссылку при ее отсутствии."""
+    ranking_dict = {
+        "mod_id": 86, "doc_id": "802444", "title": "Заголовок",
+        "text": "полный текст" * 1000, "text_lem": "лемма", "phrases": "[]",
+        "best_fragments_scores": [["фрагмент", 0.9]],
+    }
+    candidate = Candidate.from_ranking_dict(ranking_dict, "bss.vip", Parameters().alias_to_site)
+
+    assert candidate.to_dict() == {
+        "mod_id": "86", "doc_id": "802444", "title": "Заголовок",
+        "link": "https://vip.1gl.ru?#/document/86/802444/",
+        "best_fragments_scores": [("фрагмент", 0.9)],
+    }
+    assert Candidate.coerce(candidate) is candidate
+    # В памяти запроса кандидат сериализуется как обычный словарь
+    memory = AgentMemory(searching_candidates=[candidate, {"title": "как есть"}])
+    assert memory.model_dump()["searching_candidates"][0]["title"] == "Заголовок"
+    assert memory.model_dump()["searching_candidates"][1] == {"title": "как есть"}
+
+
+def test_promts_chain_render_layouts():
+    """Проверяет, что раскладка "messages" выносит общий контекст в первые сообщения."""
+    prompts = PromtsChain.from_file(PROMPTS_FILE_PATH).model_copy(update={"system_prompt": "Ты опытный бухгалтер"})
+
+    assert prompts.render("validation_plan", "вопрос", "фрагменты") == prompts.validation_plan.format("вопрос", "фрагменты")
+
+    plan = prompts.render("validation_plan", "вопрос", "фрагменты", context=1, layout="messages")
+    answer = prompts.render("answer_generation", "вопрос", "записка", "фрагменты", context=2, layout="messages")
+
+    # Системный промпт и контекст одинаковы для этапов, инструкция этапа — последняя
+    assert plan[:2] == answer[:2]
+    assert plan[0] == {"role": "system", "content": "Ты опытный бухгалтер"}
+    assert "фрагменты" in plan[1]["content"]
+    assert "фрагменты" not in plan[2]["content"] and "вопрос" in plan[2]["content"]
+    with pytest.raises(ValueError):
+        prompts.render("validation_plan", "вопрос", "фрагменты", layout="xml")
@@ -0,0 +1,63 @@
+# tests/pipelines/test_dependencies.py
+
+import pytest
+from core.data_types import Settings, Parameters
+from piplines.dependencies import AppContainer
+from services.metrics import MetricsRegistry
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_container_shares_clients(tmp_path):
+    """Тест: агенты и юниты контейнера используют один LLM-клиент и ретривер."""
+    container = AppContainer.build(
+        settings=Settings(openai_api_key="fake_api_key"),
+        parameters=Parameters(memory_path=str(tmp_path)),
+    )
+
+    searcher = container.search_agent
+    assert container.classifier_agent.ai_client is container.ai_client
+    assert searcher.ai_client is container.ai_client
+    assert searcher.analysis_unit.ai_client is container.ai_client
+    assert searcher.answer_generator.ai_client is container.ai_client
+    assert searcher.retriever is container.retriever
+    assert searcher.memory_manager is container.memory_manager
+
+    await container.aclose()
+
+
+async def test_container_starts_memory_writer_in_start(tmp_path, mocker):
+    """Тест: фоновая запись памяти и загрузка кодировок выполняются в start(), а не при сборке контейнера."""
+    get_encoding = mocker.patch("services.tokens._get_encoding", return_value=None)
+    container = AppContainer.build(
+        settings=Settings(openai_api_key="fake_api_key"),
+        parameters=Parameters(memory_path=str(tmp_path), memory_format="jsonl"),
+    )
+    writer = container.memory_manager.writer
+    assert writer._thread is None
+
+    get_encoding.assert_not_called()
+
+    await container.start()
+    assert writer._thread.is_alive()
+    get_encoding.assert_called_once_with("openai/gpt-4o-mini")
+
+    await container.aclose()
+    assert writer._thread is None
+
+
+async def test_container_publishes_component_metrics(tmp_path):
+    """Тест: контейнер публикует счетчики кешей, ретривера и предохранителя в реестре метрик."""
+    container = AppContainer.build(
+        settings=Settings(openai_api_key="fake_api_key"),
+        parameters=Parameters(memory_path=str(tmp_path), llm_cache_enabled=True),
+    )
+    registry = MetricsRegistry()
+    container.register_metrics(registry)
+
+    text = registry.render()
+    assert 'expert_bot_retriever_breaker_state{state="closed"} 1' in text
+    assert 'expert_bot_cache_events_total{cache="llm",name="misses"} 0' in text
+    assert 'expert_bot_single_flight_total{layer="pipeline",name="calls"} 0' in text
+
+    await container.aclose()
@@ -1,19 +1,21 @@
+import asyncio
+import logging
 import pytest
-from unittest.mock import MagicMock, AsyncMock
+from unittest.mock import AsyncMock
 from piplines.expert_bot import bot_pipeline, BotDependencies
-from agents.classifying_agent import ClassifierAgent
-from agents.search_agent import SearchAgent
+from services.single_flight import SingleFlight
+from services.tracing import request_context
 
 pytestmark = pytest.mark.asyncio
 
 @pytest.fixture
 def mock_bot_dependencies() -> BotDependencies:
     """Фикстура для создания мок-зависимостей для конвейера."""
-    # Создаем мок для ClassifierAgent
-    mock_classifier = MagicMock(spec=ClassifierAgent)
+    # Создаем мок для ClassifierAgent с асинхронным __call__
+    mock_classifier = AsyncMock()
     
     # Создаем мок для SearchAgent с асинхронным __call__
-    mock_searcher = AsyncMock(spec=SearchAgent)
+    mock_searcher = AsyncMock()
     
     return BotDependencies(
         classifier_agent=mock_classifier,
@@ -30,7 +32,7 @@ async def test_bot_pipeline_greeting(mock_bot_dependencies: BotDependencies):
     
     # Проверка
     assert result == "Рады приветствовать вас на нашем сайте"
-    mock_bot_dependencies.classifier_agent.assert_called_once_with("Привет")
+    mock_bot_dependencies.classifier_agent.assert_awaited_once_with("Привет")
     mock_bot_dependencies.search_agent.assert_not_called() # Убеждаемся, что поисковик не вызывался
 
 async def test_bot_pipeline_search(mock_bot_dependencies: BotDependencies):
@@ -44,7 +46,7 @@ async def test_bot_pipeline_search(mock_bot_dependencies: BotDependencies):
 
     # Проверка
     assert result == "Ответ про НДС"
-    mock_bot_dependencies.classifier_agent.assert_called_once_with("Вопрос про НДС?")
+    mock_bot_dependencies.classifier_agent.assert_awaited_once_with("Вопрос про НДС?")
     mock_bot_dependencies.search_agent.assert_awaited_once_with("Вопрос про НДС?", "test.alias")
 
 async def test_bot_pipeline_other_category(mock_bot_dependencies: BotDependencies):
@@ -56,4 +58,95 @@ async def test_bot_pipeline_other_category(mock_bot_dependencies: BotDependencie
     result = await bot_pipeline("Сколько будет 2+2?", "test.alias", mock_bot_dependencies)
 
     # Проверка
-    assert result == "Не удалось определить тип вашего запроса. Пожалуйста, переформулируйте его."
\ No newline at end of file
+    assert result == "Не удалось определить тип вашего запроса. Пожалуйста, переформулируйте его."
+
+
+async def test_optimistic_pipeline_overlaps_retrieval(mock_bot_dependencies: BotDependencies):
+    """Тест: в оптимистичном режиме поиск стартует до ответа классификатора."""
+    retrieval_started = asyncio.Event()
+    memory = object()
+
+    async def retrieve(query, alias):
+        retrieval_started.set()
+        return memory
+
+    async def classify(query):
+        await asyncio.wait_for(retrieval_started.wait(), timeout=1)
+        return "3"
+
+    mock_bot_dependencies.optimistic_retrieval = True
+    mock_bot_dependencies.classifier_agent.side_effect = classify
+    mock_bot_dependencies.search_agent.retrieve.side_effect = retrieve
+    mock_bot_dependencies.search_agent.answer.return_value = "Ответ про НДС"
+
+    result = await bot_pipeline("Вопрос про НДС?", "test.alias", mock_bot_dependencies)
+
+    assert result == "Ответ про НДС"
+    mock_bot_dependencies.search_agent.answer.assert_awaited_once_with(memory)
+
+
+async def test_optimistic_pipeline_cancels_retrieval_for_greeting(mock_bot_dependencies: BotDependencies):
+    """Тест: для приветствия начатый поиск отменяется."""
+    retrieval_cancelled = asyncio.Event()
+
+    async def retrieve(query, alias):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            retrieval_cancelled.set()
+            raise
+
+    async def classify(query):
+        await asyncio.sleep(0)
+        return "1"
+
+    mock_bot_dependencies.optimistic_retrieval = True
+    mock_bot_dependencies.classifier_agent.side_effect = classify
+    mock_bot_dependencies.search_agent.retrieve.side_effect = retrieve
+
+    result = await bot_pipeline("Привет", "test.alias", mock_bot_dependencies)
+
+    assert result == "Рады приветствовать вас на нашем сайте"
+    assert retrieval_cancelled.is_set()
+    mock_bot_dependencies.search_agent.answer.assert_not_awaited()
+
+
+async def test_bot_pipeline_coalesces_identical_questions(mock_bot_dependencies: BotDependencies):
+    """Тест: одинаковые одновременные вопросы (с точностью до регистра и пробелов) обрабатываются один раз."""
+    async def slow_answer(query, alias):
+        await asyncio.sleep(0.01)
+        return "Ответ про НДС"
+
+    mock_bot_dependencies.classifier_agent.return_value = "3"
+    mock_bot_dependencies.search_agent.side_effect = slow_answer
+    mock_bot_dependencies.single_flight = SingleFlight()
+
+    results = await asyncio.gather(
+        bot_pipeline("Вопрос про НДС?", "test.alias", mock_bot_dependencies),
+        bot_pipeline("вопрос  про НДС?", "test.alias", mock_bot_dependencies),
+        bot_pipeline("Вопрос про НДС?", "other.alias", mock_bot_dependencies),
+    )
+
+    assert results == ["Ответ про НДС"] * 3
+    assert mock_bot_dependencies.search_agent.await_count == 2
+    assert mock_bot_dependencies.single_flight.metrics()["collapsed"] == 1
+
+
+async def test_bot_pipeline_logs_coalesced_request_ids(mock_bot_dependencies: BotDependencies, caplog):
+    """Тест: для схлопнутого запроса в лог пишется связь с идентификатором первого запроса."""
+    async def slow_answer(query, alias):
+        await asyncio.sleep(0.01)
+        return "Ответ про НДС"
+
+    async def ask(request_id):
+        with request_context(request_id):
+            return await bot_pipeline("Вопрос про НДС?", "test.alias", mock_bot_dependencies)
+
+    mock_bot_dependencies.classifier_agent.return_value = "3"
+    mock_bot_dependencies.search_agent.side_effect = slow_answer
+    mock_bot_dependencies.single_flight = SingleFlight()
+
+    with caplog.at_level(logging.INFO, logger="services.single_flight"):
+        await asyncio.gather(ask("leader"), ask("follower"))
+
+    assert "Вызов follower присоединен к выполняющемуся вызову leader" in caplog.text
@@ -0,0 +1,123 @@
+# tests/services/test_cache.py
+
+import time
+import asyncio
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+from services import cache as cache_module
+from services.cache import RedisCache, TTLCache, SQLiteCache, build_shared_cache, cache_key, shared_get
+from services.resilience import request_deadline
+
+
+class FakeClock:
+    """Управляемый источник времени."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_lru_eviction():
+    """Тест: при переполнении вытесняется давно не использованная запись."""
+    cache = TTLCache(max_size=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" становится самой свежей
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_ttl_cache_expiration():
+    """Тест: просроченная запись не возвращается."""
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert cache.metrics()["expirations"] == 1
+
+
+def test_sqlite_cache_persists_and_bounds_size(tmp_path):
+    """Тест: дисковый кеш переживает переоткрытие и ограничен по размеру."""
+    clock = FakeClock()
+    path = str(tmp_path / "cache.sqlite")
+    cache = SQLiteCache(path, max_size=2, clock=clock)
+    for i, key in enumerate(["a", "b", "c"]):
+        clock.now = i
+        cache.set(key, key.upper())
+    cache.close()
+
+    reopened = SQLiteCache(path, max_size=2, clock=clock)
+    assert reopened.get("a") is None
+    assert reopened.get("b") == "B"
+    assert reopened.get("c") == "C"
+    reopened.close()
+
+
+def test_build_shared_cache(tmp_path):
+    """Тест: общий уровень SQLite виден всем экземплярам с тем же namespace; "memory" — без общего уровня."""
+    assert build_shared_cache("memory", "answers") is None
+    with pytest.raises(ValueError):
+        build_shared_cache("memcached", "answers")
+
+    first = build_shared_cache("sqlite", "answers", path=str(tmp_path))
+    second = build_shared_cache("sqlite", "answers", path=str(tmp_path))
+    key = cache_key("вопрос", "bss.vip")
+    assert key == cache_key("вопрос", "bss.vip") != cache_key("вопрос", "uss")
+    first.set(key, "ответ")
+    assert second.get(key) == "ответ"
+    assert build_shared_cache("sqlite", "llm", path=str(tmp_path)).get(key) is None
+    first.close()
+    second.close()
+
+
+def test_redis_cache_uses_timeouts_and_namespace(monkeypatch):
+    """Тест: клиент Redis создается с конечными таймаутами, ключи — под префиксом namespace."""
+    redis_module = MagicMock()
+    client = redis_module.Redis.from_url.return_value
+    client.get.side_effect = lambda key: "ответ" if key == "expert_bot:answers:k" else None
+    monkeypatch.setattr(cache_module, "redis", redis_module)
+
+    cache = build_shared_cache("redis", "answers", ttl=2.5, redis_url="redis://cache:6379/1", redis_timeout=0.5)
+
+    assert isinstance(cache, RedisCache)
+    redis_module.Redis.from_url.assert_called_once_with(
+        "redis://cache:6379/1", decode_responses=True, socket_timeout=0.5, socket_connect_timeout=0.5,
+    )
+    assert cache.get("k") == "ответ" and cache.get("other", "нет") == "нет"
+    cache.set("k", "ответ")
+    client.set.assert_called_once_with("expert_bot:answers:k", "ответ", px=2500)
+    cache.close()
+    client.close.assert_called_once()
+
+
+def test_redis_cache_requires_package(monkeypatch):
+    """Тест: без пакета redis бэкенд сообщает, что его нужно установить."""
+    monkeypatch.setattr(cache_module, "redis", None)
+    with pytest.raises(RuntimeError):
+        RedisCache("redis://127.0.0.1:6379/0", "answers")
+
+
+@pytest.mark.asyncio
+async def test_shared_get_bounded_by_request_deadline():
+    """Тест: зависший общий уровень не задерживает запрос дольше его бюджета времени."""
+    release = threading.Event()
+    hanging = MagicMock()
+    hanging.get.side_effect = lambda key: release.wait(5)
+
+    started = time.monotonic()
+    with request_deadline(0.05):
+        with pytest.raises(asyncio.TimeoutError):
+            await shared_get(hanging, "k")
+    release.set()
+
+    assert time.monotonic() - started < 1.0
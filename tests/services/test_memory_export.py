@@ -0,0 +1,123 @@
+# tests/services/test_memory_export.py
+
+import json
+import pytest
+
+from services.memory_export import export_memory, export_row, pa
+
+pytestmark = pytest.mark.skipif(pa is None, reason="пакет pyarrow не установлен")
+ds = pytest.importorskip("pyarrow.dataset")
+
+
+def _record(i: int, alias: str, day: str) -> dict:
+    return {
+        "request_id": f"req-{i}",
+        "query": f"вопрос {i}",
+        "alias": alias,
+        "answer": "ответ" if i % 2 else "НЕТ ОТВЕТА",
+        "analysis_note": "длинная записка",
+        "saved_at": f"{day}T12:00:00",
+        "searching_candidates": [{"mod_id": 1, "doc_id": 2, "title": "doc", "text": "полный текст",
+                                  "best_fragments_scores": [["фрагмент", 0.5]]}],
+        "token_usage": {"context": 10},
+        "stage_timings": {"answer": 1.5},
+    }
+
+
+def _write_memory(path, records):
+    segment = path / "memory_20250601_120000_1_0001.jsonl"
+    segment.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records[1:]), encoding="utf-8")
+    (path / "20250601_120000_abcd.json").write_text(json.dumps(records[0], ensure_ascii=False), encoding="utf-8")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export_partitions_by_date_and_alias(tmp_path, workers):
+    """Тест: записи выгружаются в разделы date=/alias= с вложенными кандидатами."""
+    memory, output = tmp_path / "memory", tmp_path / "export"
+    memory.mkdir()
+    _write_memory(memory, [_record(0, "bss", "2025-06-01"), _record(1, "uss", "2025-06-01"),
+                           _record(2, "bss", "2025-06-02"), _record(3, "bss", "2025-06-02")])
+
+    stats = export_memory(str(memory), str(output), batch_size=1, workers=workers)
+
+    assert stats["records"] == 4 and stats["tasks"] == 2
+    assert (output / "date=2025-06-02" / "alias=bss").is_dir()
+    table = ds.dataset(str(output), partitioning="hive").to_table()
+    rows = {row["request_id"]: row for row in table.to_pylist()}
+    assert rows["req-1"]["alias"] == "uss" and rows["req-1"]["outcome"] == "answered"
+    assert rows["req-0"]["outcome"] == "not_found"
+    assert rows["req-2"]["candidates"][0]["fragments"] == [{"text": "фрагмент", "score": 0.5}]
+    assert rows["req-2"]["candidates"][0]["doc_id"] == "2"
+
+    # Повторный экспорт перезаписывает те же файлы
+    export_memory(str(memory), str(output), workers=workers)
+    assert ds.dataset(str(output), partitioning="hive").count_rows() == 4
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export_skips_malformed_records(tmp_path, workers):
+    """Тест: запись, которую не удалось преобразовать, пропускается и считается, экспорт продолжается."""
+    memory, output = tmp_path / "memory", tmp_path / "export"
+    memory.mkdir()
+    broken = _record(1, "bss", "2025-06-01")
+    broken["searching_candidates"][0]["best_fragments_scores"] = [["фрагмент", None]]
+    _write_memory(memory, [_record(0, "bss", "2025-06-01"), broken, _record(2, "bss", "2025-06-01")])
+
+    stats = export_memory(str(memory), str(output), workers=workers, batch_bytes=1)
+
+    assert (stats["records"], stats["errors"]) == (2, 1)
+    rows = ds.dataset(str(output), partitioning="hive").to_table().to_pylist()
+    assert sorted(row["request_id"] for row in rows) == ["req-0", "req-2"]
+
+
+def test_export_period_and_drop_texts(tmp_path):
+    """Тест: отбор по датам и выгрузка без объемных текстов."""
+    memory, output = tmp_path / "memory", tmp_path / "export"
+    memory.mkdir()
+    _write_memory(memory, [_record(0, "bss", "2025-06-01"), _record(1, "bss", "2025-06-02")])
+
+    stats = export_memory(str(memory), str(output), since="2025-06-02", drop_texts=True, workers=1)
+
+    assert stats["records"] == 1
+    table = ds.dataset(str(output), partitioning="hive").to_table()
+    assert "analysis_note" not in table.column_names and "answer" not in table.column_names
+    assert table.to_pylist()[0]["candidates"][0]["fragments"] == []
+
+
+def test_reexport_after_new_file_does_not_duplicate(tmp_path):
+    """Тест: повторный экспорт после появления нового файла и с другим --since не дублирует записи."""
+    memory, output = tmp_path / "memory", tmp_path / "export"
+    memory.mkdir()
+    for i in range(3):
+        (memory / f"20250601_12000{i}_abc{i}.json").write_text(json.dumps(_record(i, "bss", "2025-06-01")),
+                                                               encoding="utf-8")
+    export_memory(str(memory), str(output), workers=1)
+
+    (memory / "20250601_130000_abc3.json").write_text(json.dumps(_record(3, "bss", "2025-06-01")), encoding="utf-8")
+    export_memory(str(memory), str(output), workers=1)
+    export_memory(str(memory), str(output), since="2025-06-01", workers=1)
+
+    table = ds.dataset(str(output), partitioning="hive").to_table()
+    assert sorted(table.column("request_id").to_pylist()) == ["req-0", "req-1", "req-2", "req-3"]
+
+
+def test_export_escapes_partition_values(tmp_path):
+    """Тест: alias из запроса не выводит файлы за пределы каталога и не ломает разбиение."""
+    memory, output = tmp_path / "memory", tmp_path / "export"
+    memory.mkdir()
+    _write_memory(memory, [_record(0, "../../x", "2025-06-01"), _record(1, "a/b", "2025-06-01")])
+
+    export_memory(str(memory), str(output), workers=1)
+
+    assert not (tmp_path / "x").exists()
+    assert sorted(p.name for p in (output / "date=2025-06-01").iterdir()) == ["alias=..%2F..%2Fx", "alias=a%2Fb"]
+    table = ds.dataset(str(output), partitioning="hive").to_table()
+    assert sorted(table.column("alias").to_pylist()) == ["../../x", "a/b"]
+
+
+def test_export_row_accepts_slim_candidates():
+    """Тест: кандидаты в формате Candidate.to_dict() выгружаются так же, как ranking_dict."""
+    row = export_row({"searching_candidates": [{"mod_id": "1", "doc_id": "2", "title": "t", "link": "l",
+                                               "best_fragments_scores": [("текст", 1.0)]}]})
+    assert row["candidates"][0]["link"] == "l"
+    assert row["saved_at"] is None
@@ -0,0 +1,124 @@
+# tests/services/test_memory_index.py
+
+import json
+import pytest
+
+from core.data_types import Parameters
+from agents.search_agent_units import MemoryManager
+from services.memory_index import MemoryIndex
+from services.memory_writer import MemoryWriter, zstandard
+
+
+def _record(i: int, alias: str = "bss.vip", answer: str = "ответ", day: str = "2025-06-01") -> dict:
+    return {
+        "request_id": f"req-{i}",
+        "query": f"вопрос {i}",
+        "alias": alias,
+        "answer": answer,
+        "fail_answer": "НЕТ ОТВЕТА",
+        "created_at": f"{day}T10:00:00",
+        "saved_at": f"{day}T10:00:0{i % 10}",
+        "searching_candidates": [{"doc_id": 1}, {"doc_id": 2}],
+        "token_usage": {"context": 100, "answer_completion": 20},
+        "stage_timings": {"retrieval": 0.5, "answer": 1.5},
+        "models": {"answer_generator": "openai/gpt-4o-mini"},
+    }
+
+
+@pytest.mark.parametrize("compression", [None, "zstd"])
+def test_writer_feeds_index_with_offsets(tmp_path, compression):
+    """Тест: записи пачек MemoryWriter попадают в индекс и читаются по смещению."""
+    if compression and zstandard is None:
+        pytest.skip("пакет zstandard не установлен")
+    index = MemoryIndex(str(tmp_path / "index.sqlite"))
+    writer = MemoryWriter(str(tmp_path / "memory"), compression=compression, batch_size=2,
+                          flush_interval=0.05, on_written=index.add)
+    for i in range(5):
+        writer.submit(_record(i, answer="НЕТ ОТВЕТА" if i == 3 else "ответ"))
+    writer.start()
+    writer.close()
+
+    assert len(index) == 5
+    (row,) = index.query(contains="вопрос 3")
+    assert row["outcome"] == "not_found"
+    assert row["duration"] == 3.0
+    assert row["tokens"] == 120 and row["candidates"] == 2
+    assert row["stage_timings"] == {"retrieval": 0.5, "answer": 1.5}
+    assert index.load(row)["request_id"] == "req-3"
+    index.close()
+
+
+def test_query_filters_and_summary(tmp_path):
+    """Тест: отбор по дате, alias и исходу и сводка по дням."""
+    index = MemoryIndex(str(tmp_path / "index.sqlite"))
+    segment = tmp_path / "memory_1.jsonl"
+    records = [_record(0), _record(1, alias="uss"), _record(2, answer="НЕТ ОТВЕТА", day="2025-06-02")]
+    segment.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records), encoding="utf-8")
+    index.add(str(segment), [(r, 0, 0, 0) for r in records])
+
+    assert [r["query"] for r in index.query(alias="uss")] == ["вопрос 1"]
+    assert [r["query"] for r in index.query(outcome="not_found")] == ["вопрос 2"]
+    assert len(index.query(since="2025-06-02")) == 1
+    assert len(index.query(until="2025-06-01")) == 2
+    with pytest.raises(ValueError):
+        index.query(outcome="unknown")
+
+    summary = {(r["day"], r["alias"]): r for r in index.summary()}
+    assert summary[("2025-06-01", "bss.vip")]["requests"] == 1
+    assert summary[("2025-06-02", "bss.vip")]["answered_ratio"] == 0.0
+    index.close()
+
+
+def test_sync_indexes_existing_files_once(tmp_path):
+    """Тест: sync добавляет существующие файлы и сегменты, повторно — только выросшие."""
+    (tmp_path / "20250601_100000_abcd.json").write_text(json.dumps(_record(0)), encoding="utf-8")
+    segment = tmp_path / "memory_20250601_100000_1_0001.jsonl"
+    segment.write_text(json.dumps(_record(1)) + "\n" + json.dumps(_record(2)) + "\n", encoding="utf-8")
+    index = MemoryIndex(str(tmp_path / "index.sqlite"))
+
+    assert index.sync(str(tmp_path)) == 3
+    assert index.sync(str(tmp_path)) == 0
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write(json.dumps(_record(3)) + "\n")
+    assert index.sync(str(tmp_path)) == 1
+    assert len(index) == 4
+    (row,) = index.query(contains="вопрос 2")
+    assert index.load(row)["query"] == "вопрос 2"
+    index.close()
+
+
+@pytest.mark.parametrize("memory_format", ["json", "jsonl"])
+def test_memory_manager_maintains_index(tmp_path, memory_format):
+    """Тест: MemoryManager добавляет сохраненные записи в индекс в обоих форматах."""
+    assert MemoryManager.from_parameters(Parameters(memory_path=str(tmp_path))).index is None
+    parameters = Parameters(memory_path=str(tmp_path), memory_format=memory_format, memory_flush_interval=0.05,
+                            memory_index_enabled=True)
+    manager = MemoryManager.from_parameters(parameters)
+    manager.start()
+    manager.save({"query": "вопрос", "alias": "uss", "answer": "ответ"})
+    # close() дописывает очередь записи и индексации
+    manager.close()
+
+    index = MemoryIndex(str(tmp_path / "index.sqlite"))
+    (row,) = index.query()
+    assert row["alias"] == "uss" and row["outcome"] == "answered"
+    assert index.load(row)["query"] == "вопрос"
+    index.close()
+
+
+@pytest.mark.skipif(zstandard is None, reason="пакет zstandard не установлен")
+def test_sync_records_zstd_frame_offsets(tmp_path):
+    """Тест: при sync записи сжатого сегмента указываются своим кадром, а не всем файлом."""
+    writer = MemoryWriter(str(tmp_path), compression="zstd", batch_size=2, flush_interval=0.05)
+    for i in range(5):
+        writer.submit(_record(i))
+    writer.start()
+    writer.close()
+    index = MemoryIndex(str(tmp_path / "index.sqlite"))
+
+    assert index.sync(str(tmp_path)) == 5
+    rows = index.query()
+    assert all(row["length"] > 0 for row in rows)
+    assert len({row["offset"] for row in rows}) == 3  # пачки по 2 записи — три кадра
+    assert sorted(index.load(row)["request_id"] for row in rows) == [f"req-{i}" for i in range(5)]
+    index.close()
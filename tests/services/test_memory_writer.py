@@ -0,0 +1,51 @@
+# tests/services/test_memory_writer.py
+
+import os
+import pytest
+
+from services.memory_writer import MemoryWriter, iter_segment, zstandard
+
+
+def test_writer_batches_and_rotates_segments(tmp_path):
+    """Тест: записи пишутся компактными JSONL-сегментами с ротацией по размеру."""
+    writer = MemoryWriter(str(tmp_path), segment_max_bytes=1, batch_size=2, flush_interval=0.05)
+    for i in range(4):
+        writer.submit({"query": f"вопрос {i}", "answer": "ответ"})
+    writer.start()
+    writer.close()
+
+    segments = sorted(os.listdir(tmp_path))
+    assert len(segments) == 2
+    records = [r for name in segments for r in iter_segment(os.path.join(tmp_path, name))]
+    assert [r["query"] for r in records] == [f"вопрос {i}" for i in range(4)]
+    with open(os.path.join(tmp_path, segments[0]), encoding="utf-8") as f:
+        assert '"query":"вопрос 0"' in f.readline()  # без отступов и экранирования
+    assert writer.metrics()["written"] == 4
+
+
+@pytest.mark.parametrize("policy, kept", [("drop_newest", [0, 1]), ("drop_oldest", [1, 2])])
+def test_writer_drop_policy(tmp_path, policy, kept):
+    """Тест: при переполнении очереди применяется политика сброса."""
+    writer = MemoryWriter(str(tmp_path), queue_size=2, drop_policy=policy)
+    accepted = [writer.submit({"n": i}) for i in range(3)]
+    writer.start()
+    writer.close()
+
+    assert accepted.count(False) == (1 if policy == "drop_newest" else 0)
+    (segment,) = os.listdir(tmp_path)
+    assert [r["n"] for r in iter_segment(os.path.join(tmp_path, segment))] == kept
+    assert writer.metrics()["dropped"] == 1
+
+
+@pytest.mark.skipif(zstandard is None, reason="пакет zstandard не установлен")
+def test_writer_zstd_compression(tmp_path):
+    """Тест: сжатые сегменты читаются через iter_segment."""
+    writer = MemoryWriter(str(tmp_path), compression="zstd", batch_size=1)
+    writer.start()
+    for i in range(3):
+        writer.submit({"n": i})
+    writer.close()
+
+    (segment,) = os.listdir(tmp_path)
+    assert segment.endswith(".jsonl.zst")
+    assert [r["n"] for r in iter_segment(os.path.join(tmp_path, segment))] == [0, 1, 2]
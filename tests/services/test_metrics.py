@@ -0,0 +1,110 @@
+# tests/services/test_metrics.py
+
+import pytest
+
+from services.metrics import (
+    OTHER_ALIAS, MetricsRegistry, STAGE_DURATION, STAGE_ERRORS, request_alias, set_known_aliases,
+    timed_stage, track_stage_timings,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def known_aliases():
+    """Ограничивает значения метки alias на время теста."""
+    set_known_aliases(["metrics.alias"])
+    yield
+    set_known_aliases(None)
+
+
+async def test_registry_renders_prometheus_text():
+    """Тест: счетчики, гистограммы и метрики-обратные вызовы выводятся в формате Prometheus."""
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Запросы", ("model",))
+    duration = registry.histogram("duration_seconds", "Длительность", buckets=(0.1, 1.0))
+    registry.callback("cache_total", "Кеш", "counter", lambda: [({"name": "hits"}, 3)])
+
+    requests.inc(model="m")
+    requests.inc(2, model="m")
+    duration.observe(0.05)
+    duration.observe(0.5)
+    duration.observe(5)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{model="m"} 3' in text
+    assert 'duration_seconds_bucket{le="0.1"} 1' in text
+    assert 'duration_seconds_bucket{le="1"} 2' in text
+    assert 'duration_seconds_bucket{le="+Inf"} 3' in text
+    assert "duration_seconds_count 3" in text
+    assert 'cache_total{name="hits"} 3' in text
+    with pytest.raises(ValueError):
+        requests.inc(alias="a")
+
+
+async def test_registry_const_labels_mark_worker():
+    """Тест: постоянные метки (воркер процесса) добавляются ко всем рядам всех видов метрик."""
+    registry = MetricsRegistry(const_labels={"worker": "101"})
+    registry.counter("requests_total", "Запросы", ("model",)).inc(model="m")
+    registry.histogram("duration_seconds", "Длительность", buckets=(1.0,)).observe(0.5)
+    registry.callback("cache_total", "Кеш", "counter", lambda: [({"name": "hits"}, 3)])
+
+    text = registry.render()
+    assert 'requests_total{worker="101",model="m"} 1' in text
+    assert 'duration_seconds_bucket{worker="101",le="1"} 1' in text
+    assert 'duration_seconds_count{worker="101"} 1' in text
+    assert 'cache_total{worker="101",name="hits"} 3' in text
+
+
+async def test_timed_stage_records_latency_and_errors_per_alias(known_aliases):
+    """Тест: декоратор замеряет корутины и асинхронные генераторы и считает исключения с alias запроса."""
+    @timed_stage("test_stage")
+    async def failing():
+        raise RuntimeError("boom")
+
+    @timed_stage("test_stream")
+    async def chunks():
+        yield "a"
+        yield "b"
+
+    with request_alias("metrics.alias"):
+        with pytest.raises(RuntimeError):
+            await failing()
+        assert [chunk async for chunk in chunks()] == ["a", "b"]
+
+    assert STAGE_ERRORS.value(stage="test_stage", alias="metrics.alias") == 1
+    assert STAGE_DURATION.count(stage="test_stage", alias="metrics.alias") == 1
+    assert STAGE_DURATION.count(stage="test_stream", alias="metrics.alias") == 1
+    assert STAGE_ERRORS.value(stage="test_stream", alias="metrics.alias") == 0
+
+
+async def test_unknown_alias_reported_as_other(known_aliases):
+    """Тест: alias, которого нет среди известных, попадает в метки как "other"."""
+    @timed_stage("alias_stage")
+    async def stage():
+        pass
+
+    for alias in ("metrics.alias", "client.alias.1", "client.alias.2"):
+        with request_alias(alias):
+            await stage()
+
+    assert STAGE_DURATION.count(stage="alias_stage", alias="metrics.alias") == 1
+    assert STAGE_DURATION.count(stage="alias_stage", alias=OTHER_ALIAS) == 2
+    assert STAGE_DURATION.count(stage="alias_stage", alias="client.alias.1") == 0
+
+
+async def test_stage_timings_collected_per_request():
+    """Тест: длительности этапов внутри track_stage_timings суммируются в словарь запроса."""
+    @timed_stage("timings_stage")
+    async def stage():
+        return "ok"
+
+    timings = {}
+    with track_stage_timings(timings):
+        await stage()
+        await stage()
+    await stage()
+
+    assert list(timings) == ["timings_stage"]
+    assert timings["timings_stage"] >= 0
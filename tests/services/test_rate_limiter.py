@@ -0,0 +1,33 @@
+# tests/services/test_rate_limiter.py
+
+import time
+import asyncio
+import pytest
+
+from services.rate_limiter import TokenBucket, ModelRateLimiter
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_token_bucket_waits_for_refill():
+    """Тест: после исчерпания запаса запрос ждет пополнения."""
+    bucket = TokenBucket(rate_per_minute=600, capacity=2)  # 10 единиц в секунду
+
+    assert await bucket.acquire() < 0.01
+    assert await bucket.acquire() < 0.01
+    started = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - started >= 0.08
+
+
+async def test_model_rate_limiter_applies_rpm_and_tpm_per_model():
+    """Тест: лимиты применяются к своей модели, остальные модели не ограничиваются."""
+    limiter = ModelRateLimiter({"slow": {"rpm": 6000, "tpm": 600}})  # TPM: 10 токенов в секунду
+
+    await limiter.acquire("slow", tokens=600)  # исчерпывает минутный запас токенов
+    started = time.monotonic()
+    await asyncio.gather(limiter.acquire("slow", tokens=1), limiter.acquire("fast", tokens=10 ** 6))
+    assert time.monotonic() - started >= 0.08
+
+    assert limiter.metrics()["acquired"] == 3
+    assert limiter.metrics()["throttled"] == 1
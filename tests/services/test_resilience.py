@@ -0,0 +1,87 @@
+# tests/services/test_resilience.py
+
+import time
+import pytest
+
+from services.resilience import (
+    CircuitBreaker, DeadlineExceeded, LatencyTracker, RetryPolicy, StageDeadlineExceeded, cap_timeout, remaining,
+    request_deadline, stage_deadline,
+)
+
+
+def test_stage_deadline_splits_remaining_budget():
+    """Тест: этап получает свою долю оставшегося бюджета, без дедлайна ограничений нет."""
+    assert remaining() is None
+    shares = {"classifier": 0.2, "retrieval": 0.2, "analysis": 0.2, "voting": 0.2, "answer": 0.2}
+    with request_deadline(10.0, shares):
+        with stage_deadline("classifier"):
+            assert remaining() == pytest.approx(2.0, abs=0.05)
+        with stage_deadline("answer"):
+            # Последний этап получает все оставшееся время
+            assert remaining() == pytest.approx(10.0, abs=0.05)
+        assert cap_timeout(15) == pytest.approx(10.0, abs=0.05)
+    assert remaining() is None
+    assert cap_timeout(15) == 15
+
+
+def test_cap_timeout_raises_after_deadline():
+    """Тест: после истечения бюджета новые операции не начинаются."""
+    with request_deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            cap_timeout(15)
+
+
+def test_stage_overrun_does_not_end_request():
+    """Тест: истечение доли этапа — StageDeadlineExceeded, истечение бюджета запроса — DeadlineExceeded."""
+    with request_deadline(10.0, {"classifier": 0.001, "answer": 0.999}):
+        with pytest.raises(StageDeadlineExceeded):
+            with stage_deadline("classifier"):
+                time.sleep(0.02)
+                cap_timeout(15)
+        assert remaining() > 9
+
+    with request_deadline(0.01):
+        with pytest.raises(DeadlineExceeded) as error:
+            with stage_deadline("answer"):
+                time.sleep(0.02)
+                cap_timeout(15)
+        assert not isinstance(error.value, StageDeadlineExceeded)
+
+
+def test_retry_policy_and_latency_tracker():
+    """Тест: задержка ограничена сверху и учитывает Retry-After; квантиль появляется после min_samples."""
+    policy = RetryPolicy(base_delay=0.5, max_delay=2.0)
+    assert all(0 <= policy.delay(attempt) <= 2.0 for attempt in range(10))
+    assert policy.delay(0, retry_after=1.5) >= 1.5
+
+    tracker = LatencyTracker(window=10, min_samples=5)
+    for value in range(1, 5):
+        tracker.observe("m", value)
+    assert tracker.quantile("m", 0.95) is None
+    for value in range(5, 21):
+        tracker.observe("m", value)
+    assert tracker.quantile("m", 0.5) == 16  # в окне остались последние 10 наблюдений
+
+
+def test_circuit_breaker_opens_and_recovers_through_half_open():
+    """Тест: предохранитель размыкается по доле ошибок и замыкается после успешного пробного вызова."""
+    now = [0.0]
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, reset_timeout=10, clock=lambda: now[0])
+    for _ in range(2):
+        breaker.record_success()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    now[0] = 10.0
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # одновременно допускается только один пробный вызов
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.metrics() == {"state": "closed", "failure_rate": 0.0, "rejected": 2, "opened": 2}
@@ -2,8 +2,15 @@
 
 import pytest
 import asyncio
+import threading
 from unittest.mock import MagicMock, AsyncMock
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from services.cache import SQLiteCache, TTLCache
+from services.resilience import CircuitBreaker, CircuitOpenError
 from services.retriever import AsyncPostRequest
+from services.single_flight import SingleFlight
+from services.tracing import REQUEST_ID_HEADER, request_context
 
 # Помечаем все тесты в этом модуле как асинхронные
 pytestmark = pytest.mark.asyncio
@@ -55,4 +62,201 @@ async def test_retriever_404_error(mock_aiohttp_session):
     retriever = AsyncPostRequest("http://fake-url.com")
     
     with pytest.raises(ValueError, match="Endpoint not found"):
-        await retriever(query="test", alias="bss.vip", endpoint="/query/")
\ No newline at end of file
+        await retriever(query="test", alias="bss.vip", endpoint="/query/")
+
+
+async def test_retriever_reuses_pooled_connections():
+    """
+    Тестирует, что последовательные запросы идут через одно keep-alive соединение.
+    """
+    async def handle_query(request):
+        body = await request.json()
+        return web.json_response({"ranking_dicts": [{"title": body["query"]}]})
+
+    app = web.Application()
+    app.router.add_post("/query/", handle_query)
+
+    async with TestServer(app) as server:
+        retriever = AsyncPostRequest(str(server.make_url("")), limit_per_host=4)
+        await retriever.start()
+        for i in range(3):
+            response = await retriever(query=f"q{i}", alias="bss.vip", endpoint="/query/")
+            assert response == {"ranking_dicts": [{"title": f"q{i}"}]}
+        stats = retriever.stats()
+        await retriever.close()
+
+    assert stats["requests"] == 3
+    assert stats["connections_created"] == 1
+    assert stats["connections_reused"] == 2
+
+
+async def test_retriever_breaker_fails_fast_and_serves_stale():
+    """
+    Тестирует деградацию: при недоступном сервисе отдается сохраненный ответ,
+    а после размыкания предохранителя запросы не отправляются вовсе.
+    """
+    healthy = True
+
+    async def handle_query(request):
+        body = await request.json()
+        if not healthy:
+            return web.json_response({"detail": "unavailable"}, status=503)
+        return web.json_response({"ranking_dicts": [{"title": body["query"]}]})
+
+    app = web.Application()
+    app.router.add_post("/query/", handle_query)
+
+    async with TestServer(app) as server:
+        retriever = AsyncPostRequest(
+            str(server.make_url("")),
+            breaker=CircuitBreaker(window=2, min_calls=2, failure_rate=1.0, reset_timeout=60),
+            stale_cache=TTLCache(max_size=10),
+        )
+        assert await retriever(query="q", alias="bss.vip", endpoint="/query/") == {"ranking_dicts": [{"title": "q"}]}
+
+        healthy = False
+        assert await retriever(query="q", alias="bss.vip", endpoint="/query/") == {"ranking_dicts": [{"title": "q"}]}
+        with pytest.raises(ValueError):
+            await retriever(query="new", alias="bss.vip", endpoint="/query/")
+
+        stats = retriever.stats()
+        assert stats["breaker"]["state"] == "open"
+        with pytest.raises(CircuitOpenError):
+            await retriever(query="new", alias="bss.vip", endpoint="/query/")
+        assert await retriever(query="q", alias="bss.vip", endpoint="/query/") == {"ranking_dicts": [{"title": "q"}]}
+        assert retriever.stats()["requests"] == stats["requests"]
+        await retriever.close()
+
+
+async def test_retriever_half_open_probe_with_malformed_body_reopens_breaker():
+    """Тестирует, что некорректный JSON в ответе пробного вызова снова размыкает предохранитель."""
+    now = [0.0]
+
+    async def handle_query(request):
+        return web.Response(text="{не json", content_type="application/json")
+
+    app = web.Application()
+    app.router.add_post("/query/", handle_query)
+
+    async with TestServer(app) as server:
+        breaker = CircuitBreaker(window=2, min_calls=1, reset_timeout=10, clock=lambda: now[0])
+        retriever = AsyncPostRequest(str(server.make_url("")), breaker=breaker)
+        breaker.record_failure()
+        now[0] = 10.0
+        assert breaker.state == "half_open"
+
+        with pytest.raises(ValueError):
+            await retriever(query="q", alias="bss.vip", endpoint="/query/")
+
+        assert breaker.state == "open"
+        await retriever.close()
+
+
+async def test_retriever_shared_stale_cache_between_workers(tmp_path):
+    """
+    Тестирует общий уровень кеша последних ответов: ответ, полученный одним
+    воркером, отдается другому при недоступности сервиса.
+    """
+    healthy = True
+
+    async def handle_query(request):
+        body = await request.json()
+        if not healthy:
+            return web.json_response({"detail": "unavailable"}, status=503)
+        return web.json_response({"ranking_dicts": [{"title": body["query"]}]})
+
+    app = web.Application()
+    app.router.add_post("/query/", handle_query)
+
+    path = str(tmp_path / "retrieval.sqlite")
+    async with TestServer(app) as server:
+        first = AsyncPostRequest(str(server.make_url("")), shared_stale_cache=SQLiteCache(path))
+        second = AsyncPostRequest(str(server.make_url("")), shared_stale_cache=SQLiteCache(path))
+        assert await first(query="q", alias="bss.vip", endpoint="/query/") == {"ranking_dicts": [{"title": "q"}]}
+        # Запись в общий кеш фоновая; close() дожидается ее
+        await first.close()
+
+        healthy = False
+        assert await second(query="q", alias="bss.vip", endpoint="/query/") == {"ranking_dicts": [{"title": "q"}]}
+        assert second.stats()["stale_responses"] == 1
+        await second.close()
+
+
+async def test_retriever_shared_write_does_not_delay_response(tmp_path):
+    """
+    Тестирует, что запись ответа в общий кеш выполняется в фоне и не задерживает ответ.
+    """
+    released = threading.Event()
+
+    class SlowCache(SQLiteCache):
+        def set(self, key, value, ttl=None):
+            released.wait(5)
+            super().set(key, value, ttl)
+
+    async def handle_query(request):
+        return web.json_response({"ranking_dicts": []})
+
+    app = web.Application()
+    app.router.add_post("/query/", handle_query)
+
+    async with TestServer(app) as server:
+        shared = SlowCache(str(tmp_path / "retrieval.sqlite"))
+        retriever = AsyncPostRequest(str(server.make_url("")), shared_stale_cache=shared)
+        response = await asyncio.wait_for(retriever(query="q", alias="bss.vip", endpoint="/query/"), timeout=1)
+        assert response == {"ranking_dicts": []}
+        assert len(shared) == 0
+
+        released.set()
+        await retriever.close()
+
+
+async def test_retriever_coalesces_identical_requests():
+    """
+    Тестирует, что одинаковые одновременные запросы отправляются на сервер один раз.
+    """
+    received = []
+
+    async def handle_query(request):
+        body = await request.json()
+        received.append(body["query"])
+        await asyncio.sleep(0.01)
+        return web.json_response({"ranking_dicts": [{"title": body["query"]}]})
+
+    app = web.Application()
+    app.router.add_post("/query/", handle_query)
+
+    async with TestServer(app) as server:
+        retriever = AsyncPostRequest(str(server.make_url("")), single_flight=SingleFlight())
+        responses = await asyncio.gather(
+            *(retriever(query="q", alias="bss.vip", endpoint="/query/") for _ in range(3)),
+            retriever(query="other", alias="bss.vip", endpoint="/query/"),
+        )
+        stats = retriever.stats()
+        await retriever.close()
+
+    assert responses[0] == responses[2] == {"ranking_dicts": [{"title": "q"}]}
+    assert sorted(received) == ["other", "q"]
+    assert stats["single_flight"]["collapsed"] == 2
+
+
+async def test_retriever_propagates_request_id():
+    """
+    Тестирует, что идентификатор текущего запроса передается сервису поиска в заголовке.
+    """
+    received = []
+
+    async def handle_query(request):
+        received.append(request.headers.get(REQUEST_ID_HEADER))
+        return web.json_response({"ranking_dicts": []})
+
+    app = web.Application()
+    app.router.add_post("/query/", handle_query)
+
+    async with TestServer(app) as server:
+        retriever = AsyncPostRequest(str(server.make_url("")))
+        with request_context("req-42"):
+            await retriever(query="q", alias="bss.vip", endpoint="/query/", headers={"Authorization": "Bearer t"})
+        await retriever(query="q", alias="bss.vip", endpoint="/query/")
+        await retriever.close()
+
+    assert received == ["req-42", None]
@@ -0,0 +1,55 @@
+# tests/services/test_single_flight.py
+
+import asyncio
+import pytest
+
+from services.single_flight import SingleFlight
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_single_flight_collapses_concurrent_calls():
+    """Тест: одновременные вызовы с одним ключом выполняются один раз, с разными — отдельно."""
+    flight = SingleFlight()
+    calls = []
+
+    async def compute(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"результат {key}"
+
+    results = await asyncio.gather(
+        *(flight.do("a", lambda: compute("a")) for _ in range(5)),
+        flight.do("b", lambda: compute("b")),
+    )
+
+    assert results == ["результат a"] * 5 + ["результат b"]
+    assert calls == ["a", "b"]
+    assert flight.metrics()["collapsed"] == 4
+    assert flight.metrics()["in_flight"] == 0
+
+    # Завершившийся вызов не кешируется
+    await flight.do("a", lambda: compute("a"))
+    assert calls == ["a", "b", "a"]
+
+
+async def test_single_flight_shares_errors_and_survives_cancelled_waiter():
+    """Тест: исключение получают все ожидающие; отмена одного не прерывает вычисление для других."""
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "готово"
+
+    first = asyncio.ensure_future(flight.do("s", slow))
+    second = asyncio.ensure_future(flight.do("s", slow))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "готово"
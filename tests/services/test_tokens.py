@@ -0,0 +1,61 @@
+# tests/services/test_tokens.py
+
+import asyncio
+import threading
+import pytest
+
+from services.tokens import TokenCounter, preload_encodings, record_tokens, track_token_usage
+
+
+def test_estimate_without_tokenizer():
+    """Тест: без tiktoken токены оцениваются по числу символов."""
+    counter = TokenCounter(chars_per_token=3.0, use_tiktoken=False)
+
+    assert not counter.exact
+    assert counter.count("") == 0
+    assert counter.count("абвг") == 2
+    assert counter.truncate("абвгдеж", 2) == "абвгде"
+
+
+@pytest.mark.asyncio
+async def test_usage_is_tracked_per_request_across_tasks():
+    """Тест: учет ведется в словаре запроса, в том числе из дочерних задач."""
+    async def stage(name):
+        await asyncio.sleep(0)
+        record_tokens(name, 10)
+
+    async def request(usage):
+        with track_token_usage(usage):
+            await asyncio.gather(stage("analysis_prompt"), asyncio.ensure_future(stage("analysis_prompt")))
+            record_tokens("context", 5)
+
+    first, second = {}, {}
+    await asyncio.gather(request(first), request(second))
+    record_tokens("context", 100)  # вне запроса учет не ведется
+
+    assert first == second == {"analysis_prompt": 20, "context": 5}
+
+
+def test_encoding_loaded_lazily(mocker):
+    """Тест: кодировка tiktoken загружается при первом подсчете; ошибка загрузки — переход на оценку."""
+    get_encoding = mocker.patch("services.tokens._get_encoding", return_value=None)
+
+    counter = TokenCounter("openai/gpt-4o-mini", chars_per_token=3.0)
+    get_encoding.assert_not_called()
+
+    assert counter.count("абвг") == 2
+    assert counter.count("абвгдеж") == 3
+    get_encoding.assert_called_once_with("openai/gpt-4o-mini")
+
+
+@pytest.mark.asyncio
+async def test_preload_encodings_off_event_loop(mocker):
+    """Тест: кодировки загружаются заранее в отдельном потоке, по одному разу на модель."""
+    threads = []
+    get_encoding = mocker.patch("services.tokens._get_encoding",
+                                side_effect=lambda model: threads.append(threading.get_ident()))
+
+    await preload_encodings(["openai/gpt-4o-mini", "openai/gpt-4o", "openai/gpt-4o-mini"])
+
+    assert [call.args[0] for call in get_encoding.call_args_list] == ["openai/gpt-4o-mini", "openai/gpt-4o"]
+    assert threading.get_ident() not in threads
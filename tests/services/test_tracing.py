@@ -0,0 +1,86 @@
+# tests/services/test_tracing.py
+
+import json
+import asyncio
+import pytest
+
+from services import tracing
+from services.metrics import timed_stage
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def exporter():
+    """Включает трассировку в память процесса на время теста."""
+    exporter = tracing.InMemorySpanExporter()
+    previous = tracing.set_exporter(exporter)
+    yield exporter
+    tracing.set_exporter(previous)
+
+
+async def test_spans_nest_across_tasks_and_share_request_id(exporter):
+    """Тест: этапы и дочерние задачи попадают в одну трассу с trace_id = идентификатор запроса."""
+    @timed_stage("analysis")
+    async def analysis():
+        with tracing.span("llm.create", model="m"):
+            await asyncio.sleep(0)
+
+    @timed_stage("retrieval")
+    async def retrieval():
+        await asyncio.gather(*(asyncio.ensure_future(fetch(i)) for i in range(2)))
+
+    async def fetch(i):
+        with tracing.span("retriever.post", query=f"q{i}"):
+            await asyncio.sleep(0)
+
+    with tracing.request_context("req-1"):
+        with tracing.span("bot_pipeline") as root:
+            await retrieval()
+            with pytest.raises(RuntimeError):
+                with tracing.span("failing"):
+                    raise RuntimeError("boom")
+            await analysis()
+
+    assert {span.trace_id for span in exporter.spans} == {"req-1"}
+    retrieval_span = exporter.find("retrieval")[0]
+    assert [span.parent_id for span in exporter.find("retriever.post")] == [retrieval_span.span_id] * 2
+    assert retrieval_span.parent_id == root.span_id
+    assert exporter.find("llm.create")[0].parent_id == exporter.find("analysis")[0].span_id
+    assert exporter.find("failing")[0].status == "error"
+    assert tracing.current_request_id() == ""
+
+
+async def test_disabled_tracing_and_file_exporter(tmp_path):
+    """Тест: по умолчанию span'ы не создаются; файловый получатель пишет JSONL."""
+    with tracing.span("noop") as current:
+        assert current is None
+
+    path = tmp_path / "spans.jsonl"
+    previous = tracing.set_exporter(tracing.build_exporter("file", str(path)))
+    try:
+        with tracing.request_context() as request_id:
+            with tracing.span("stage", alias="bss.vip"):
+                pass
+    finally:
+        tracing.set_exporter(previous).close()
+
+    record = json.loads(path.read_text(encoding="utf-8").strip())
+    assert record["name"] == "stage" and record["trace_id"] == request_id
+    assert record["attributes"] == {"alias": "bss.vip"}
+    with pytest.raises(ValueError):
+        tracing.build_exporter("jaeger")
+
+
+async def test_file_exporter_writes_in_background(tmp_path):
+    """Тест: файловый получатель пишет span'ы в фоновом потоке и дописывает очередь при закрытии."""
+    path = tmp_path / "spans.jsonl"
+    exporter = tracing.FileSpanExporter(str(path), batch_size=7)
+    assert exporter._thread is None  # без span'ов поток не запускается
+
+    for i in range(50):
+        exporter.export(tracing.Span(name=f"span-{i}", trace_id="t", span_id=str(i)))
+    exporter.close()
+
+    names = [json.loads(line)["name"] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert names == [f"span-{i}" for i in range(50)]
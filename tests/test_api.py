@@ -1,15 +1,16 @@
 # tests/test_api.py
 
 from fastapi.testclient import TestClient
-from main import app, get_classifier_agent, get_search_agent
+from main import app, get_classifier_agent, get_search_agent, get_parameters, worker_count
+from core.data_types import Parameters
 from agents.classifying_agent import ClassifierAgent
 from agents.search_agent import SearchAgent
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 
 # --- Моки для агентов ---
 
-# Мок для классификатора
-mock_classifier_agent = MagicMock(spec=ClassifierAgent)
+# Мок для классификатора (вызов агента асинхронный)
+mock_classifier_agent = AsyncMock()
 
 # Мок для поискового агента
 # Для асинхронных методов нужно использовать AsyncMock или настроить __call__
@@ -35,6 +36,7 @@ def override_get_searcher():
 # Переопределяем зависимости в приложении FastAPI
 app.dependency_overrides[get_classifier_agent] = override_get_classifier
 app.dependency_overrides[get_search_agent] = override_get_searcher
+app.dependency_overrides[get_parameters] = Parameters
 
 # Создаем тестовый клиент
 client = TestClient(app)
@@ -68,4 +70,45 @@ def test_process_query_search_fail():
     
     # Ожидаем ошибку 404, как определено в эндпоинте
     assert response.status_code == 404
-    assert response.json() == {"detail": "No answer found"}
\ No newline at end of file
+    assert response.json() == {"detail": "No answer found"}
+
+
+def test_process_query_stream_sse():
+    """Тестирует потоковый эндпоинт: фрагменты приходят событиями SSE."""
+    mock_classifier_agent.return_value = "3"
+
+    async def stream_answer(memory):
+        for chunk in ["Ответ ", "про НДС"]:
+            yield chunk
+
+    mock_search_agent.retrieve = AsyncMock(return_value=object())
+    mock_search_agent.stream_answer = stream_answer
+
+    response = client.post("/expert_bot/stream/", json={"query": "вопрос про НДС", "alias": "bss.vip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        'data: {"delta": "Ответ "}\n\n'
+        'data: {"delta": "про НДС"}\n\n'
+        'event: done\ndata: {"answer": "Ответ про НДС", "found": true}\n\n'
+    )
+
+
+def test_metrics_endpoint_exports_stage_latency():
+    """Тестирует, что /metrics отдает метрики этапов в формате Prometheus."""
+    mock_classifier_agent.return_value = "3"
+
+    client.post("/expert_bot/", json={"query": "вопрос про НДС", "alias": "bss.test"})
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE expert_bot_stage_duration_seconds histogram" in response.text
+
+
+def test_worker_count_defaults_to_cores(monkeypatch):
+    """Тест: 0 воркеров означает число ядер, явное значение сохраняется."""
+    monkeypatch.setattr("os.cpu_count", lambda: 6)
+    assert worker_count(0) == 6
+    assert worker_count(3) == 3
@@ -1,8 +1,20 @@
 # utils/utils.py
 
+import re
 import functools
 import multiprocessing.pool
 
+def normalize_query(text: str) -> str:
+    """
+    Нормализует текст запроса для сравнения и построения ключей кеша:
+    нижний регистр, ё -> е, схлопывание пробелов.
+
+    :param text: Исходный текст.
+    :return: Нормализованный текст.
+    """
+    text = text.lower().replace("ё", "е").replace("\xa0", " ")
+    return re.sub(r"\s+", " ", text).strip()
+
 def build_document_link(alias: str, module_id: str, document_id: str, alias_to_site: dict) -> str:
     """
     Собирает URL-адрес документа на основе его идентификаторов и алиаса сайта.